@@ -1,11 +1,46 @@
 # -*- coding: utf-8 -*-
+import base64
+import click
+import collections
+import concurrent.futures
+import contextlib
+import dbm
+import hashlib
 import flask
 import flask_login
+import gzip
+import json
+import markupsafe
+import mimetypes
 import mysql.connector
 import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import weakref
+import werkzeug.exceptions
+import werkzeug.http
+import werkzeug.security
 import xml.etree.ElementTree as ET
-from datetime import datetime
+from datetime import UTC, datetime
 from flask import g
+from typing import ClassVar
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # previews of images are disabled without Pillow
+    Image = None
+try:
+    import fcntl
+except ImportError:  # Windows: sector locks only cover threads
+    fcntl = None
+try:
+    import brotli
+except ImportError:  # static assets are precompressed with gzip only
+    brotli = None
 
 app: flask.Flask = flask.Flask(
     __name__, template_folder="../templates", static_folder="../static"
@@ -13,28 +48,198 @@ app: flask.Flask = flask.Flask(
 app.secret_key = "wielkiedildo33cm"
 
 
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "password": "",
+    "database": "bigbag",
+    "autocommit": True,
+}
+
+# Tunables; override with e.g. FLASK_DB_POOL_SIZE=10 in the environment.
+app.config.from_mapping(
+    DB_POOL_SIZE=5,
+    DB_POOL_MAX_OVERFLOW=10,
+    DB_POOL_RECYCLE=1800,
+    DB_POOL_TIMEOUT=10,
+    USER_CACHE_TTL=300,
+    USER_CACHE_SIZE=1024,
+    ATTACHMENT_STORAGE="filesystem",
+    ATTACHMENT_MAX_SIZE=10 * 1024 * 1024,
+    # whole request body: one attachment plus the form fields
+    MAX_CONTENT_LENGTH=11 * 1024 * 1024,
+    PREVIEW_CACHE_MAX_BYTES=512 * 1024 * 1024,
+    EXPORT_WORKER_ENABLED=True,
+    EXPORT_WORKER_POLL_INTERVAL=5,
+    EXPORT_WORKER_BATCH_SIZE=500,
+    BULK_DECISION_MAX=500,
+    CHANGE_FEED_POLL_INTERVAL=2,
+    CHANGE_FEED_HEARTBEAT=15,
+    API_PAGE_SIZE=50,
+    API_MAX_PAGE_SIZE=200,
+    API_GZIP_MIN_BYTES=1024,
+    COMPRESS_ENABLED=True,
+    COMPRESS_MIN_SIZE=1024,
+    COMPRESS_LEVEL=6,
+    COMPRESS_BR_QUALITY=5,
+)
+app.config.from_prefixed_env()
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection becomes available in time."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of MySQL connections.
+
+    Keeps up to `size` idle connections and allows `max_overflow` extra
+    connections under load; overflow connections are closed on check-in.
+    Connections older than `recycle` seconds are replaced on checkout and
+    every reused connection is pinged once (without retries or sleeps)
+    before it is handed out.
+    """
+
+    def __init__(self, size=5, max_overflow=10, recycle=1800, timeout=10):
+        self.size = int(size)
+        self.max_overflow = int(max_overflow)
+        self.recycle = float(recycle)
+        self.timeout = float(timeout)
+        self._idle = collections.deque()
+        self._born = {}
+        self._open = 0
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._checkouts = 0
+        self._failures = 0
+        self._replaced = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        conn = mysql.connector.connect(**DB_CONFIG)
+        self._born[id(conn)] = time.monotonic()
+        return conn
+
+    def _close(self, conn):
+        self._born.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _usable(self, conn) -> bool:
+        born = self._born.get(id(conn), 0.0)
+        if time.monotonic() - born > self.recycle:
+            return False
+        try:
+            return conn.is_connected()
+        except Exception:
+            return False
+
+    def checkout(self):
+        """Return a healthy connection, waiting up to `timeout` seconds."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._open < self.size + self.max_overflow:
+                    # reserve a slot; the connection is opened below
+                    self._open += 1
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._failures += 1
+                    raise PoolTimeout(
+                        f"no connection available after {self.timeout}s"
+                    )
+                self._cond.wait(remaining)
+            self._in_use += 1
+
+        try:
+            if conn is not None and not self._usable(conn):
+                self._close(conn)
+                self._replaced += 1
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._failures += 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - started
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return conn
+
+    def checkin(self, conn):
+        """Return a connection to the pool, rolling back open transactions."""
+        keep = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except Exception:
+            keep = False
+        with self._cond:
+            self._in_use -= 1
+            if not keep or len(self._idle) >= self.size:
+                self._open -= 1
+            else:
+                self._idle.append(conn)
+                conn = None
+            self._cond.notify()
+        if conn is not None:
+            self._close(conn)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "open": self._open,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "checkouts": self._checkouts,
+                "checkout_failures": self._failures,
+                "replaced": self._replaced,
+                "wait_time_avg_ms": round(
+                    1000 * self._wait_total / max(1, self._checkouts), 3
+                ),
+                "wait_time_max_ms": round(1000 * self._wait_max, 3),
+            }
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = ConnectionPool(
+                    size=app.config["DB_POOL_SIZE"],
+                    max_overflow=app.config["DB_POOL_MAX_OVERFLOW"],
+                    recycle=app.config["DB_POOL_RECYCLE"],
+                    timeout=app.config["DB_POOL_TIMEOUT"],
+                )
+    return _db_pool
+
+
 def get_db():
     if "db" not in g:
-        g.db = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",
-            database="bigbag",
-            autocommit=True,
-        )
-        print("Established new DB connection")
-    else:
-        try:
-            g.db.ping(reconnect=True, attempts=3, delay=2)
-        except mysql.connector.Error:
-            g.db = mysql.connector.connect(
-                host="localhost",
-                user="root",
-                password="",
-                database="mydb",
-                autocommit=True,
-            )
-            print("Re-established DB connection after ping failure")
+        g.db = get_pool().checkout()
     return g.db
 
 
@@ -42,16 +247,260 @@ def get_db():
 def close_db(exception):
     db = g.pop("db", None)
     if db is not None:
-        db.close()
+        get_pool().checkin(db)
+
+
+### Schema upgrades
+# Statements are applied in order by `flask upgrade-db`. They must be safe to
+# re-run: "already exists" errors are reported and skipped.
+SCHEMA_UPGRADES = [
+    """
+    CREATE TABLE IF NOT EXISTS estate_year_quota (
+        id_estate INT NOT NULL,
+        year SMALLINT NOT NULL,
+        bag_total INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (id_estate, year)
+    )
+    """,
+    "ALTER TABLE application ADD COLUMN free_bags INT NULL",
+    "ALTER TABLE application ADD COLUMN paid_bags INT NULL",
+    (
+        "CREATE INDEX idx_application_estate_created "
+        "ON application (id_estate, creation_date, id_application)"
+    ),
+    (
+        "CREATE INDEX idx_application_created "
+        "ON application (creation_date, id_application)"
+    ),
+    (
+        "CREATE INDEX idx_application_citizen_created "
+        "ON application (id_citizen, creation_date, id_application)"
+    ),
+    """
+    CREATE TABLE IF NOT EXISTS application_search (
+        id_application INT NOT NULL PRIMARY KEY,
+        document TEXT NOT NULL,
+        FULLTEXT KEY ft_application_search (document)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS application_status_count (
+        id_citizen INT NOT NULL,
+        status VARCHAR(32) NOT NULL,
+        cnt INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (id_citizen, status)
+    )
+    """,
+    "ALTER TABLE attachment ADD COLUMN content_hash CHAR(64) NULL",
+    "ALTER TABLE attachment ADD COLUMN file_size BIGINT NULL",
+    "ALTER TABLE attachment MODIFY file_data LONGBLOB NULL",
+    "CREATE INDEX idx_attachment_hash ON attachment (content_hash)",
+    """
+    CREATE TABLE IF NOT EXISTS export_outbox (
+        id_job BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        id_application INT NOT NULL,
+        action VARCHAR(16) NOT NULL,
+        attempts INT NOT NULL DEFAULT 0,
+        last_error TEXT NULL,
+        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        next_attempt_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        done_at DATETIME NULL,
+        KEY idx_export_outbox_due (done_at, next_attempt_at),
+        KEY idx_export_outbox_app (id_application, done_at)
+    )
+    """,
+    "ALTER TABLE application ADD COLUMN prev_status VARCHAR(32) NULL",
+    "ALTER TABLE export_outbox ADD COLUMN status VARCHAR(32) NULL",
+    """
+    CREATE TABLE IF NOT EXISTS application_status_history (
+        id_history BIGINT NOT NULL AUTO_INCREMENT PRIMARY KEY,
+        id_application INT NOT NULL,
+        old_status VARCHAR(32) NULL,
+        new_status VARCHAR(32) NOT NULL,
+        changed_by INT NULL,
+        changed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        KEY idx_status_history_app (id_application, changed_at)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS application_change (
+        seq BIGINT NOT NULL PRIMARY KEY,
+        id_application INT NOT NULL,
+        kind VARCHAR(16) NOT NULL,
+        changed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS application_change_seq (
+        id TINYINT NOT NULL PRIMARY KEY,
+        seq BIGINT NOT NULL
+    )
+    """,
+    # seed the quota ledger from existing applications; recomputing the
+    # totals makes this safe to re-run
+    """
+    INSERT INTO estate_year_quota (id_estate, year, bag_total)
+    SELECT id_estate, YEAR(creation_date), COALESCE(SUM(bag_count), 0)
+    FROM application
+    WHERE id_estate IS NOT NULL AND creation_date IS NOT NULL
+    GROUP BY id_estate, YEAR(creation_date)
+    ON DUPLICATE KEY UPDATE bag_total = VALUES(bag_total)
+    """,
+    # index existing applications for search (same document as
+    # _SEARCH_DOCUMENT_SQL); safe to re-run
+    """
+    INSERT INTO application_search (id_application, document)
+    SELECT a.id_application,
+        CONCAT_WS(' ', e.street, e.building_number, e.apartment_number,
+            c.first_name, c.last_name, c.email)
+    FROM application a
+    LEFT JOIN estate e ON a.id_estate = e.id_estate
+    LEFT JOIN citizen c ON a.id_citizen = c.id_citizen
+    ON DUPLICATE KEY UPDATE document = VALUES(document)
+    """,
+    # seed the per-status counters (per citizen and the id_citizen = 0
+    # totals); recomputing them makes this safe to re-run
+    """
+    INSERT INTO application_status_count (id_citizen, status, cnt)
+    SELECT id_citizen, status, COUNT(*) FROM application
+    WHERE id_citizen IS NOT NULL AND status IS NOT NULL
+    GROUP BY id_citizen, status
+    UNION ALL
+    SELECT 0, status, COUNT(*) FROM application
+    WHERE status IS NOT NULL
+    GROUP BY status
+    ON DUPLICATE KEY UPDATE cnt = VALUES(cnt)
+    """,
+    # start the change-feed sequence after any existing change rows
+    """
+    INSERT INTO application_change_seq (id, seq)
+    SELECT 1, COALESCE(MAX(seq), 0) FROM application_change
+    ON DUPLICATE KEY UPDATE seq = GREATEST(seq, VALUES(seq))
+    """,
+    # API listings join estate and citizen columns and are tagged with the
+    # change seq, so edits to those rows have to move it too
+    """
+    CREATE TRIGGER estate_change_seq AFTER UPDATE ON estate
+    FOR EACH ROW
+    UPDATE application_change_seq SET seq = seq + 1 WHERE id = 1
+    """,
+    """
+    CREATE TRIGGER citizen_change_seq AFTER UPDATE ON citizen
+    FOR EACH ROW
+    UPDATE application_change_seq SET seq = seq + 1 WHERE id = 1
+    """,
+]
+
+# duplicate column / duplicate key name / table exists / trigger exists
+_SCHEMA_ALREADY_APPLIED = (1060, 1061, 1050, 1359)
+
+
+@app.cli.command("upgrade-db")
+def upgrade_db_command():
+    """Apply SCHEMA_UPGRADES to the configured database."""
+    db = get_db()
+    cur = db.cursor()
+    try:
+        for stmt in SCHEMA_UPGRADES:
+            summary = " ".join(stmt.split())[:72]
+            try:
+                cur.execute(stmt)
+                click.echo(f"applied: {summary}")
+            except mysql.connector.Error as err:
+                if err.errno not in _SCHEMA_ALREADY_APPLIED:
+                    raise
+                click.echo(f"skipped: {summary} ({err.msg})")
+        # DDL commits implicitly, the seed statements do not
+        db.commit()
+    finally:
+        cur.close()
+
+
+FREE_BAGS_PER_ESTATE_YEAR = 1
+
+
+def _year_bounds(creation) -> tuple[datetime, datetime] | None:
+    """Return the [start, end) datetimes of the calendar year of `creation`."""
+    try:
+        year = creation.year
+    except AttributeError:
+        try:
+            year = datetime.fromisoformat(str(creation)).year
+        except Exception:
+            return None
+    return datetime(year, 1, 1), datetime(year + 1, 1, 1)
+
+
+def _split_bags(prior_bags, bag_count) -> tuple[int, int]:
+    """Split `bag_count` into (free, paid) given bags already used this year."""
+    prior_bags = int(prior_bags or 0)
+    free_remaining = max(0, FREE_BAGS_PER_ESTATE_YEAR - prior_bags)
+    free_for_this = min(free_remaining, bag_count)
+    return free_for_this, bag_count - free_for_this
+
+
+def _fetch_prior_bags(db, applications: list) -> dict:
+    """Return {id_application: prior_bags} for a batch of applications.
+
+    One windowed query covers the whole batch: every (estate, year) pair in
+    the batch contributes a sargable `creation_date` range instead of a
+    `YEAR()` call, and the running sum over earlier applications of the
+    same estate and year is computed by MySQL in a single pass.
+    """
+    ranges = {}
+    app_ids = []
+    for a in applications:
+        bounds = _year_bounds(a.get("creation_date"))
+        if a.get("id_application") is None or bounds is None:
+            continue
+        app_ids.append(a["id_application"])
+        ranges[(a.get("id_estate"), bounds)] = None
+    if not app_ids:
+        return {}
+
+    range_sql = " OR ".join(
+        ["(id_estate = %s AND creation_date >= %s AND creation_date < %s)"]
+        * len(ranges)
+    )
+    params = []
+    for estate_id, (year_start, year_end) in ranges:
+        params.extend([estate_id, year_start, year_end])
+    id_sql = ",".join(["%s"] * len(app_ids))
+    params.extend(app_ids)
+
+    sql = f"""
+        SELECT w.id_application, w.prior_bags FROM (
+            SELECT id_application,
+                COALESCE(SUM(bag_count) OVER (
+                    PARTITION BY id_estate, YEAR(creation_date)
+                    ORDER BY creation_date, id_application
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                ), 0) AS prior_bags
+            FROM application
+            WHERE {range_sql}
+        ) w
+        WHERE w.id_application IN ({id_sql})
+        """
+    cur = db.cursor(dictionary=True)
+    try:
+        cur.execute(sql, tuple(params))
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    return {r["id_application"]: r["prior_bags"] for r in rows}
 
 
 def compute_free_paid(applications):
-    """Compute free_bags and paid_bags for each application in the list."""
+    """Compute free_bags and paid_bags for each application in the list.
+
+    Rows are converted to dicts in place so callers observe the computed
+    keys. Rows that already carry the split stored at submission time are
+    left alone; the rest are allocated together with a single query (see
+    `_fetch_prior_bags`). If the database is unavailable every bag is
+    reported as paid.
+    """
     if not applications:
-        print("compute_free_paid: no applications provided")
         return
-    # Ensure we modify the original list in-place so callers observe the changes.
-    # Convert non-dict rows to dicts but replace the element in the original list.
     for i, item in enumerate(applications):
         if not isinstance(item, dict):
             try:
@@ -59,88 +508,177 @@ def compute_free_paid(applications):
             except Exception:
                 # leave the original item if conversion fails
                 pass
-
-    try:
-        db = get_db()
-        sum_cur = db.cursor(dictionary=True)
-    except Exception:
-        # DB not available; ensure defaults exist and exit
-        for a in applications:
-            try:
-                if isinstance(a, dict):
-                    a.setdefault("free_bags", 0)
-                    a.setdefault("paid_bags", int(a.get("bag_count") or 0))
-            except Exception:
-                pass
+    # rows written after the quota ledger was introduced carry their split
+    rows = [
+        a
+        for a in applications
+        if isinstance(a, dict)
+        and (a.get("free_bags") is None or a.get("paid_bags") is None)
+    ]
+    if not rows:
         return
 
     try:
-        for a in applications:
-            # operate on the dict stored in the list (may already be a dict)
-            if not isinstance(a, dict):
-                # if conversion didn't happen above, try to make a minimal dict
-                try:
-                    a = dict(a)
-                except Exception:
-                    continue
+        prior_map = _fetch_prior_bags(get_db(), rows)
+    except Exception as e:
+        print("compute_free_paid: allocation query failed:", e)
+        prior_map = None
 
-            estate_id = a.get("id_estate")
-            creation = a.get("creation_date")
-            app_id = a.get("id_application")
-            try:
-                bag_count = int(a.get("bag_count") or 0)
-            except Exception:
-                bag_count = 0
+    for a in rows:
+        try:
+            bag_count = int(a.get("bag_count") or 0)
+        except Exception:
+            bag_count = 0
+        if prior_map is None or a.get("id_application") not in prior_map:
+            a["free_bags"] = 0
+            a["paid_bags"] = bag_count
+            continue
+        a["free_bags"], a["paid_bags"] = _split_bags(
+            prior_map[a["id_application"]], bag_count
+        )
 
-            sum_sql = (
-                "SELECT COALESCE(SUM(bag_count),0) as prior_bags "
-                "FROM application "
-                "WHERE id_estate = %s AND YEAR(creation_date) = YEAR(%s) "
-                "AND (creation_date < %s OR (creation_date = %s AND id_application < %s))"
-            )
-            try:
-                sum_cur.execute(
-                    sum_sql,
-                    (estate_id, creation, creation, creation, app_id),
-                )
-                srow = sum_cur.fetchone()
-                prior_bags = (
-                    srow["prior_bags"] if srow and "prior_bags" in srow else 0
-                )
-            except Exception:
-                prior_bags = 0
 
-            free_remaining = max(0, 1 - int(prior_bags or 0))
-            free_for_this = min(free_remaining, bag_count)
-            paid_for_this = bag_count - free_for_this
+def _reserve_bags(cur, estate_id, bag_count: int):
+    """Charge `bag_count` bags to the estate's yearly quota ledger.
 
-            # write back into the list element
-            try:
-                a["free_bags"] = free_for_this
-                a["paid_bags"] = paid_for_this
-            except Exception:
-                # if a isn't mutable, try to replace the whole element
-                try:
-                    idx = applications.index(a)
-                    applications[idx] = {
-                        **(a if isinstance(a, dict) else {}),
-                        "free_bags": free_for_this,
-                        "paid_bags": paid_for_this,
-                    }
-                except Exception:
-                    pass
+    Must run inside the transaction that inserts the application: the
+    ledger row is locked until commit so concurrent submissions for the same
+    estate are serialized. The creation timestamp is taken only once the
+    lock is held, so splits follow the (creation_date, id_application)
+    order that `quota-rebuild` replays. Returns (free, paid, creation_date).
+    """
+    year = datetime.now().year
+    while True:
+        cur.execute(
+            "INSERT INTO estate_year_quota (id_estate, year, bag_total) "
+            "VALUES (%s, %s, 0) ON DUPLICATE KEY UPDATE bag_total = bag_total",
+            (estate_id, year),
+        )
+        cur.execute(
+            "SELECT bag_total FROM estate_year_quota "
+            "WHERE id_estate = %s AND year = %s FOR UPDATE",
+            (estate_id, year),
+        )
+        row = cur.fetchone()
+        creation_date = datetime.now().replace(microsecond=0)
+        if creation_date.year == year:
+            break
+        # the year rolled over while waiting for the lock
+        year = creation_date.year
+    prior_bags = row[0] if row else 0
+    cur.execute(
+        "UPDATE estate_year_quota SET bag_total = bag_total + %s "
+        "WHERE id_estate = %s AND year = %s",
+        (bag_count, estate_id, year),
+    )
+    free, paid = _split_bags(prior_bags, bag_count)
+    return free, paid, creation_date
+
+
+@app.cli.command("quota-rebuild")
+@click.option(
+    "--verify", is_flag=True, help="Only report drift, do not write."
+)
+def quota_rebuild_command(verify):
+    """Recompute the estate quota ledger and stored bag splits from history.
+
+    Without --verify the ledger rows are locked before the totals are
+    read, so submissions wait for the rebuild instead of committing
+    between the read and the replacement (and being lost from the ledger).
+    """
+    db = get_db()
+    cur = db.cursor(dictionary=True)
+    try:
+        if not verify:
+            db.start_transaction()
+            # a locking read over the whole ledger also locks the gaps, so
+            # submissions for new (estate, year) rows block as well
+            cur.execute("SELECT id_estate FROM estate_year_quota FOR UPDATE")
+            cur.fetchall()
+        cur.execute(
+            "SELECT id_estate, YEAR(creation_date) AS year, "
+            "SUM(bag_count) AS bag_total FROM application "
+            "WHERE id_estate IS NOT NULL AND creation_date IS NOT NULL "
+            "GROUP BY id_estate, YEAR(creation_date)"
+        )
+        expected = {
+            (r["id_estate"], r["year"]): int(r["bag_total"] or 0)
+            for r in cur.fetchall()
+        }
+        cur.execute("SELECT id_estate, year, bag_total FROM estate_year_quota")
+        stored = {
+            (r["id_estate"], r["year"]): int(r["bag_total"] or 0)
+            for r in cur.fetchall()
+        }
+        ledger_drift = [
+            (key, stored.get(key), expected.get(key))
+            for key in sorted(set(expected) | set(stored), key=str)
+            if stored.get(key) != expected.get(key)
+        ]
+        for (estate_id, year), have, want in ledger_drift:
+            click.echo(
+                f"ledger drift: estate={estate_id} year={year} "
+                f"stored={have} expected={want}"
+            )
+
+        cur.execute(
+            """
+            SELECT id_application, bag_count, free_bags, paid_bags,
+                COALESCE(SUM(bag_count) OVER (
+                    PARTITION BY id_estate, YEAR(creation_date)
+                    ORDER BY creation_date, id_application
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                ), 0) AS prior_bags
+            FROM application
+            """
+        )
+        split_drift = []
+        for r in cur.fetchall():
+            free, paid = _split_bags(r["prior_bags"], int(r["bag_count"] or 0))
+            if (r["free_bags"], r["paid_bags"]) != (free, paid):
+                split_drift.append((free, paid, r["id_application"]))
+        click.echo(
+            f"ledger rows drifted: {len(ledger_drift)}, "
+            f"application splits drifted: {len(split_drift)}"
+        )
+        if verify:
+            if ledger_drift or split_drift:
+                raise SystemExit(1)
+            return
+
+        cur.execute("DELETE FROM estate_year_quota")
+        if expected:
+            cur.executemany(
+                "INSERT INTO estate_year_quota "
+                "(id_estate, year, bag_total) VALUES (%s, %s, %s)",
+                [(e, y, t) for (e, y), t in expected.items()],
+            )
+        if split_drift:
+            cur.executemany(
+                "UPDATE application SET free_bags = %s, paid_bags = %s "
+                "WHERE id_application = %s",
+                split_drift,
+            )
+        db.commit()
+        click.echo("ledger rebuilt")
+    except Exception:
+        if not verify:
+            db.rollback()
+        raise
     finally:
-        sum_cur.close()
+        cur.close()
 
 
 class User(flask_login.UserMixin):
     """Represents a user for authentication purposes."""
 
-    def __init__(self, id: str, type: str) -> None:
+    def __init__(self, id: str, type: str, first_name: str | None = None):
         super().__init__()
         self.id = id
         self.type: str = type
-        self.first_name: str = self._get_first_name()
+        self.first_name: str = (
+            first_name if first_name is not None else self._get_first_name()
+        )
 
     @staticmethod
     def get(user_id: str, type: str) -> "User | None":
@@ -148,28 +686,30 @@ class User(flask_login.UserMixin):
         cursor = db.cursor(dictionary=True)
         if type == "citizen":
             cursor.execute(
-                "SELECT id_citizen FROM citizen WHERE id_citizen = %s",
+                "SELECT id_citizen, first_name FROM citizen "
+                "WHERE id_citizen = %s",
                 (user_id,),
             )
         else:
             cursor.execute(
-                "SELECT id_employee FROM employee WHERE id_employee = %s",
+                "SELECT id_employee, first_name FROM employee "
+                "WHERE id_employee = %s",
                 (user_id,),
             )
         result = cursor.fetchone()
         cursor.close()
         if result:
+            first_name = result["first_name"] or "BRAK IMIENIA"
             if type == "citizen":
-                return User(str(result["id_citizen"]), "citizen")
+                return User(str(result["id_citizen"]), "citizen", first_name)
             else:
-                return User(str(result["id_employee"]), "employee")
+                return User(str(result["id_employee"]), "employee", first_name)
         return None
 
     def _get_first_name(self) -> str:
         """Return the first name of the user."""
         db = get_db()
         cursor = db.cursor(dictionary=True)
-        print(f"Fetching first name for user {self.id} of type {self.type}")
         if self.type == "citizen":
             cursor.execute(
                 "SELECT first_name FROM citizen WHERE id_citizen = %s",
@@ -182,7 +722,6 @@ class User(flask_login.UserMixin):
             )
         result = cursor.fetchone()
         cursor.close()
-        print(f"Fetched first name for user {self.id}: {result}")
         if result:
             return result["first_name"]
         return "BRAK IMIENIA"
@@ -198,11 +737,61 @@ class User(flask_login.UserMixin):
         return f"User(id={self.id}, type={self.type})"
 
 
+class UserCache:
+    """Per-process LRU cache of `User` objects with a time-to-live.
+
+    Lets `load_user` skip the database on most authenticated requests.
+    Entries must be dropped with `invalidate` whenever the underlying
+    citizen or employee record changes.
+    """
+
+    def __init__(self, ttl=300, maxsize=1024):
+        self.ttl = float(ttl)
+        self.maxsize = int(maxsize)
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str, type: str) -> "User | None":
+        key = (type, str(user_id))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            user, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def put(self, user: "User") -> None:
+        key = (user.type, str(user.id))
+        with self._lock:
+            self._entries[key] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str, type: str) -> None:
+        with self._lock:
+            self._entries.pop((type, str(user_id)), None)
+
+
+user_cache = UserCache(
+    ttl=app.config["USER_CACHE_TTL"], maxsize=app.config["USER_CACHE_SIZE"]
+)
+
+
 def load_user(user_id):
     user_type = flask.session.get("user_type")
     if not user_type:
         return None
-    return User.get(user_id, user_type)
+    user = user_cache.get(user_id, user_type)
+    if user is None:
+        user = User.get(user_id, user_type)
+        if user is not None:
+            user_cache.put(user)
+    return user
 
 
 ### XML export helpers (per-sector files)
@@ -269,44 +858,7 @@ def _application_element_from_row(row: dict, attachments: list) -> ET.Element:
 
     # application details
     sub("bag_count", row.get("bag_count") or 0)
-    try:
-        db = get_db()
-        sum_cur = db.cursor(dictionary=True)
-        try:
-            estate_id = row.get("id_estate")
-            creation = row.get("creation_date")
-            app_id = row.get("id_application")
-            bag_count = int(row.get("bag_count") or 0)
-
-            sum_sql = (
-                "SELECT COALESCE(SUM(bag_count),0) as prior_bags "
-                "FROM application "
-                "WHERE id_estate = %s AND YEAR(creation_date) = YEAR(%s) "
-                "AND (creation_date < %s OR (creation_date = %s AND id_application < %s))"
-            )
-            sum_cur.execute(
-                sum_sql, (estate_id, creation, creation, creation, app_id)
-            )
-            srow = sum_cur.fetchone()
-            prior_bags = (
-                srow["prior_bags"] if srow and "prior_bags" in srow else 0
-            )
-
-            free_remaining = max(0, 1 - int(prior_bags or 0))
-            free_for_this = min(free_remaining, bag_count)
-            paid_for_this = bag_count - free_for_this
-
-            row["free_bags"] = free_for_this
-            row["paid_bags"] = paid_for_this
-        finally:
-            sum_cur.close()
-    except Exception:
-        # best-effort fallback if DB not available or something fails
-        row["free_bags"] = 0
-        try:
-            row["paid_bags"] = int(row.get("bag_count") or 0)
-        except Exception:
-            row["paid_bags"] = 0
+    compute_free_paid([row])
     sub(
         "free_bags",
         row.get("free_bags") if row.get("free_bags") is not None else 0,
@@ -340,144 +892,1952 @@ def _application_element_from_row(row: dict, attachments: list) -> ET.Element:
     return app
 
 
-def _write_sector_application(row: dict, attachments: list):
-    """Write or update application element in sector XML file."""
-    sector_id = row.get("id_sector") or 0
-    path = _sector_file_path(sector_id)
+# Approvals and revocations are appended to a per-sector journal
+# (sector_N.journal, one JSON record per line) instead of rewriting
+# sector_N.xml each time. Compaction replays the journal onto the canonical
+# XML file; it runs once a journal outgrows SECTOR_JOURNAL_COMPACT_BYTES and
+# on demand via `flask xml-compact` (e.g. from cron).
+SECTOR_JOURNAL_COMPACT_BYTES = 1024 * 1024
+_SECTOR_FILE_RE = re.compile(
+    r"^sector_(\d+)\.(xml|journal|journal\.compacting)$"
+)
 
-    # load or create root
-    if os.path.exists(path):
-        try:
-            tree = ET.parse(path)
-            root = tree.getroot()
-        except Exception as e:
-            # corrupt file? start fresh but try to back up the corrupt file
-            try:
-                bak = path + ".corrupt"
-                os.replace(path, bak)
-                print(f"Backed up corrupt XML to {bak}")
-            except Exception:
-                pass
-            root = ET.Element("applications")
-            tree = ET.ElementTree(root)
+
+def _sector_journal_path(sector_id: int) -> str:
+    _ensure_xml_dir()
+    return os.path.join(XML_OUT_DIR, f"sector_{sector_id}.journal")
+
+
+def _revoked_at(timestamp: float | None = None) -> str:
+    """Return revoked_at as naive UTC ISO time (now, or a Unix timestamp)."""
+    if timestamp is None:
+        at = datetime.now(UTC)
     else:
-        root = ET.Element("applications")
-        tree = ET.ElementTree(root)
-
-    app_id = str(row.get("id_application"))
-    # find existing element
-    existing = None
-    for el in root.findall("application"):
-        if el.get("id") == app_id:
-            existing = el
-            break
+        at = datetime.fromtimestamp(float(timestamp), UTC)
+    return at.replace(tzinfo=None).isoformat()
 
-    new_el = _application_element_from_row(row, attachments)
 
-    try:
-        # debug: list existing application ids
-        existing_ids = [el.get("id") for el in root.findall("application")]
+_file_locks_guard = threading.Lock()
+
+
+class _FileLock:
+    """Exclusive lock on XML_OUT_DIR/<name>.lock for threads and processes.
+
+    Threads of one process are serialised by an in-process lock first; the
+    flock on the lock file then excludes other worker processes. Without
+    fcntl (Windows) only the in-process lock applies. With
+    `blocking=False`, entering raises BlockingIOError when the lock is held.
+    """
+
+    # one in-process lock per lock file, created under _file_locks_guard
+    _thread_locks: ClassVar[dict[str, threading.Lock]] = {}
+
+    def __init__(self, name: str, blocking: bool = True):
+        self.path = os.path.join(XML_OUT_DIR, name + ".lock")
+        self.blocking = blocking
+        with _file_locks_guard:
+            self._tlock = self._thread_locks.get(self.path)
+            if self._tlock is None:
+                self._tlock = self._thread_locks[self.path] = threading.Lock()
+        self._f = None
+
+    def __enter__(self):
+        if not self._tlock.acquire(self.blocking):
+            raise BlockingIOError(f"{self.path} is held")
         try:
-            app_id = str(row.get("id_application"))
+            _ensure_xml_dir()
+            self._f = open(self.path, "a")
+            if fcntl is not None:
+                flags = fcntl.LOCK_EX
+                if not self.blocking:
+                    flags |= fcntl.LOCK_NB
+                fcntl.flock(self._f.fileno(), flags)
         except Exception:
-            app_id = ""
-        print(
-            f"_write_sector_application: sector={sector_id} path={path} existing_count={len(existing_ids)} ids={existing_ids} writing_app_id={app_id}"
-        )
-    except Exception:
-        pass
+            if self._f is not None:
+                self._f.close()
+            self._tlock.release()
+            raise
+        return self
 
-    if existing is not None:
-        # replace existing element
-        root.remove(existing)
-    root.append(new_el)
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._f.fileno(), fcntl.LOCK_UN)
+            self._f.close()
+        finally:
+            self._tlock.release()
+        return False
 
-    try:
-        # pretty-print the tree for easier inspection
+
+def _sector_lock(sector_id: int) -> _FileLock:
+    return _FileLock(f"sector_{sector_id}")
+
+
+def _write_journal(sector_id: int, records: list) -> tuple[list, int]:
+    """Append records to a sector journal under the sector lock.
+
+    Returns the byte offset of each record and the new journal size.
+    """
+    path = _sector_journal_path(sector_id)
+    lines = [
+        (
+            json.dumps(r, ensure_ascii=False, separators=(",", ":")) + "\n"
+        ).encode("utf-8")
+        for r in records
+    ]
+    with _sector_lock(sector_id), open(path, "ab") as f:
+        f.seek(0, os.SEEK_END)
+        offsets = []
+        pos = f.tell()
+        for line in lines:
+            offsets.append(pos)
+            pos += len(line)
+        f.write(b"".join(lines))
+        f.flush()
+        os.fsync(f.fileno())
+        return offsets, f.tell()
+
+
+class _JournalGroupCommit:
+    """Coalesce concurrent appends to one sector journal into one write.
+
+    A thread that finds no write in progress for its sector becomes the
+    leader: it takes every record queued for the sector so far, writes and
+    fsyncs them together and hands each waiting thread its offsets. Threads
+    that arrive meanwhile queue up for the next leader, so a burst of N
+    approvals costs a couple of writes instead of N.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._leaders = set()
+
+    def append(self, sector_id: int, records: list) -> tuple[list, int]:
+        entry = {"records": records, "done": False}
+        with self._cond:
+            self._queues.setdefault(sector_id, []).append(entry)
+            while not entry["done"] and sector_id in self._leaders:
+                self._cond.wait()
+            if entry["done"]:
+                return self._result(entry)
+            self._leaders.add(sector_id)
+            batch = self._queues.pop(sector_id)
         try:
-            ET.indent(tree, space="  ")
-        except Exception:
-            # indent may not be available in older Python, ignore
-            pass
-        # debug: show new count
-        new_ids = [el.get("id") for el in root.findall("application")]
-        print(
-            f"_write_sector_application: after append new_count={len(new_ids)} ids={new_ids}"
-        )
-    except Exception:
+            offsets, size = _write_journal(
+                sector_id, [r for e in batch for r in e["records"]]
+            )
+            pos = 0
+            for e in batch:
+                e["offsets"] = offsets[pos : pos + len(e["records"])]
+                e["size"] = size
+                pos += len(e["records"])
+        except Exception as exc:
+            for e in batch:
+                e["error"] = exc
+        finally:
+            with self._cond:
+                for e in batch:
+                    e["done"] = True
+                self._leaders.discard(sector_id)
+                self._cond.notify_all()
+        return self._result(entry)
+
+    @staticmethod
+    def _result(entry: dict) -> tuple[list, int]:
+        if "offsets" not in entry:
+            raise entry.get("error") or RuntimeError("journal write aborted")
+        return entry["offsets"], entry["size"]
+
+
+_journal_commits = _JournalGroupCommit()
+
+
+def _append_journal(sector_id: int, records: list) -> tuple[list, int]:
+    """Append records to a sector journal, group-committed with others.
+
+    Returns the byte offset of each record and the new journal size.
+    """
+    return _journal_commits.append(sector_id, records)
+
+
+# Persistent map of application id -> sector kept next to the exports, so
+# a revocation only touches the sector that holds the application.
+XML_INDEX_PATH = os.path.join(XML_OUT_DIR, "index")
+_XML_INDEX_COMPLETE = b"__complete__"
+
+
+def _open_xml_index(flag: str = "c"):
+    _ensure_xml_dir()
+    return dbm.open(XML_INDEX_PATH, flag)
+
+
+def _xml_index_put(entries: dict) -> None:
+    """Store {app_id: sector_id} in the index."""
+    if not entries:
+        return
+    with _FileLock("index"), _open_xml_index() as index:
+        for app_id, sector_id in entries.items():
+            index[str(app_id)] = str(sector_id)
+
+
+def _xml_index_get(app_id) -> int | None:
+    """Return the sector holding an exported application.
+
+    Returns None when the application was never exported. Raises KeyError
+    when the index has not been built for this directory yet, so callers
+    can fall back to scanning.
+    """
+    with _FileLock("index"), _open_xml_index() as index:
+        value = index.get(str(app_id).encode("utf-8"))
+        if value is None:
+            if _XML_INDEX_COMPLETE not in index:
+                raise KeyError(app_id)
+            return None
+    # entries written by older versions carry a ":offset" suffix
+    return int(value.decode("utf-8").partition(":")[0])
+
+
+def _read_journal(path: str) -> list:
+    records = []
+    try:
+        with open(path, "rb") as f:
+            for lineno, line in enumerate(f, 1):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # torn write at the tail after a crash
+                    print(
+                        f"_read_journal: skipping bad record {path}:{lineno}"
+                    )
+    except FileNotFoundError:
         pass
+    return records
 
-    # Debug/logging: show what we're doing
+
+def _backup_corrupt(path: str) -> None:
     try:
-        print(
-            f"_write_sector_application: writing application id={app_id} to {path} (replaced_existing={existing is not None})"
-        )
+        bak = path + ".corrupt"
+        os.replace(path, bak)
+        print(f"Backed up corrupt XML to {bak}")
     except Exception:
         pass
 
-    # write atomically
-    tmp = path + ".tmp"
-    try:
-        tree.write(tmp, encoding="utf-8", xml_declaration=True)
-        # On Windows replace can fail if file locked; try to replace and fall back to write
+
+class SectorXMLWriter:
+    """Write an <applications> sector file one element at a time.
+
+    Produces the same bytes as building the whole tree, running ET.indent
+    and ElementTree.write with an XML declaration, but only one application
+    element is held in memory at a time. The output goes to a temporary
+    file that replaces `path` on a clean close and is discarded on error.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = None
+        self.count = 0
+        self._f = None
+
+    def __enter__(self):
+        # unique temp name: concurrent writers never share a scratch file
+        fd, self.tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(self.path) or ".",
+            prefix=os.path.basename(self.path) + ".",
+            suffix=".tmp",
+        )
+        self._f = os.fdopen(fd, "w", encoding="utf-8")
+        self._f.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        return self
+
+    def write(self, el: ET.Element) -> None:
+        el.tail = None
+        ET.indent(el, space="  ", level=1)
+        if not self.count:
+            self._f.write("<applications>")
+        self._f.write("\n  ")
+        self._f.write(ET.tostring(el, encoding="unicode"))
+        self.count += 1
+
+    def __exit__(self, exc_type, exc, tb):
         try:
-            os.replace(tmp, path)
-        except Exception as e:
-            print(
-                f"_write_sector_application: os.replace failed: {e}; falling back to overwrite"
-            )
+            if exc_type is None:
+                self._f.write(
+                    "\n</applications>" if self.count else "<applications />"
+                )
+                self._f.flush()
+                os.fsync(self._f.fileno())
+        finally:
+            self._f.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        else:
             try:
-                # fallback: overwrite target
-                with open(tmp, "rb") as rf, open(path, "wb") as wf:
-                    wf.write(rf.read())
-                os.remove(tmp)
-            except Exception as e2:
-                print(
-                    f"_write_sector_application: fallback write failed: {e2}"
+                os.remove(self.tmp_path)
+            except OSError:
+                pass
+        return False
+
+
+def _iter_sector_applications(path: str):
+    """Yield the <application> elements of a sector file one by one.
+
+    Each element is detached from the document once the caller is done
+    with it, so memory stays bounded by a single application. Raises
+    ET.ParseError for a corrupt file.
+    """
+    if not os.path.exists(path):
+        return
+    depth = 0
+    root = None
+    for event, el in ET.iterparse(path, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = el
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1 and el.tag == "application":
+            yield el
+            root.remove(el)
+
+
+def _journal_plan(records: list) -> tuple[list, dict]:
+    """Reduce journal records to their net effect.
+
+    Returns the upsert records that survive, in the order their elements
+    end up at the tail of the file, and {app_id: revoked_at} for revokes
+    that follow the last upsert of their application. An upsert replaces
+    any earlier element with the same id; only the first effective revoke
+    counts.
+    """
+    last_upsert = {}
+    for i, rec in enumerate(records):
+        if rec.get("op") == "upsert":
+            last_upsert[str(rec.get("id"))] = i
+    revoked = {}
+    for i, rec in enumerate(records):
+        app_id = str(rec.get("id"))
+        if rec.get("op") == "revoke" and i > last_upsert.get(app_id, -1):
+            revoked.setdefault(app_id, rec.get("at") or "")
+    upserts = [records[i] for i in sorted(last_upsert.values())]
+    return upserts, revoked
+
+
+def _revoke_element(el: ET.Element, at: str) -> None:
+    if el.get("revoked") != "true":
+        el.set("revoked", "true")
+        rev = ET.SubElement(el, "revoked_at")
+        rev.text = at
+
+
+def _rewrite_sector(path: str, records: list) -> None:
+    """Stream sector file `path` through the journal records into place."""
+    upserts, revoked = _journal_plan(records)
+    replaced = {str(rec.get("id")) for rec in upserts}
+    with SectorXMLWriter(path) as out:
+        for el in _iter_sector_applications(path):
+            app_id = el.get("id")
+            if app_id in replaced:
+                continue
+            if app_id in revoked:
+                _revoke_element(el, revoked[app_id])
+            out.write(el)
+        for rec in upserts:
+            el = ET.fromstring(rec["xml"])
+            if el.get("id") in revoked:
+                _revoke_element(el, revoked[el.get("id")])
+            out.write(el)
+
+
+def _sector_compact_lock(sector_id: int, blocking: bool = True) -> _FileLock:
+    return _FileLock(f"sector_{sector_id}.compact", blocking)
+
+
+def _compact_sector(
+    sector_id: int, min_bytes: int = 0, blocking: bool = True
+) -> int:
+    """Fold a sector journal into sector_N.xml; return records applied.
+
+    The journal is first renamed aside, under the sector lock, so new
+    appends go to a fresh file while the XML is rewritten. Only one
+    compaction per sector runs at a time; with `min_bytes` a journal that
+    another process has just compacted is left alone. A leftover
+    `.compacting` journal from an interrupted run is replayed again; replay
+    is idempotent. With `blocking=False`, raises BlockingIOError instead of
+    waiting for a compaction or `xml-rebuild` holding the sector.
+    """
+    with _sector_compact_lock(sector_id, blocking):
+        return _compact_sector_locked(sector_id, min_bytes)
+
+
+def _compact_sector_locked(sector_id: int, min_bytes: int) -> int:
+    path = _sector_file_path(sector_id)
+    journal = _sector_journal_path(sector_id)
+    pending = journal + ".compacting"
+    if not os.path.exists(pending):
+        with _sector_lock(sector_id):
+            try:
+                size = os.path.getsize(journal)
+            except FileNotFoundError:
+                return 0
+            if size < min_bytes:
+                return 0
+            os.replace(journal, pending)
+    records = _read_journal(pending)
+    try:
+        _rewrite_sector(path, records)
+    except ET.ParseError:
+        # corrupt file: keep a backup and rebuild from the journal alone
+        _backup_corrupt(path)
+        _rewrite_sector(path, records)
+    os.remove(pending)
+    print(
+        f"_compact_sector: sector={sector_id} applied {len(records)} records"
+    )
+    return len(records)
+
+
+def _write_sector_applications(sector_id: int, items: list) -> None:
+    """Record approved applications of one sector in a single append.
+
+    `items` is a list of (row, attachments) pairs.
+    """
+    records = []
+    for row, attachments in items:
+        el = _application_element_from_row(row, attachments)
+        records.append(
+            {
+                "op": "upsert",
+                "id": str(row.get("id_application")),
+                "xml": ET.tostring(el, encoding="unicode"),
+            }
+        )
+    if not records:
+        return
+    _, size = _append_journal(sector_id, records)
+    _xml_index_put({r["id"]: sector_id for r in records})
+    if size >= SECTOR_JOURNAL_COMPACT_BYTES:
+        try:
+            _compact_sector(
+                sector_id,
+                min_bytes=SECTOR_JOURNAL_COMPACT_BYTES,
+                blocking=False,
+            )
+        except BlockingIOError:
+            # busy (e.g. xml-rebuild); a later append compacts the journal
+            pass
+
+
+def _write_sector_application(row: dict, attachments: list):
+    """Record an approved application in its sector journal."""
+    _write_sector_applications(row.get("id_sector") or 0, [(row, attachments)])
+
+
+def _scan_exports() -> dict:
+    """Scan every sector file and journal; return {app_id: sector_id}.
+
+    Journals are read after the canonical files so that the sector of the
+    latest pending upsert wins.
+    """
+    _ensure_xml_dir()
+    found = {}
+    names = sorted(
+        os.listdir(XML_OUT_DIR), key=lambda n: (not n.endswith(".xml"), n)
+    )
+    for fname in names:
+        m = _SECTOR_FILE_RE.match(fname)
+        if not m:
+            continue
+        sector_id = int(m.group(1))
+        path = os.path.join(XML_OUT_DIR, fname)
+        if m.group(2) != "xml":
+            for rec in _read_journal(path):
+                if rec.get("op") == "upsert":
+                    found[rec["id"]] = sector_id
+            continue
+        try:
+            for _, el in ET.iterparse(path):
+                if el.tag == "application":
+                    found.setdefault(el.get("id"), sector_id)
+                    el.clear()
+        except ET.ParseError:
+            continue
+    return found
+
+
+def _mark_applications_revoked(app_ids) -> None:
+    """Mark applications as revoked, one journal append per sector."""
+    by_sector = collections.defaultdict(list)
+    found = None
+    for app_id in app_ids:
+        try:
+            sector_id = _xml_index_get(app_id)
+        except KeyError:
+            # index not built for this directory yet: build it once
+            if found is None:
+                found = _rebuild_xml_index()
+            sector_id = found.get(str(app_id))
+        if sector_id is not None:
+            by_sector[sector_id].append(str(app_id))
+    at = _revoked_at()
+    for sector_id, ids in by_sector.items():
+        _append_journal(
+            sector_id, [{"op": "revoke", "id": i, "at": at} for i in ids]
+        )
+
+
+def _mark_application_revoked(app_id: int):
+    """Mark the application as revoked in the sector export that holds it."""
+    _mark_applications_revoked([app_id])
+
+
+def _rebuild_xml_index() -> dict:
+    """Rebuild the index from a scan of the export directory.
+
+    The scan runs under the index lock, so an entry put meanwhile is
+    either seen by the scan or written after the new index.
+    """
+    with _FileLock("index"):
+        found = _scan_exports()
+        with _open_xml_index("n") as index:
+            for app_id, sector_id in found.items():
+                index[str(app_id)] = str(sector_id)
+            index[_XML_INDEX_COMPLETE] = b"1"
+    return found
+
+
+@app.cli.command("xml-index-rebuild")
+def xml_index_rebuild_command():
+    """Rebuild the application -> sector index from the export directory."""
+    found = _rebuild_xml_index()
+    click.echo(f"indexed {len(found)} applications")
+
+
+@app.cli.command("xml-compact")
+@click.option("--sector", type=int, default=None, help="Only this sector.")
+def xml_compact_command(sector):
+    """Fold sector journals into the canonical sector_N.xml files."""
+    _ensure_xml_dir()
+    if sector is not None:
+        sectors = [sector]
+    else:
+        matches = map(_SECTOR_FILE_RE.match, os.listdir(XML_OUT_DIR))
+        sectors = sorted(
+            {int(m.group(1)) for m in matches if m and m.group(2) != "xml"}
+        )
+    for sector_id in sectors:
+        applied = _compact_sector(sector_id)
+        click.echo(f"sector {sector_id}: {applied} records compacted")
+
+
+### Background export worker
+# decide_application only records an export job in export_outbox, in the
+# same transaction as the status change. ExportWorker drains the outbox in
+# a daemon thread (or in the foreground via `flask export-worker`), in job
+# order per application, retrying failures with exponential backoff. Each
+# job carries the status the application had when it was queued, which is
+# what gets exported even if the status has moved on since.
+EXPORT_BACKOFF_BASE = 5
+EXPORT_BACKOFF_MAX = 3600
+
+# explicit citizen columns so they do not shadow application columns; the
+# estate columns are the ones the export has always carried (postal_code
+# and city stay empty in the XML)
+_EXPORT_ROW_SQL = """
+    SELECT a.*, e.id_sector, e.street, e.building_number,
+        e.apartment_number,
+        c.first_name, c.last_name, c.email, c.phone_number, c.pesel, c.nip,
+        c.reg_address, c.birth_date
+    FROM application a
+    LEFT JOIN estate e ON a.id_estate = e.id_estate
+    LEFT JOIN citizen c ON a.id_citizen = c.id_citizen
+    """
+
+
+def _enqueue_export(cur, app_ids, action: str, status: str) -> None:
+    """Queue XML export ('export') or revocation ('revoke') jobs."""
+    cur.executemany(
+        "INSERT INTO export_outbox (id_application, action, status) "
+        "VALUES (%s, %s, %s)",
+        [(app_id, action, status) for app_id in app_ids],
+    )
+
+
+def _process_export_jobs(db, jobs: list) -> dict:
+    """Run a batch of outbox jobs with one export pass per sector.
+
+    Returns {id_job: exception} for the jobs that failed.
+    """
+    failed = {}
+    exports = {j["id_application"]: j for j in jobs if j["action"] != "revoke"}
+    revokes = [j for j in jobs if j["action"] == "revoke"]
+    if exports:
+        ids = list(exports)
+        placeholders = ", ".join(["%s"] * len(ids))
+        cur = db.cursor(dictionary=True)
+        try:
+            cur.execute(
+                f"{_EXPORT_ROW_SQL} "
+                f"WHERE a.id_application IN ({placeholders})",
+                ids,
+            )
+            rows = cur.fetchall()
+            cur.execute(
+                "SELECT id_attachment, id_application, file_name, file_type "
+                f"FROM attachment WHERE id_application IN ({placeholders}) "
+                "ORDER BY id_attachment",
+                ids,
+            )
+            atts = collections.defaultdict(list)
+            for att in cur.fetchall():
+                atts[att["id_application"]].append(att)
+        finally:
+            cur.close()
+        compute_free_paid(rows)
+        by_sector = collections.defaultdict(list)
+        for row in rows:
+            # jobs queued before the column existed carry no status
+            row["status"] = (
+                exports[row["id_application"]].get("status") or row["status"]
+            )
+            by_sector[row.get("id_sector") or 0].append(
+                (row, atts[row["id_application"]])
+            )
+        for sector_id, items in by_sector.items():
+            try:
+                _write_sector_applications(sector_id, items)
+            except Exception as e:
+                for row, _ in items:
+                    failed[exports[row["id_application"]]["id_job"]] = e
+    if revokes:
+        try:
+            _mark_applications_revoked([j["id_application"] for j in revokes])
+        except Exception as e:
+            for job in revokes:
+                failed[job["id_job"]] = e
+    return failed
+
+
+class ExportWorker:
+    """Drains export_outbox; safe to run in several processes at once."""
+
+    def __init__(self, poll_interval=5, batch_size=500):
+        self.poll_interval = float(poll_interval)
+        self.batch_size = int(batch_size)
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self.run_forever, name="export-worker", daemon=True
+                )
+                self._thread.start()
+
+    def wake(self) -> None:
+        """Ask the worker to look at the outbox now (starting it if needed)."""
+        if app.config["EXPORT_WORKER_ENABLED"]:
+            self.start()
+        self._wake.set()
+
+    def run_forever(self) -> None:
+        while True:
+            try:
+                with app.app_context():
+                    processed = self.run_once()
+            except Exception as e:
+                print("export worker error:", e)
+                processed = 0
+            if processed < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def run_once(self) -> int:
+        """Process one batch of due jobs; return how many were handled.
+
+        Jobs are claimed with SKIP LOCKED and a job is only due once every
+        earlier job of the same application is done, so an approval and a
+        later decline are never exported out of order. The batch is written
+        with one journal append per sector.
+        """
+        db = get_db()
+        cur = db.cursor(dictionary=True)
+        try:
+            db.start_transaction()
+            cur.execute(
+                """
+                SELECT o.id_job, o.id_application, o.action, o.status,
+                    o.attempts
+                FROM export_outbox o
+                WHERE o.done_at IS NULL AND o.next_attempt_at <= NOW()
+                AND NOT EXISTS (
+                    SELECT 1 FROM export_outbox p
+                    WHERE p.id_application = o.id_application
+                    AND p.done_at IS NULL AND p.id_job < o.id_job
+                )
+                ORDER BY o.id_job
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+                """,
+                (self.batch_size,),
+            )
+            jobs = cur.fetchall()
+            try:
+                failed = _process_export_jobs(db, jobs)
+            except Exception as e:
+                failed = {job["id_job"]: e for job in jobs}
+            for job in jobs:
+                e = failed.get(job["id_job"])
+                if e is None:
+                    continue
+                delay = min(
+                    EXPORT_BACKOFF_MAX,
+                    EXPORT_BACKOFF_BASE * 2 ** job["attempts"],
+                )
+                print(f"export job {job['id_job']} failed: {e}")
+                cur.execute(
+                    "UPDATE export_outbox SET attempts = attempts + 1, "
+                    "last_error = %s, next_attempt_at = "
+                    "NOW() + INTERVAL %s SECOND WHERE id_job = %s",
+                    (str(e)[:2000], delay, job["id_job"]),
+                )
+            done = [j["id_job"] for j in jobs if j["id_job"] not in failed]
+            if done:
+                cur.execute(
+                    "UPDATE export_outbox SET done_at = NOW() "
+                    f"WHERE id_job IN ({', '.join(['%s'] * len(done))})",
+                    done,
+                )
+            db.commit()
+            return len(jobs)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+export_worker = ExportWorker(
+    poll_interval=app.config["EXPORT_WORKER_POLL_INTERVAL"],
+    batch_size=app.config["EXPORT_WORKER_BATCH_SIZE"],
+)
+
+
+@app.before_request
+def start_export_worker():
+    """Start (or revive) this process' export worker on its first request.
+
+    Jobs left in the outbox by a previous process are drained without
+    waiting for the next decision. Not done at import time, so CLI
+    commands and a preloading master process do not run the worker.
+    """
+    if app.config["EXPORT_WORKER_ENABLED"]:
+        export_worker.start()
+
+
+def export_queue_stats() -> dict:
+    """Return outbox depth, failing jobs and the age of the oldest job."""
+    db = get_db()
+    cur = db.cursor(dictionary=True)
+    try:
+        cur.execute(
+            """
+            SELECT COUNT(*) AS depth,
+                COALESCE(SUM(attempts > 0), 0) AS failing,
+                TIMESTAMPDIFF(SECOND, MIN(created_at), NOW()) AS lag_seconds
+            FROM export_outbox WHERE done_at IS NULL
+            """
+        )
+        row = cur.fetchone() or {}
+    finally:
+        cur.close()
+    return {
+        "depth": int(row.get("depth") or 0),
+        "failing": int(row.get("failing") or 0),
+        "lag_seconds": int(row.get("lag_seconds") or 0),
+    }
+
+
+@app.cli.command("export-worker")
+@click.option("--once", is_flag=True, help="Drain due jobs and exit.")
+def export_worker_command(once):
+    """Run the XML export worker in the foreground."""
+    if once:
+        total = 0
+        while True:
+            processed = export_worker.run_once()
+            total += processed
+            if processed < export_worker.batch_size:
+                break
+        click.echo(f"processed {total} jobs")
+        return
+    export_worker.run_forever()
+
+
+### Full XML re-export
+# `flask xml-rebuild` regenerates every sector_N.xml from MySQL, e.g. after
+# a corrupt file was backed up or the export format changed. Each sector is
+# written by its own process into sector_N.xml.rebuild; the new files are
+# only swapped in once every sector has succeeded. The sectors' compaction
+# locks are held from before the export until the swap and the index
+# rebuild, so journal records written meanwhile stay in the journals and
+# are replayed onto the new files by the next compaction. Like the
+# incremental export, the files keep applications whose approval was
+# withdrawn, marked revoked, as the status history records them.
+XML_REBUILD_BATCH_SIZE = 500
+
+# approved now, or approved before and withdrawn since
+_XML_REBUILD_WHERE = """
+    (a.status = 'approved' OR a.id_application IN (
+        SELECT id_application FROM application_status_history
+        WHERE old_status = 'approved'
+    ))
+    """
+
+
+def _export_sector_file(sector_id: int, batch_size: int) -> tuple:
+    """Write sector_N.xml.rebuild from the database (runs in a worker).
+
+    Exported applications are read in id order, one batch at a time, with
+    a single attachment query, a single revocation query and a single
+    allocation query per batch. Returns (sector_id, applications written,
+    seconds).
+    """
+    global _db_pool
+    # never reuse connections inherited from the parent process
+    _db_pool = None
+    started = time.monotonic()
+    path = _sector_file_path(sector_id) + ".rebuild"
+    with app.app_context(), SectorXMLWriter(path) as out:
+        db = get_db()
+        cur = db.cursor(dictionary=True)
+        last_id = 0
+        try:
+            while True:
+                cur.execute(
+                    f"""{_EXPORT_ROW_SQL}
+                    WHERE {_XML_REBUILD_WHERE} AND a.id_application > %s
+                    AND (e.id_sector = %s OR (%s = 0 AND e.id_sector IS NULL))
+                    ORDER BY a.id_application
+                    LIMIT %s
+                    """,
+                    (last_id, sector_id, sector_id, batch_size),
+                )
+                rows = cur.fetchall()
+                if not rows:
+                    break
+                last_id = rows[-1]["id_application"]
+                ids = [r["id_application"] for r in rows]
+                placeholders = ", ".join(["%s"] * len(ids))
+                cur.execute(
+                    "SELECT id_attachment, id_application, file_name, "
+                    "file_type FROM attachment "
+                    f"WHERE id_application IN ({placeholders}) "
+                    "ORDER BY id_attachment",
+                    ids,
+                )
+                atts = collections.defaultdict(list)
+                for att in cur.fetchall():
+                    atts[att["id_application"]].append(att)
+                revoked = {}
+                withdrawn = [
+                    r["id_application"]
+                    for r in rows
+                    if r["status"] != "approved"
+                ]
+                if withdrawn:
+                    # the latest move away from approved is the first one
+                    # after the last approval, which is what the journal
+                    # keeps as revoked_at. changed_at is in the session
+                    # time zone; UNIX_TIMESTAMP reads it back as UTC
+                    cur.execute(
+                        "SELECT id_application, "
+                        "UNIX_TIMESTAMP(MAX(changed_at)) AS at "
+                        "FROM application_status_history "
+                        "WHERE old_status = 'approved' AND id_application "
+                        f"IN ({', '.join(['%s'] * len(withdrawn))}) "
+                        "GROUP BY id_application",
+                        withdrawn,
+                    )
+                    revoked = {
+                        r["id_application"]: r["at"] for r in cur.fetchall()
+                    }
+                compute_free_paid(rows)
+                for row in rows:
+                    at = revoked.get(row["id_application"])
+                    if at is not None:
+                        # exported as approved, then revoked
+                        row["status"] = "approved"
+                    el = _application_element_from_row(
+                        row, atts[row["id_application"]]
+                    )
+                    if at is not None:
+                        _revoke_element(el, _revoked_at(at))
+                    out.write(el)
+        finally:
+            cur.close()
+    return sector_id, out.count, time.monotonic() - started
+
+
+@app.cli.command("xml-rebuild")
+@click.option(
+    "--workers", type=int, default=None, help="Worker processes to use."
+)
+@click.option(
+    "--batch-size", type=int, default=XML_REBUILD_BATCH_SIZE, show_default=True
+)
+def xml_rebuild_command(workers, batch_size):
+    """Regenerate every sector XML export from the database."""
+    started = time.monotonic()
+    _ensure_xml_dir()
+    # a direct connection: forked workers must not share pooled sockets
+    conn = mysql.connector.connect(**DB_CONFIG)
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            "SELECT DISTINCT COALESCE(e.id_sector, 0) FROM application a "
+            "LEFT JOIN estate e ON a.id_estate = e.id_estate "
+            f"WHERE {_XML_REBUILD_WHERE}"
+        )
+        sectors = {r[0] for r in cur.fetchall()}
+        cur.close()
+    finally:
+        conn.close()
+    # sectors that no longer have exported applications get an empty file
+    for m in map(_SECTOR_FILE_RE.match, os.listdir(XML_OUT_DIR)):
+        if m:
+            sectors.add(int(m.group(1)))
+    sectors = sorted(sectors)
+    if not sectors:
+        click.echo("nothing to export")
+        return
+
+    results = []
+    failed = []
+    with contextlib.ExitStack() as locks:
+        # a compaction during the export would fold journal records into
+        # the old file, which the swap then throws away
+        for sector_id in sectors:
+            locks.enter_context(_sector_compact_lock(sector_id))
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=min(workers or os.cpu_count() or 1, len(sectors))
+        ) as pool:
+            futures = {
+                pool.submit(
+                    _export_sector_file, sector_id, batch_size
+                ): sector_id
+                for sector_id in sectors
+            }
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    failed.append(futures[future])
+                    click.echo(
+                        f"sector {futures[future]}: failed: {e}", err=True
+                    )
+
+        if failed:
+            for sector_id in sectors:
+                try:
+                    os.remove(_sector_file_path(sector_id) + ".rebuild")
+                except OSError:
+                    pass
+            raise click.ClickException(
+                f"{len(failed)} sectors failed; existing exports kept"
+            )
+
+        for sector_id in sectors:
+            path = _sector_file_path(sector_id)
+            os.replace(path + ".rebuild", path)
+        # journal offsets are re-read against the new files before any
+        # compaction can move them
+        _rebuild_xml_index()
+
+    for sector_id, count, seconds in sorted(results):
+        click.echo(
+            f"sector {sector_id}: {count} applications in {seconds:.2f}s"
+        )
+    total = sum(count for _, count, _ in results)
+    click.echo(
+        f"exported {total} applications in {len(sectors)} sectors "
+        f"in {time.monotonic() - started:.2f}s"
+    )
+
+
+### Application search index
+# One denormalized document per application (address and applicant fields)
+# under a FULLTEXT index, refreshed when the application is written.
+# Terms match word prefixes ("tum" finds "Tumska", "ska" does not), unlike
+# the substring LIKE used before the index. InnoDB does not index tokens
+# shorter than innodb_ft_min_token_size (3 by default), so short terms such
+# as building numbers are still matched as substrings with LIKE against the
+# same narrow table.
+SEARCH_MIN_TOKEN = 3
+
+_SEARCH_DOCUMENT_SQL = """
+    SELECT a.id_application,
+        CONCAT_WS(' ', e.street, e.building_number, e.apartment_number,
+            c.first_name, c.last_name, c.email) AS document
+    FROM application a
+    LEFT JOIN estate e ON a.id_estate = e.id_estate
+    LEFT JOIN citizen c ON a.id_citizen = c.id_citizen
+    """
+
+
+def _index_application(cur, app_id) -> None:
+    """Insert or refresh the search document of one application."""
+    cur.execute(
+        "INSERT INTO application_search (id_application, document) "
+        f"{_SEARCH_DOCUMENT_SQL} WHERE a.id_application = %s "
+        "ON DUPLICATE KEY UPDATE document = VALUES(document)",
+        (app_id,),
+    )
+
+
+def _search_terms(q: str) -> tuple[str, list]:
+    """Split `q` into a boolean-mode MATCH expression and short terms."""
+    words = re.findall(r"\w+", q or "")
+    long_words = [w for w in words if len(w) >= SEARCH_MIN_TOKEN]
+    short_words = [w for w in words if len(w) < SEARCH_MIN_TOKEN]
+    match_expr = " ".join(f"+{w}*" for w in long_words)
+    return match_expr, short_words
+
+
+def _search_clause(q: str, column: str = "a.id_application"):
+    """Return (sql, params) restricting `column` to applications matching q."""
+    match_expr, short_words = _search_terms(q)
+    conditions = []
+    params = []
+    if match_expr:
+        conditions.append("MATCH(document) AGAINST (%s IN BOOLEAN MODE)")
+        params.append(match_expr)
+    for w in short_words:
+        conditions.append("document LIKE %s")
+        params.append(f"%{w}%")
+    if not conditions:
+        return "1", []
+    sql = (
+        f"{column} IN (SELECT id_application FROM application_search "
+        f"WHERE {' AND '.join(conditions)})"
+    )
+    return sql, params
+
+
+@app.cli.command("search-rebuild")
+def search_rebuild_command():
+    """Rebuild the application search index from scratch."""
+    db = get_db()
+    cur = db.cursor()
+    try:
+        db.start_transaction()
+        cur.execute("DELETE FROM application_search")
+        cur.execute(
+            "INSERT INTO application_search (id_application, document) "
+            f"{_SEARCH_DOCUMENT_SQL}"
+        )
+        indexed = cur.rowcount
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+    click.echo(f"indexed {indexed} applications")
+
+
+### Status counters
+# application_status_count holds one row per (citizen, status) plus totals
+# over all applications under id_citizen = 0. Rows are adjusted in the
+# transaction that inserts an application or changes its status.
+ALL_CITIZENS = 0
+
+
+def _move_status_count(cur, id_citizen, old_status, new_status) -> None:
+    """Move one application from `old_status` to `new_status` in counters.
+
+    `old_status` is None for a new application.
+    """
+    values = []
+    for status, delta in ((old_status, -1), (new_status, 1)):
+        if status is None:
+            continue
+        values.append((ALL_CITIZENS, status, delta))
+        values.append((id_citizen, status, delta))
+    if not values:
+        return
+    cur.execute(
+        "INSERT INTO application_status_count (id_citizen, status, cnt) "
+        f"VALUES {', '.join(['(%s, %s, %s)'] * len(values))} "
+        "ON DUPLICATE KEY UPDATE cnt = cnt + VALUES(cnt)",
+        tuple(v for row in values for v in row),
+    )
+
+
+def _status_counts(cur, id_citizen=ALL_CITIZENS) -> dict:
+    """Return {status: count} for one citizen, or for everyone by default."""
+    cur.execute(
+        "SELECT status, cnt FROM application_status_count "
+        "WHERE id_citizen = %s",
+        (id_citizen,),
+    )
+    # a counter that drifted below zero must not turn into a negative total
+    return {r["status"]: max(0, int(r["cnt"])) for r in cur.fetchall()}
+
+
+def _set_status(cur, app_ids, new_status: str) -> int:
+    """Compare-and-set `status` on applications; return rows changed.
+
+    Only rows whose status differs are touched. MySQL assigns left to
+    right, so `prev_status` keeps the old status for
+    `_record_transitions`.
+    """
+    cur.execute(
+        "UPDATE application SET prev_status = status, status = %s "
+        f"WHERE id_application IN ({', '.join(['%s'] * len(app_ids))}) "
+        "AND status <> %s",
+        [new_status, *app_ids, new_status],
+    )
+    return cur.rowcount
+
+
+def _record_transitions(cur, app_ids, changed_by) -> None:
+    """Write history rows and move counters for just-changed applications.
+
+    Reads `prev_status` and `status` straight from the updated rows, so
+    it must run in the same transaction as `_set_status` and only with
+    ids that statement actually changed.
+    """
+    placeholders = ", ".join(["%s"] * len(app_ids))
+    cur.execute(
+        "INSERT INTO application_status_history "
+        "(id_application, old_status, new_status, changed_by) "
+        "SELECT id_application, prev_status, status, %s FROM application "
+        f"WHERE id_application IN ({placeholders})",
+        [changed_by, *app_ids],
+    )
+    cur.execute(
+        f"""
+        INSERT INTO application_status_count (id_citizen, status, cnt)
+        SELECT t.id_citizen, t.status, SUM(t.delta) FROM (
+            SELECT id_citizen, prev_status AS status, -1 AS delta
+            FROM application WHERE id_application IN ({placeholders})
+            UNION ALL
+            SELECT %s, prev_status, -1
+            FROM application WHERE id_application IN ({placeholders})
+            UNION ALL
+            SELECT id_citizen, status, 1
+            FROM application WHERE id_application IN ({placeholders})
+            UNION ALL
+            SELECT %s, status, 1
+            FROM application WHERE id_application IN ({placeholders})
+        ) t
+        GROUP BY t.id_citizen, t.status
+        ON DUPLICATE KEY UPDATE cnt = cnt + VALUES(cnt)
+        """,
+        [
+            *app_ids,
+            ALL_CITIZENS,
+            *app_ids,
+            *app_ids,
+            ALL_CITIZENS,
+            *app_ids,
+        ],
+    )
+
+
+@app.cli.command("counters-rebuild")
+def counters_rebuild_command():
+    """Recompute the per-status application counters from scratch."""
+    db = get_db()
+    cur = db.cursor()
+    try:
+        db.start_transaction()
+        cur.execute("DELETE FROM application_status_count")
+        cur.execute(
+            "INSERT INTO application_status_count (id_citizen, status, cnt) "
+            "SELECT id_citizen, status, COUNT(*) FROM application "
+            "GROUP BY id_citizen, status"
+        )
+        cur.execute(
+            "INSERT INTO application_status_count (id_citizen, status, cnt) "
+            "SELECT %s, status, COUNT(*) FROM application GROUP BY status",
+            (ALL_CITIZENS,),
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        cur.close()
+    click.echo("status counters rebuilt")
+
+
+### Change feed
+# Every new application, attachment and status change appends a row to
+# application_change; its seq is the feed cursor. The staff dashboard asks
+# for `changes?since=<seq>` and keeps an SSE stream open; a single
+# ChangeFeed thread polls the table for every connected employee and fans
+# the new rows out to their streams.
+#
+# seq values come from the single row of application_change_seq, bumped
+# in the transaction of the change. Its row lock is held until commit, so
+# a higher seq never becomes visible before a lower one (AUTO_INCREMENT
+# values are handed out at insert time and can commit out of order, which
+# made readers skip changes for good). The committed counter is also the
+# highest seq a reader can see. Edits to estate and citizen rows move the
+# counter without a change row (see the triggers in SCHEMA_UPGRADES), so
+# seq values can have gaps.
+CHANGE_FEED_LIMIT = 200
+CHANGE_FEED_BUFFER = 1000
+
+
+def _log_changes(cur, app_ids, kind: str) -> None:
+    """Append change-feed rows; call inside the transaction of the change.
+
+    Other transactions logging changes wait on the sequence row from here
+    until this one ends, so call it as late as possible.
+    """
+    if not app_ids:
+        return
+    cur.execute(
+        "UPDATE application_change_seq "
+        "SET seq = LAST_INSERT_ID(seq + %s) WHERE id = 1",
+        (len(app_ids),),
+    )
+    if not cur.rowcount:
+        raise RuntimeError("application_change_seq missing; run upgrade-db")
+    first = cur.lastrowid - len(app_ids) + 1
+    cur.executemany(
+        "INSERT INTO application_change (seq, id_application, kind) "
+        "VALUES (%s, %s, %s)",
+        [(first + i, app_id, kind) for i, app_id in enumerate(app_ids)],
+    )
+
+
+def _latest_change_seq(cur) -> int:
+    """Return the highest committed change seq."""
+    cur.execute("SELECT seq FROM application_change_seq WHERE id = 1")
+    row = cur.fetchone()
+    return int(row["seq"]) if row else 0
+
+
+def _changes_since(cur, since: int, limit: int = CHANGE_FEED_LIMIT) -> list:
+    """Return change rows after `since`, oldest first, with status."""
+    cur.execute(
+        """
+        SELECT ch.seq, ch.id_application, ch.kind, a.status
+        FROM application_change ch
+        LEFT JOIN application a ON a.id_application = ch.id_application
+        WHERE ch.seq > %s
+        ORDER BY ch.seq
+        LIMIT %s
+        """,
+        (since, limit),
+    )
+    return [
+        {
+            "seq": r["seq"],
+            "id_application": r["id_application"],
+            "kind": r["kind"],
+            "status": r["status"],
+        }
+        for r in cur.fetchall()
+    ]
+
+
+class ChangeFeed:
+    """One poller thread shared by every SSE subscriber.
+
+    The thread only runs queries while someone is subscribed and keeps the
+    last CHANGE_FEED_BUFFER changes in memory; a subscriber that fell
+    further behind is told to resync through the changes endpoint.
+    """
+
+    def __init__(self, poll_interval=2):
+        self.poll_interval = float(poll_interval)
+        self._cond = threading.Condition()
+        self._recent = collections.deque(maxlen=CHANGE_FEED_BUFFER)
+        self._seq = None
+        # changes after _floor are all in _recent
+        self._floor = None
+        self._subscribers = 0
+        self._thread = None
+
+    def subscribe(self) -> None:
+        with self._cond:
+            self._subscribers += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="change-feed", daemon=True
+                )
+                self._thread.start()
+            self._cond.notify_all()
+
+    def unsubscribe(self) -> None:
+        with self._cond:
+            self._subscribers -= 1
+
+    def wait(self, after: int, timeout: float) -> tuple[list, int, bool]:
+        """Block until there are changes after `after` or `timeout` passes.
+
+        Returns (changes, latest seq, gap) where gap means changes after
+        `after` are no longer buffered.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._seq is not None and self._seq > after, timeout
+            )
+            if self._seq is None:
+                return [], after, False
+            if after < self._floor:
+                return [], self._seq, True
+            changes = [c for c in self._recent if c["seq"] > after]
+            return changes, self._seq, False
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._subscribers > 0)
+                seq = self._seq
+            try:
+                with app.app_context():
+                    cur = get_db().cursor(dictionary=True)
+                    try:
+                        if seq is None:
+                            changes = []
+                            seq = _latest_change_seq(cur)
+                        else:
+                            changes = _changes_since(cur, seq)
+                    finally:
+                        cur.close()
+            except Exception as e:
+                print("change feed poll failed:", e)
+                time.sleep(self.poll_interval)
+                continue
+            with self._cond:
+                first = self._seq is None
+                if first:
+                    self._floor = seq
+                self._recent.extend(changes)
+                if len(self._recent) == self._recent.maxlen:
+                    self._floor = self._recent[0]["seq"] - 1
+                self._seq = changes[-1]["seq"] if changes else seq
+                if changes or first:
+                    self._cond.notify_all()
+            if len(changes) < CHANGE_FEED_LIMIT:
+                time.sleep(self.poll_interval)
+
+
+change_feed = ChangeFeed(poll_interval=app.config["CHANGE_FEED_POLL_INTERVAL"])
+
+
+### Keyset pagination helpers
+# Dashboards are ordered newest first by (creation_date, id_application).
+# Cursors are opaque url-safe tokens carrying that key for a boundary row.
+
+
+def _encode_cursor(row: dict) -> str:
+    key = [str(row.get("creation_date")), int(row.get("id_application"))]
+    raw = json.dumps(key, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _decode_cursor(token: str | None) -> tuple[datetime, int] | None:
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        created, app_id = json.loads(raw)
+        return datetime.fromisoformat(created), int(app_id)
+    except Exception:
+        return None
+
+
+def _fetch_application_page(
+    cur,
+    select_sql: str,
+    where_clauses: list,
+    params: list,
+    page: int,
+    per_page: int,
+    total: int,
+    after: str | None = None,
+    before: str | None = None,
+    exact_total: bool = False,
+):
+    """Fetch one dashboard page; return (rows, prev_cursor, next_cursor).
+
+    With an `after`/`before` cursor the page is located by a range scan on
+    (creation_date, id_application), so its cost does not depend on how
+    deep the page is. Without one, `page` is used: the first and last page
+    are read from either end of the index and only pages in between fall
+    back to OFFSET. Unless `exact_total` is set, `total` is taken as an
+    estimate and the rows are counted before the tail is cut.
+    """
+    after_key = _decode_cursor(after)
+    before_key = _decode_cursor(before)
+    total = max(0, total)
+    total_pages = max(1, (total + per_page - 1) // per_page)
+    clauses = list(where_clauses)
+    params = list(params)
+    descending = True
+    limit = per_page + 1
+    offset = 0
+    if after_key:
+        clauses.append(
+            "(a.creation_date < %s OR "
+            "(a.creation_date = %s AND a.id_application < %s))"
+        )
+        params.extend([after_key[0], after_key[0], after_key[1]])
+    elif before_key:
+        clauses.append(
+            "(a.creation_date > %s OR "
+            "(a.creation_date = %s AND a.id_application > %s))"
+        )
+        params.extend([before_key[0], before_key[0], before_key[1]])
+        descending = False
+    elif page > 1 and page >= total_pages:
+        if not exact_total:
+            # the size of the tail decides where it meets the page before
+            # it, so a drifted counter must not set it
+            from_sql = select_sql.partition("FROM")[2].strip()
+            where_sql = " AND ".join(clauses) if clauses else "1"
+            cur.execute(
+                f"SELECT COUNT(*) AS cnt FROM {from_sql} WHERE {where_sql}",
+                tuple(params),
+            )
+            row = cur.fetchone()
+            total = row["cnt"] if row else 0
+            total_pages = max(1, (total + per_page - 1) // per_page)
+        if page < total_pages:
+            offset = (page - 1) * per_page
+        else:
+            # last page: read the tail from the other end of the index
+            descending = False
+            limit = max(0, total - (total_pages - 1) * per_page)
+            if page > total_pages:
+                limit = 0
+    else:
+        offset = (page - 1) * per_page
+
+    direction = "DESC" if descending else "ASC"
+    where_sql = " AND ".join(clauses) if clauses else "1"
+    cur.execute(
+        f"{select_sql} WHERE {where_sql} "
+        f"ORDER BY a.creation_date {direction}, a.id_application {direction} "
+        "LIMIT %s OFFSET %s",
+        tuple(params + [limit, offset]),
+    )
+    rows = cur.fetchall()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if not descending:
+        rows.reverse()
+    if not rows:
+        return rows, None, None
+
+    if after_key:
+        has_prev, has_next = True, more
+    elif before_key:
+        has_prev, has_next = more, True
+    else:
+        has_prev = page > 1
+        has_next = offset + len(rows) < total and page < total_pages
+    prev_cursor = _encode_cursor(rows[0]) if has_prev else None
+    next_cursor = _encode_cursor(rows[-1]) if has_next else None
+    return rows, prev_cursor, next_cursor
+
+
+### Responsive images
+# `flask build-images` turns the photos in static/img into AVIF/WebP/JPEG
+# variants at RESPONSIVE_IMAGE_WIDTHS, named after a hash of the source so
+# they can be cached forever, and records them in a manifest. Templates
+# call `responsive_image()`, which falls back to the original file when
+# the variants have not been built.
+RESPONSIVE_IMAGE_SOURCE_DIR = os.path.join(app.static_folder, "img")
+RESPONSIVE_IMAGE_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "data", "img"
+)
+RESPONSIVE_IMAGE_MANIFEST = os.path.join(RESPONSIVE_IMAGE_DIR, "manifest.json")
+RESPONSIVE_IMAGE_WIDTHS = (480, 960, 1600)
+# fallback <img src> for browsers without srcset support
+RESPONSIVE_IMAGE_DEFAULT_WIDTH = 960
+_RESPONSIVE_FORMATS = (
+    # (manifest key, Pillow format, file extension, MIME type)
+    ("avif", "AVIF", "avif", "image/avif"),
+    ("webp", "WEBP", "webp", "image/webp"),
+    ("jpeg", "JPEG", "jpg", "image/jpeg"),
+)
+_image_manifest = {"mtime": None, "entries": {}}
+_image_manifest_lock = threading.Lock()
+
+
+def _load_image_manifest() -> dict:
+    """Return the image manifest, re-reading it when the file changes."""
+    try:
+        mtime = os.path.getmtime(RESPONSIVE_IMAGE_MANIFEST)
+    except OSError:
+        return {}
+    with _image_manifest_lock:
+        if _image_manifest["mtime"] != mtime:
+            try:
+                with open(RESPONSIVE_IMAGE_MANIFEST, encoding="utf-8") as f:
+                    _image_manifest["entries"] = json.load(f)
+            except (OSError, ValueError) as e:
+                print("Could not read image manifest:", e)
+                _image_manifest["entries"] = {}
+            _image_manifest["mtime"] = mtime
+        return _image_manifest["entries"]
+
+
+def _html_attrs(attrs: dict) -> str:
+    return " ".join(
+        f'{k.replace("_", "-")}="{markupsafe.escape(v)}"'
+        for k, v in attrs.items()
+        if v is not None
+    )
+
+
+@app.template_global()
+def responsive_image(filename: str, alt: str = "", sizes="100vw", **attrs):
+    """Render a <picture> for static/img/<filename> with srcset variants.
+
+    Extra keyword arguments become <img> attributes (underscores turn into
+    dashes); images are lazy-loaded unless `loading` says otherwise.
+    """
+    attrs = {"alt": alt, "loading": "lazy", "decoding": "async", **attrs}
+    entry = _load_image_manifest().get(filename)
+    if not entry:
+        attrs["src"] = flask.url_for("static", filename=f"img/{filename}")
+        return markupsafe.Markup(f"<img {_html_attrs(attrs)} />")
+
+    def srcset(variants):
+        return ", ".join(
+            f"{flask.url_for('responsive_image_file', filename=name)} {w}w"
+            for w, name in variants
+        )
+
+    sources = []
+    for key, _, _, mime in _RESPONSIVE_FORMATS[:-1]:
+        if entry["variants"].get(key):
+            sources.append(
+                "<source "
+                + _html_attrs(
+                    {
+                        "type": mime,
+                        "srcset": srcset(entry["variants"][key]),
+                        "sizes": sizes,
+                    }
+                )
+                + " />"
+            )
+    jpeg = entry["variants"]["jpeg"]
+    fallback = [
+        name for w, name in jpeg if w <= RESPONSIVE_IMAGE_DEFAULT_WIDTH
+    ] or [jpeg[0][1]]
+    attrs.update(
+        src=flask.url_for("responsive_image_file", filename=fallback[-1]),
+        srcset=srcset(jpeg),
+        sizes=sizes,
+        width=entry["width"],
+        height=entry["height"],
+    )
+    return markupsafe.Markup(
+        f"<picture>{''.join(sources)}<img {_html_attrs(attrs)} /></picture>"
+    )
+
+
+@app.route("/img/<path:filename>")
+def responsive_image_file(filename: str):
+    """Serve a generated image variant; names change with the content."""
+    response = flask.send_from_directory(
+        RESPONSIVE_IMAGE_DIR, filename, max_age=365 * 24 * 3600
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def _build_responsive_image(path: str, widths, quality: int) -> dict:
+    """Write the variants of one source image; return its manifest entry."""
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(path))[0]
+    available = Image.registered_extensions().values()
+    formats = [f for f in _RESPONSIVE_FORMATS if f[1] in available]
+    with Image.open(path) as im:
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        width, height = im.size
+        # never upscale; the source width is the largest variant
+        targets = sorted({w for w in widths if w < width} | {width})
+        variants = {key: [] for key, _, _, _ in formats}
+        for w in targets:
+            resized = im
+            if w != width:
+                resized = im.resize(
+                    (w, max(1, round(height * w / width))), Image.LANCZOS
+                )
+            for key, fmt, ext, _ in formats:
+                name = f"{stem}.{digest}.{w}.{ext}"
+                out = os.path.join(RESPONSIVE_IMAGE_DIR, name)
+                if not os.path.exists(out):
+                    options = {"quality": quality}
+                    if fmt == "JPEG":
+                        options.update(optimize=True, progressive=True)
+                    elif fmt == "WEBP":
+                        options["method"] = 6
+                    fd, tmp = tempfile.mkstemp(
+                        dir=RESPONSIVE_IMAGE_DIR, suffix=".tmp"
+                    )
+                    try:
+                        with os.fdopen(fd, "wb") as f:
+                            resized.save(f, fmt, **options)
+                        os.replace(tmp, out)
+                    except Exception:
+                        os.remove(tmp)
+                        raise
+                variants[key].append([w, name])
+    return {"width": width, "height": height, "variants": variants}
+
+
+@app.cli.command("build-images")
+@click.option("--quality", type=int, default=75, show_default=True)
+def build_images_command(quality):
+    """Generate responsive variants of the images in static/img."""
+    if Image is None:
+        raise click.ClickException("Pillow is required to build images")
+    os.makedirs(RESPONSIVE_IMAGE_DIR, exist_ok=True)
+    manifest = {}
+    for fname in sorted(os.listdir(RESPONSIVE_IMAGE_SOURCE_DIR)):
+        if not fname.lower().endswith((".jpg", ".jpeg", ".png")):
+            continue
+        src = os.path.join(RESPONSIVE_IMAGE_SOURCE_DIR, fname)
+        manifest[fname] = _build_responsive_image(
+            src, RESPONSIVE_IMAGE_WIDTHS, quality
+        )
+        sizes = {
+            key: sum(
+                os.path.getsize(os.path.join(RESPONSIVE_IMAGE_DIR, name))
+                for _, name in items
+            )
+            for key, items in manifest[fname]["variants"].items()
+        }
+        click.echo(
+            f"{fname}: {os.path.getsize(src)} bytes -> "
+            + ", ".join(f"{k} {v}" for k, v in sizes.items())
+        )
+    # drop variants of images that changed or disappeared
+    keep = {
+        name
+        for entry in manifest.values()
+        for items in entry["variants"].values()
+        for _, name in items
+    }
+    for fname in os.listdir(RESPONSIVE_IMAGE_DIR):
+        if fname != "manifest.json" and fname not in keep:
+            os.remove(os.path.join(RESPONSIVE_IMAGE_DIR, fname))
+    tmp = RESPONSIVE_IMAGE_MANIFEST + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, RESPONSIVE_IMAGE_MANIFEST)
+    click.echo(f"wrote {len(manifest)} images to {RESPONSIVE_IMAGE_DIR}")
+
+
+### Static asset manifest
+# `flask build-assets` copies static/css and static/js to data/assets under
+# content-hashed names, with .gz (and .br when brotli is installed)
+# siblings, and writes a manifest. Templates link assets through
+# `asset_url()`; hashed files are served with an immutable Cache-Control,
+# so repeat visits need no requests for them.
+STATIC_ASSET_DIRS = ("css", "js")
+STATIC_ASSET_OUT_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "data", "assets"
+)
+STATIC_ASSET_MANIFEST = os.path.join(STATIC_ASSET_OUT_DIR, "manifest.json")
+STATIC_ASSET_MAX_AGE = 365 * 24 * 3600
+_asset_manifest = {"mtime": None, "entries": {}}
+_asset_manifest_lock = threading.Lock()
+
+
+def _load_asset_manifest() -> dict:
+    """Return {static path: hashed path}, re-reading it when it changes."""
+    try:
+        mtime = os.path.getmtime(STATIC_ASSET_MANIFEST)
+    except OSError:
+        return {}
+    with _asset_manifest_lock:
+        if _asset_manifest["mtime"] != mtime:
+            try:
+                with open(STATIC_ASSET_MANIFEST, encoding="utf-8") as f:
+                    _asset_manifest["entries"] = json.load(f)
+            except (OSError, ValueError) as e:
+                print("Could not read asset manifest:", e)
+                _asset_manifest["entries"] = {}
+            _asset_manifest["mtime"] = mtime
+        return _asset_manifest["entries"]
+
+
+@app.template_global()
+def asset_url(filename: str) -> str:
+    """URL of a static file, fingerprinted when the manifest lists it."""
+    hashed = _load_asset_manifest().get(filename)
+    if hashed is None:
+        return flask.url_for("static", filename=filename)
+    return flask.url_for("asset_file", filename=hashed)
+
+
+@app.route("/assets/<path:filename>")
+def asset_file(filename: str):
+    """Serve a fingerprinted asset, precompressed when the client allows."""
+    path = werkzeug.security.safe_join(STATIC_ASSET_OUT_DIR, filename)
+    if path is None or not os.path.isfile(path):
+        return flask.abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encoding = None
+    accept = flask.request.accept_encodings
+    for enc, ext in (("br", ".br"), ("gzip", ".gz")):
+        if accept[enc] > 0 and os.path.isfile(path + ext):
+            path, encoding = path + ext, enc
+            break
+    response = flask.send_file(
+        path, mimetype=mimetype, max_age=STATIC_ASSET_MAX_AGE, etag=False
+    )
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.cli.command("build-assets")
+def build_assets_command():
+    """Fingerprint and precompress static CSS and JS."""
+    manifest = {}
+    for sub in STATIC_ASSET_DIRS:
+        src_dir = os.path.join(app.static_folder, sub)
+        out_dir = os.path.join(STATIC_ASSET_OUT_DIR, sub)
+        os.makedirs(out_dir, exist_ok=True)
+        for fname in sorted(os.listdir(src_dir)):
+            src = os.path.join(src_dir, fname)
+            if not os.path.isfile(src):
+                continue
+            with open(src, "rb") as f:
+                data = f.read()
+            stem, ext = os.path.splitext(fname)
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            hashed = f"{sub}/{stem}.{digest}{ext}"
+            out = os.path.join(STATIC_ASSET_OUT_DIR, hashed)
+            outputs = {out: data, out + ".gz": gzip.compress(data, 9)}
+            if brotli is not None:
+                outputs[out + ".br"] = brotli.compress(data)
+            for target, content in outputs.items():
+                if os.path.exists(target):
+                    continue
+                tmp = target + ".tmp"
+                with open(tmp, "wb") as f:
+                    f.write(content)
+                os.replace(tmp, target)
+            manifest[f"{sub}/{fname}"] = hashed
+            click.echo(
+                f"{sub}/{fname} -> {hashed} ({len(data)} bytes, "
+                f"gzip {len(outputs[out + '.gz'])})"
+            )
+    # drop outputs of files that changed or disappeared
+    keep = set(manifest.values())
+    for sub in STATIC_ASSET_DIRS:
+        out_dir = os.path.join(STATIC_ASSET_OUT_DIR, sub)
+        for fname in os.listdir(out_dir):
+            base = re.sub(r"\.(gz|br)$", "", fname)
+            if f"{sub}/{base}" not in keep:
+                os.remove(os.path.join(out_dir, fname))
+    tmp = STATIC_ASSET_MANIFEST + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, STATIC_ASSET_MANIFEST)
+    click.echo(f"wrote {len(manifest)} assets to {STATIC_ASSET_OUT_DIR}")
+
+
+### Response compression and validators
+# CompressionMiddleware wraps app.wsgi_app so views need no changes: fully
+# buffered GET/HEAD responses of a text type get a strong ETag (answered
+# with 304 on a matching If-None-Match) and are gzip/brotli encoded when
+# they exceed COMPRESS_MIN_SIZE. A strong ETag set by the view (e.g.
+# send_file) gets the encoding appended so each representation keeps its
+# own validator. Streams (no Content-Length, e.g. SSE), other types such
+# as attachments, and already encoded bodies pass untouched.
+COMPRESS_MIMETYPES = (
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/xml",
+    "application/json",
+    "application/javascript",
+    "text/javascript",
+    "application/xml",
+    "image/svg+xml",
+)
+COMPRESS_MAX_BUFFER = 8 * 1024 * 1024
+# headers a 304 keeps from the full response
+_NOT_MODIFIED_DROP = ("content-length", "content-type", "content-encoding")
+
+
+class CompressionMiddleware:
+    """WSGI middleware adding strong ETags, 304s and gzip/br encoding."""
+
+    def __init__(self, wsgi_app, flask_app):
+        self.wsgi_app = wsgi_app
+        self.flask_app = flask_app
+
+    def __call__(self, environ, start_response):
+        config = self.flask_app.config
+        method = environ["REQUEST_METHOD"]
+        if not config["COMPRESS_ENABLED"] or method not in ("GET", "HEAD"):
+            return self.wsgi_app(environ, start_response)
+
+        captured, app_iter = self._run(environ, start_response)
+        if "status" not in captured or not self._eligible(
+            captured["status"], captured["headers"]
+        ):
+            if "status" in captured:
+                start_response(captured["status"], captured["headers"])
+            return app_iter
+        if method == "HEAD":
+            # only now render the GET body, so HEAD reports the same
+            # encoding, length and ETag; streams never get here
+            self._close(app_iter)
+            captured, app_iter = self._run(
+                dict(environ, REQUEST_METHOD="GET"), start_response
+            )
+            if "status" not in captured or not self._eligible(
+                captured["status"], captured["headers"]
+            ):
+                self._close(app_iter)
+                if "status" in captured:
+                    start_response(captured["status"], captured["headers"])
+                return []
+        try:
+            body = b"".join(app_iter)
+        finally:
+            self._close(app_iter)
+        return self._finish(
+            environ, start_response, captured, body, head=method == "HEAD"
+        )
+
+    def _run(self, environ, start_response) -> tuple[dict, object]:
+        """Call the app, holding back its status and headers."""
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            if exc_info is not None:
+                return start_response(status, headers, exc_info)
+            captured["status"] = status
+            captured["headers"] = headers
+            # a write() callable is never used by Flask responses
+            return lambda data: None
+
+        return captured, self.wsgi_app(environ, capture)
+
+    @staticmethod
+    def _close(app_iter) -> None:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+
+    @staticmethod
+    def _eligible(status: str, headers: list) -> bool:
+        if not status.startswith("200"):
+            return False
+        h = {k.lower(): v for k, v in headers}
+        mimetype = h.get("content-type", "").split(";")[0].strip().lower()
+        length = h.get("content-length")
+        return (
+            mimetype in COMPRESS_MIMETYPES
+            and "content-encoding" not in h
+            and "no-transform" not in h.get("cache-control", "")
+            and length is not None
+            and length.isdigit()
+            and int(length) <= COMPRESS_MAX_BUFFER
+        )
+
+    def _finish(self, environ, start_response, captured, body, head=False):
+        config = self.flask_app.config
+        headers = [
+            (k, v) for k, v in captured["headers"] if k.lower() != "vary"
+        ]
+        vary = [
+            v.strip()
+            for k, value in captured["headers"]
+            if k.lower() == "vary"
+            for v in value.split(",")
+            if v.strip()
+        ]
+
+        encoding = None
+        if len(body) >= config["COMPRESS_MIN_SIZE"]:
+            accept = werkzeug.http.parse_accept_header(
+                environ.get("HTTP_ACCEPT_ENCODING", "")
+            )
+            if brotli is not None and accept["br"] > 0:
+                encoding = "br"
+            elif accept["gzip"] > 0:
+                encoding = "gzip"
+            if "Accept-Encoding" not in vary:
+                vary.append("Accept-Encoding")
+        if vary:
+            headers.append(("Vary", ", ".join(vary)))
+
+        # strong validator per representation. A view's own weak ETag may
+        # cover every encoding and is kept; a strong one is made specific
+        # to the encoding, which the view cannot match, so conditional
+        # requests for it are answered here
+        etag = None
+        own = [v for k, v in headers if k.lower() == "etag"]
+        if not own:
+            digest = hashlib.sha1(body).hexdigest()
+            etag = f"{digest}-{encoding}" if encoding else digest
+            headers.append(("ETag", werkzeug.http.quote_etag(etag)))
+        else:
+            value, weak = werkzeug.http.unquote_etag(own[0])
+            if value is not None and not weak and encoding:
+                etag = f"{value}-{encoding}"
+                headers = [(k, v) for k, v in headers if k.lower() != "etag"]
+                headers.append(("ETag", werkzeug.http.quote_etag(etag)))
+        if etag is not None:
+            if_none_match = werkzeug.http.parse_etags(
+                environ.get("HTTP_IF_NONE_MATCH")
+            )
+            if if_none_match.contains_weak(etag):
+                start_response(
+                    "304 NOT MODIFIED",
+                    [
+                        (k, v)
+                        for k, v in headers
+                        if k.lower() not in _NOT_MODIFIED_DROP
+                    ],
                 )
-    except Exception as e:
-        print(f"_write_sector_application: write tmp failed: {e}")
-        try:
-            tree.write(path, encoding="utf-8", xml_declaration=True)
-        except Exception as e2:
-            print(f"_write_sector_application: final write failed: {e2}")
+                return []
 
+        if encoding == "br":
+            body = brotli.compress(body, quality=config["COMPRESS_BR_QUALITY"])
+        elif encoding == "gzip":
+            body = gzip.compress(body, compresslevel=config["COMPRESS_LEVEL"])
+        if encoding:
+            headers = [
+                (k, v) for k, v in headers if k.lower() != "content-length"
+            ]
+            headers.append(("Content-Encoding", encoding))
+            headers.append(("Content-Length", str(len(body))))
+        start_response(captured["status"], headers)
+        return [] if head else [body]
 
-def _mark_application_revoked(app_id: int):
-    """Mark the application as revoked in any sector XML file where it exists."""
-    _ensure_xml_dir()
-    # scan files in XML_OUT_DIR
-    for fname in os.listdir(XML_OUT_DIR):
-        if not fname.endswith(".xml"):
-            continue
-        path = os.path.join(XML_OUT_DIR, fname)
-        try:
-            tree = ET.parse(path)
-            root = tree.getroot()
-        except Exception:
-            continue
-
-        changed = False
-        for el in root.findall("application"):
-            if el.get("id") == str(app_id):
-                # set attribute revoked and add revoked child with timestamp
-                if el.get("revoked") == "true":
-                    continue
-                el.set("revoked", "true")
-                rev = ET.SubElement(el, "revoked_at")
-                rev.text = datetime.utcnow().isoformat()
-                changed = True
 
-        if changed:
-            tmp = path + ".tmp"
-            try:
-                tree.write(tmp, encoding="utf-8", xml_declaration=True)
-                os.replace(tmp, path)
-            except Exception:
-                try:
-                    tree.write(path, encoding="utf-8", xml_declaration=True)
-                except Exception:
-                    pass
+app.wsgi_app = CompressionMiddleware(app.wsgi_app, app)
 
 
 @app.route("/")
@@ -504,7 +2864,12 @@ def login() -> flask.Response | str:
         cursor.close()
 
         if user_record:
-            user = User(str(user_record["id_citizen"]), "citizen")
+            user = User(
+                str(user_record["id_citizen"]),
+                "citizen",
+                user_record["first_name"] or "BRAK IMIENIA",
+            )
+            user_cache.put(user)
             flask.session["user_type"] = "citizen"
             flask_login.login_user(user)
             print(f"Zalogowano użytkownika: {user}")
@@ -535,7 +2900,12 @@ def login_staff() -> str:
         cursor.close()
 
         if user_record:
-            user = User(str(user_record["id_employee"]), "employee")
+            user = User(
+                str(user_record["id_employee"]),
+                "employee",
+                user_record["first_name"] or "BRAK IMIENIA",
+            )
+            user_cache.put(user)
             flask.session["user_type"] = "employee"
             flask_login.login_user(user)
             print(f"Zalogowano urzędnika: {user}")
@@ -551,6 +2921,8 @@ def login_staff() -> str:
 @flask_login.login_required
 def logout() -> flask.Response:
     """Logs out the current user."""
+    user = flask_login.current_user
+    user_cache.invalidate(user.get_id(), user.type)
     flask_login.logout_user()
     return flask.redirect(flask.url_for("index"))
 
@@ -619,6 +2991,18 @@ def application_form() -> str:
         form = flask.request.form
         files = flask.request.files
 
+        # reject unsupported attachments before anything is written
+        upload = files.get("new_est_attachment")
+        upload_type = None
+        if upload and upload.filename:
+            upload_type = _upload_type(upload)
+            if upload_type not in ATTACHMENT_ALLOWED_TYPES:
+                return flask.render_template(
+                    "application_form.html",
+                    estates=[],
+                    error="Nieprawidłowy typ pliku (dozwolone: pdf, jpg, png)",
+                )
+
         id_estate = form.get("id_estate")
         # if adding new estate, insert into estate table
         if id_estate == "new":
@@ -681,21 +3065,39 @@ def application_form() -> str:
                 bag_count = 1
             if bag_count < 1:
                 bag_count = 1
-            cur.execute(
-                "INSERT INTO application (id_estate, id_citizen, status, bag_count, bag_arrival_date, bag_depart_date, notes) VALUES (%s, %s, %s, %s, %s, %s, %s)",
-                (
-                    id_estate,
-                    flask_login.current_user.id,
-                    "awaiting",
-                    bag_count,
-                    bag_arrival,
-                    bag_depart,
-                    notes,
-                ),
-            )
-            db.commit()
-            id_application = cur.lastrowid
-            cur.close()
+            # ledger update and application insert commit together
+            db.start_transaction()
+            try:
+                free_bags, paid_bags, creation_date = _reserve_bags(
+                    cur, id_estate, bag_count
+                )
+                cur.execute(
+                    "INSERT INTO application (id_estate, id_citizen, status, bag_count, free_bags, paid_bags, bag_arrival_date, bag_depart_date, notes, creation_date) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                    (
+                        id_estate,
+                        flask_login.current_user.id,
+                        "awaiting",
+                        bag_count,
+                        free_bags,
+                        paid_bags,
+                        bag_arrival,
+                        bag_depart,
+                        notes,
+                        creation_date,
+                    ),
+                )
+                id_application = cur.lastrowid
+                _index_application(cur, id_application)
+                _move_status_count(
+                    cur, flask_login.current_user.id, None, "awaiting"
+                )
+                _log_changes(cur, [id_application], "created")
+                db.commit()
+            except mysql.connector.Error:
+                db.rollback()
+                raise
+            finally:
+                cur.close()
         except mysql.connector.Error as err:
             print("Error inserting application:", err)
             return flask.render_template(
@@ -704,28 +3106,31 @@ def application_form() -> str:
                 error="Błąd przy tworzeniu wniosku",
             )
 
-        # handle attachment file (if provided)
-        if "new_est_attachment" in files:
-            f = files["new_est_attachment"]
-            if f and f.filename:
-                data = f.read()
+        # handle attachment file (if provided); the upload is already
+        # spooled to disk and hashed by UploadSpool
+        if upload and upload.filename:
+            try:
+                db = get_db()
+                cur = db.cursor()
+                db.start_transaction()
                 try:
-                    db = get_db()
-                    cur = db.cursor()
-                    cur.execute(
-                        "INSERT INTO attachment (id_application, file_name, file_type, file_data) VALUES (%s, %s, %s, %s)",
-                        (
-                            id_application,
-                            f.filename,
-                            f.content_type or "",
-                            data,
-                        ),
+                    get_attachment_store().save(
+                        cur,
+                        id_application,
+                        upload.filename,
+                        upload_type,
+                        upload.stream,
                     )
+                    _log_changes(cur, [id_application], "attachment")
                     db.commit()
+                except Exception:
+                    db.rollback()
+                    raise
+                finally:
                     cur.close()
-                except mysql.connector.Error as err:
-                    print("Error inserting attachment:", err)
-                    # continue without failing the whole request
+            except (mysql.connector.Error, OSError) as err:
+                print("Error inserting attachment:", err)
+                # continue without failing the whole request
 
         return flask.redirect(flask.url_for("resident_dashboard"))
 
@@ -739,6 +3144,31 @@ def application_form() -> str:
     return flask.render_template("application_form.html", estates=estates)
 
 
+@app.errorhandler(werkzeug.exceptions.RequestEntityTooLarge)
+@app.errorhandler(werkzeug.exceptions.UnsupportedMediaType)
+def upload_rejected(error):
+    """Explain rejected uploads on the form instead of a bare 413/415.
+
+    Both are raised by `UploadSpool` while the body is still streaming in;
+    requests to any other endpoint get the default error page.
+    """
+    if flask.request.endpoint != "application_form":
+        return error
+    if isinstance(error, werkzeug.exceptions.UnsupportedMediaType):
+        message = "Nieprawidłowy typ pliku (dozwolone: pdf, jpg, png)"
+    else:
+        limit = app.config["ATTACHMENT_MAX_SIZE"]
+        if app.config["MAX_CONTENT_LENGTH"]:
+            limit = min(limit, app.config["MAX_CONTENT_LENGTH"])
+        message = f"Plik nie może być większy niż {limit / 2**20:g} MB"
+    return (
+        flask.render_template(
+            "application_form.html", estates=[], error=message
+        ),
+        error.code,
+    )
+
+
 @app.route("/panel/mieszkaniec")
 @flask_login.login_required
 def resident_dashboard() -> str:
@@ -747,11 +3177,10 @@ def resident_dashboard() -> str:
         return flask.redirect(flask.url_for("index"))
     # pagination and filters
     try:
-        page = int(flask.request.args.get("page", "1"))
+        page = max(1, int(flask.request.args.get("page", "1")))
     except ValueError:
         page = 1
     per_page = 25
-    offset = (page - 1) * per_page
 
     status_filter = flask.request.args.get("status")
     q = flask.request.args.get("q", "").strip()
@@ -774,360 +3203,653 @@ def resident_dashboard() -> str:
 
         where_sql = " AND ".join(where_clauses)
 
-        # total count
-        count_sql = f"SELECT COUNT(*) as cnt FROM application a LEFT JOIN estate e ON a.id_estate = e.id_estate WHERE {where_sql}"
-        cur.execute(count_sql, tuple(params))
-        row = cur.fetchone()
-        total = row["cnt"] if row and "cnt" in row else 0
+        # total count: maintained counters unless a search narrows it down
+        status_counts = _status_counts(cur, flask_login.current_user.id)
+        exact_total = not status_counts or bool(q)
+        if not exact_total:
+            total = (
+                status_counts.get(status_filter, 0)
+                if status_filter
+                else sum(status_counts.values())
+            )
+        else:
+            count_sql = f"SELECT COUNT(*) as cnt FROM application a LEFT JOIN estate e ON a.id_estate = e.id_estate WHERE {where_sql}"
+            cur.execute(count_sql, tuple(params))
+            row = cur.fetchone()
+            total = row["cnt"] if row and "cnt" in row else 0
 
-        # paginated fetch
-        fetch_sql = f"""
+        # page fetch (keyset when a cursor is given)
+        select_sql = """
             SELECT a.*, e.id_sector, s.managing_company, s.company_address, s.company_hours, e.street, e.building_number, e.apartment_number
             FROM application a
             LEFT JOIN estate e ON a.id_estate = e.id_estate
             LEFT JOIN sector s ON e.id_sector = s.id_sector
-            WHERE {where_sql}
-            ORDER BY a.creation_date DESC
-            LIMIT %s OFFSET %s
             """
-        fetch_params = tuple(params + [per_page, offset])
-        cur.execute(fetch_sql, fetch_params)
-        applications = cur.fetchall()
+        applications, prev_cursor, next_cursor = _fetch_application_page(
+            cur,
+            select_sql,
+            where_clauses,
+            params,
+            page,
+            per_page,
+            total,
+            after=flask.request.args.get("after"),
+            before=flask.request.args.get("before"),
+            exact_total=exact_total,
+        )
 
-        # attach computed free/paid bag counts so staff can see which bags are paid
-        if applications:
-            try:
-                applications = [dict(a) for a in applications]
-            except Exception:
-                pass
+        # one free bag per estate per calendar year, allocated for the page
+        compute_free_paid(applications)
 
-            db = get_db()
-            sum_cur = db.cursor(dictionary=True)
-            try:
-                for a in applications:
-                    estate_id = a.get("id_estate")
-                    creation = a.get("creation_date")
-                    app_id = a.get("id_application")
-                    bag_count = int(a.get("bag_count") or 0)
-
-                    sum_sql = (
-                        "SELECT COALESCE(SUM(bag_count),0) as prior_bags "
-                        "FROM application "
-                        "WHERE id_estate = %s AND YEAR(creation_date) = YEAR(%s) "
-                        "AND (creation_date < %s OR (creation_date = %s AND id_application < %s))"
-                    )
-                    sum_cur.execute(
-                        sum_sql,
-                        (estate_id, creation, creation, creation, app_id),
-                    )
-                    srow = sum_cur.fetchone()
-                    prior_bags = (
-                        srow["prior_bags"]
-                        if srow and "prior_bags" in srow
-                        else 0
-                    )
+        # fetch attachments for listed applications
+        app_ids = (
+            [a["id_application"] for a in applications] if applications else []
+        )
+        attachments_map = {}
+        if app_ids:
+            format_strings = ",".join(["%s"] * len(app_ids))
+            cur.execute(
+                f"SELECT id_attachment, id_application, file_name, file_type FROM attachment WHERE id_application IN ({format_strings})",
+                tuple(app_ids),
+            )
+            atts = cur.fetchall()
+            for att in atts:
+                attachments_map.setdefault(att["id_application"], []).append(
+                    att
+                )
+    finally:
+        cur.close()
 
-                    free_remaining = max(0, 1 - int(prior_bags or 0))
-                    free_for_this = min(free_remaining, bag_count)
-                    paid_for_this = bag_count - free_for_this
+    total_pages = max(1, (total + per_page - 1) // per_page)
 
-                    a["free_bags"] = free_for_this
-                    a["paid_bags"] = paid_for_this
-            finally:
-                sum_cur.close()
+    return flask.render_template(
+        "resident_dashboard.html",
+        applications=applications,
+        attachments_map=attachments_map,
+        page=page,
+        total_pages=total_pages,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor,
+        status_counts=status_counts,
+        status_filter=status_filter,
+        q=q,
+    )
+    # Serve attachment bytes endpoint
 
-        # ensure applications are plain dicts so templates can read computed keys
-        if applications:
-            try:
-                applications = [dict(a) for a in applications]
-            except Exception:
-                pass
 
-        # compute free/paid bags for staff view (one free bag per estate per calendar year)
-        if applications:
-            db = get_db()
-            sum_cur = db.cursor(dictionary=True)
-            try:
-                for a in applications:
-                    estate_id = a.get("id_estate")
-                    creation = a.get("creation_date")
-                    app_id = a.get("id_application")
-                    bag_count = int(a.get("bag_count") or 0)
-
-                    sum_sql = (
-                        "SELECT COALESCE(SUM(bag_count),0) as prior_bags "
-                        "FROM application "
-                        "WHERE id_estate = %s AND YEAR(creation_date) = YEAR(%s) "
-                        "AND (creation_date < %s OR (creation_date = %s AND id_application < %s))"
-                    )
-                    sum_cur.execute(
-                        sum_sql,
-                        (estate_id, creation, creation, creation, app_id),
-                    )
-                    srow = sum_cur.fetchone()
-                    prior_bags = (
-                        srow["prior_bags"]
-                        if srow and "prior_bags" in srow
-                        else 0
-                    )
+### Attachment storage
+# New attachment bytes go to the backend named by ATTACHMENT_STORAGE. Reads
+# follow the row: attachments with a content_hash live in the filesystem
+# store, older rows still carry their bytes in attachment.file_data.
+ATTACHMENT_CHUNK_SIZE = 256 * 1024
+ATTACHMENT_STORE_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "data", "attachments"
+)
 
-                    free_remaining = max(0, 1 - int(prior_bags or 0))
-                    free_for_this = min(free_remaining, bag_count)
-                    paid_for_this = bag_count - free_for_this
 
-                    a["free_bags"] = free_for_this
-                    a["paid_bags"] = paid_for_this
-            finally:
-                sum_cur.close()
+ATTACHMENT_ALLOWED_TYPES = ("application/pdf", "image/jpeg", "image/png")
 
-        # normalize rows to plain dicts so we can attach computed keys
-        if applications:
-            try:
-                applications = [dict(a) for a in applications]
-            except Exception:
-                # if conversion fails, keep original
-                pass
 
-        # Compute paid/free bags per application (one free bag per estate per calendar year)
-        if applications:
-            db = get_db()
-            sum_cur = db.cursor(dictionary=True)
-            try:
-                for a in applications:
-                    estate_id = (
-                        a.get("id_estate")
-                        if isinstance(a, dict)
-                        else a["id_estate"]
-                    )
-                    creation = (
-                        a.get("creation_date")
-                        if isinstance(a, dict)
-                        else a["creation_date"]
-                    )
-                    app_id = (
-                        a.get("id_application")
-                        if isinstance(a, dict)
-                        else a["id_application"]
-                    )
-                    bag_count = int(
-                        (
-                            a.get("bag_count")
-                            if isinstance(a, dict)
-                            else a["bag_count"]
-                        )
-                        or 0
-                    )
+def _sniff_type(head: bytes) -> str | None:
+    """Return the MIME type of an allowed upload from its first bytes."""
+    if head.startswith(b"%PDF-"):
+        return "application/pdf"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    return None
 
-                    sum_sql = (
-                        "SELECT COALESCE(SUM(bag_count),0) as prior_bags "
-                        "FROM application "
-                        "WHERE id_estate = %s AND YEAR(creation_date) = YEAR(%s) "
-                        "AND (creation_date < %s OR (creation_date = %s AND id_application < %s))"
-                    )
-                    sum_cur.execute(
-                        sum_sql,
-                        (estate_id, creation, creation, creation, app_id),
-                    )
-                    srow = sum_cur.fetchone()
-                    prior_bags = (
-                        srow["prior_bags"]
-                        if srow and "prior_bags" in srow
-                        else 0
-                    )
 
-                    free_remaining = max(0, 1 - int(prior_bags or 0))
-                    free_for_this = min(free_remaining, bag_count)
-                    paid_for_this = bag_count - free_for_this
+def _discard_spool(file, path: str) -> None:
+    file.close()
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
 
-                    # attach values
-                    try:
-                        a["free_bags"] = free_for_this
-                        a["paid_bags"] = paid_for_this
-                    except Exception:
-                        # ignore if row type isn't mutable
-                        pass
-            finally:
-                sum_cur.close()
 
-        # Compute paid/free bags per application (one free bag per estate per calendar year)
-        if applications:
-            db = get_db()
-            sum_cur = db.cursor(dictionary=True)
-            try:
-                for a in applications:
-                    try:
-                        estate_id = a.get("id_estate")
-                        creation = a.get("creation_date")
-                        app_id = a.get("id_application")
-                        bag_count = int(a.get("bag_count") or 0)
-                    except Exception:
-                        # fallback defaults
-                        estate_id = a.get("id_estate")
-                        creation = a.get("creation_date")
-                        app_id = a.get("id_application")
-                        bag_count = a.get("bag_count") or 0
-
-                    sum_sql = (
-                        "SELECT COALESCE(SUM(bag_count),0) as prior_bags "
-                        "FROM application "
-                        "WHERE id_estate = %s AND YEAR(creation_date) = YEAR(%s) "
-                        "AND (creation_date < %s OR (creation_date = %s AND id_application < %s))"
-                    )
-                    sum_cur.execute(
-                        sum_sql,
-                        (estate_id, creation, creation, creation, app_id),
-                    )
-                    srow = sum_cur.fetchone()
-                    prior_bags = (
-                        srow["prior_bags"]
-                        if srow and "prior_bags" in srow
-                        else 0
-                    )
+class UploadSpool:
+    """Temporary file that receives an uploaded file part as it streams in.
 
-                    free_remaining = max(0, 1 - int(prior_bags or 0))
-                    free_for_this = min(free_remaining, bag_count)
-                    paid_for_this = bag_count - free_for_this
+    Installed as werkzeug's file stream factory (see `BigBagRequest`), so
+    the upload is hashed, measured and sniffed in the same pass that spools
+    it to disk, and the size limit and allowed types are enforced before
+    the body is fully read. The spool lives inside the attachment store so
+    it can be linked into place without copying.
+    """
 
-                    a["free_bags"] = free_for_this
-                    a["paid_bags"] = paid_for_this
-            finally:
-                sum_cur.close()
+    HEAD_SIZE = 8
 
-        # Compute paid/free bags per application (one free bag per estate per calendar year)
-        if applications:
-            db = get_db()
-            sum_cur = db.cursor(dictionary=True)
-            try:
-                for a in applications:
-                    try:
-                        estate_id = a.get("id_estate")
-                        creation = a.get("creation_date")
-                        app_id = a.get("id_application")
-                        bag_count = int(a.get("bag_count") or 0)
-                    except Exception:
-                        # fallback defaults
-                        estate_id = a.get("id_estate")
-                        creation = a.get("creation_date")
-                        app_id = a.get("id_application")
-                        bag_count = a.get("bag_count") or 0
-
-                    sum_sql = (
-                        "SELECT COALESCE(SUM(bag_count),0) as prior_bags "
-                        "FROM application "
-                        "WHERE id_estate = %s AND YEAR(creation_date) = YEAR(%s) "
-                        "AND (creation_date < %s OR (creation_date = %s AND id_application < %s))"
-                    )
-                    sum_cur.execute(
-                        sum_sql,
-                        (estate_id, creation, creation, creation, app_id),
-                    )
-                    srow = sum_cur.fetchone()
-                    prior_bags = (
-                        srow["prior_bags"]
-                        if srow and "prior_bags" in srow
-                        else 0
-                    )
+    def __init__(self, limit: int):
+        tmp_dir = os.path.join(ATTACHMENT_STORE_DIR, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, self.name = tempfile.mkstemp(dir=tmp_dir, prefix="up-")
+        self._file = os.fdopen(fd, "w+b")
+        # removed on close(), or when the spool is collected without one
+        self._discard = weakref.finalize(
+            self, _discard_spool, self._file, self.name
+        )
+        self._digest = hashlib.sha256()
+        self.limit = limit
+        self.size = 0
+        self.head = b""
+
+    def write(self, data) -> int:
+        self.size += len(data)
+        if self.size > self.limit:
+            raise werkzeug.exceptions.RequestEntityTooLarge()
+        if len(self.head) < self.HEAD_SIZE:
+            self.head += bytes(data[: self.HEAD_SIZE - len(self.head)])
+            if len(self.head) == self.HEAD_SIZE and self.sniffed_type is None:
+                raise werkzeug.exceptions.UnsupportedMediaType()
+        self._digest.update(data)
+        return self._file.write(data)
+
+    @property
+    def content_hash(self) -> str:
+        return self._digest.hexdigest()
+
+    @property
+    def sniffed_type(self) -> str | None:
+        return _sniff_type(self.head)
+
+    def close(self) -> None:
+        self._discard()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class BigBagRequest(flask.Request):
+    def _get_file_stream(
+        self,
+        total_content_length,
+        content_type,
+        filename=None,
+        content_length=None,
+    ):
+        return UploadSpool(app.config["ATTACHMENT_MAX_SIZE"])
 
-                    free_remaining = max(0, 1 - int(prior_bags or 0))
-                    free_for_this = min(free_remaining, bag_count)
-                    paid_for_this = bag_count - free_for_this
 
-                    a["free_bags"] = free_for_this
-                    a["paid_bags"] = paid_for_this
-            finally:
-                sum_cur.close()
+app.request_class = BigBagRequest
 
-        # Compute paid/free bags per application (one free bag per estate per calendar year)
-        if applications:
-            db = get_db()
-            sum_cur = db.cursor(dictionary=True)
-            try:
-                for a in applications:
-                    try:
-                        estate_id = a.get("id_estate")
-                        creation = a.get("creation_date")
-                        app_id = a.get("id_application")
-                        bag_count = int(a.get("bag_count") or 0)
-                    except Exception:
-                        # fallback defaults
-                        estate_id = a.get("id_estate")
-                        creation = a.get("creation_date")
-                        app_id = a.get("id_application")
-                        bag_count = a.get("bag_count") or 0
-
-                    # prior bags in same calendar year and earlier than this application
-                    sum_sql = (
-                        "SELECT COALESCE(SUM(bag_count),0) as prior_bags "
-                        "FROM application "
-                        "WHERE id_estate = %s AND YEAR(creation_date) = YEAR(%s) "
-                        "AND (creation_date < %s OR (creation_date = %s AND id_application < %s))"
-                    )
-                    sum_cur.execute(
-                        sum_sql,
-                        (estate_id, creation, creation, creation, app_id),
-                    )
-                    srow = sum_cur.fetchone()
-                    prior_bags = (
-                        srow["prior_bags"]
-                        if srow and "prior_bags" in srow
-                        else 0
-                    )
 
-                    free_remaining = max(0, 1 - int(prior_bags or 0))
-                    free_for_this = min(free_remaining, bag_count)
-                    paid_for_this = bag_count - free_for_this
+def _upload_type(upload) -> str | None:
+    """Return the sniffed MIME type of an uploaded FileStorage."""
+    stream = upload.stream
+    if isinstance(stream, UploadSpool):
+        return stream.sniffed_type
+    head = stream.read(UploadSpool.HEAD_SIZE)
+    stream.seek(0)
+    return _sniff_type(head)
 
-                    a["free_bags"] = free_for_this
-                    a["paid_bags"] = paid_for_this
-            finally:
-                sum_cur.close()
 
-        # fetch attachments for listed applications
-        app_ids = (
-            [a["id_application"] for a in applications] if applications else []
+class DatabaseAttachmentStore:
+    """Keeps attachment bytes in the attachment.file_data BLOB column.
+
+    The upload is read in BLOB_CHUNK_SIZE pieces: the first goes in with
+    the INSERT and the rest are appended to the BLOB, so only one piece is
+    held in memory or sent in a packet. Call inside a transaction.
+    """
+
+    BLOB_CHUNK_SIZE = 1024 * 1024
+
+    def save(self, cur, id_application, file_name, file_type, stream) -> int:
+        chunks = _read_chunks(stream, self.BLOB_CHUNK_SIZE)
+        data = next(chunks, b"")
+        cur.execute(
+            "INSERT INTO attachment (id_application, file_name, file_type, file_data, file_size) VALUES (%s, %s, %s, %s, %s)",
+            (id_application, file_name, file_type, data, len(data)),
         )
-        attachments_map = {}
-        if app_ids:
-            format_strings = ",".join(["%s"] * len(app_ids))
+        id_attachment = cur.lastrowid
+        for data in chunks:
             cur.execute(
-                f"SELECT id_attachment, id_application, file_name, file_type FROM attachment WHERE id_application IN ({format_strings})",
-                tuple(app_ids),
+                "UPDATE attachment SET file_data = CONCAT(file_data, %s), "
+                "file_size = file_size + %s WHERE id_attachment = %s",
+                (data, len(data), id_attachment),
             )
-            atts = cur.fetchall()
-            for att in atts:
-                attachments_map.setdefault(att["id_application"], []).append(
-                    att
+        return id_attachment
+
+
+class FilesystemAttachmentStore:
+    """Content-addressed attachment store on local disk.
+
+    Files are named by the SHA-256 of their content and sharded two levels
+    deep (ab/cd/abcd...), so identical uploads are stored once. MySQL only
+    keeps the hash, size and type.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, content_hash: str) -> str:
+        return os.path.join(
+            self.root, content_hash[:2], content_hash[2:4], content_hash
+        )
+
+    def put(self, chunks) -> tuple[str, int]:
+        """Store an iterable of byte chunks; return (sha256 hex, size)."""
+        tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as out:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            content_hash = digest.hexdigest()
+            target = self.path(content_hash)
+            if os.path.exists(target):
+                os.remove(tmp)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp, target)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return content_hash, size
+
+    def put_spool(self, spool: UploadSpool) -> tuple[str, int]:
+        """Link a fully received upload spool into the store."""
+        content_hash = spool.content_hash
+        target = self.path(content_hash)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            spool.flush()
+            try:
+                os.link(spool.name, target)
+            except FileExistsError:
+                pass
+        return content_hash, spool.size
+
+    def save(self, cur, id_application, file_name, file_type, stream) -> int:
+        if isinstance(stream, UploadSpool):
+            content_hash, size = self.put_spool(stream)
+        else:
+            content_hash, size = self.put(_read_chunks(stream))
+        cur.execute(
+            "INSERT INTO attachment (id_application, file_name, file_type, content_hash, file_size) VALUES (%s, %s, %s, %s, %s)",
+            (id_application, file_name, file_type, content_hash, size),
+        )
+        return cur.lastrowid
+
+
+attachment_files = FilesystemAttachmentStore(ATTACHMENT_STORE_DIR)
+
+
+def get_attachment_store():
+    """Return the backend that new attachments are written to."""
+    if app.config["ATTACHMENT_STORAGE"] == "database":
+        return DatabaseAttachmentStore()
+    return attachment_files
+
+
+def _read_chunks(stream, size=ATTACHMENT_CHUNK_SIZE):
+    return iter(lambda: stream.read(size), b"")
+
+
+@app.cli.command("attachments-migrate")
+@click.option("--batch-size", default=50, show_default=True)
+def attachments_migrate_command(batch_size):
+    """Move attachment BLOBs into the filesystem store in batches."""
+    db = get_db()
+    cur = db.cursor()
+    moved = 0
+    try:
+        while True:
+            cur.execute(
+                "SELECT id_attachment FROM attachment "
+                "WHERE content_hash IS NULL AND file_data IS NOT NULL "
+                "ORDER BY id_attachment LIMIT %s",
+                (batch_size,),
+            )
+            ids = [r[0] for r in cur.fetchall()]
+            if not ids:
+                break
+            updates = []
+            for attachment_id in ids:
+                content_hash, size = attachment_files.put(
+                    _stream_attachment_blob(attachment_id, 0, 2**63 - 1)
                 )
+                updates.append((content_hash, size, attachment_id))
+            cur.executemany(
+                "UPDATE attachment SET content_hash = %s, file_size = %s, "
+                "file_data = NULL WHERE id_attachment = %s",
+                updates,
+            )
+            db.commit()
+            moved += len(updates)
+            click.echo(f"moved {moved} attachments")
+    finally:
+        cur.close()
+    click.echo(f"done, {moved} attachments moved")
+
+
+def _stream_attachment_blob(attachment_id: int, start: int, stop: int):
+    """Yield bytes [start, stop) of an attachment BLOB in bounded chunks."""
+    db = get_db()
+    cur = db.cursor()
+    try:
+        pos = start
+        while pos < stop:
+            size = min(ATTACHMENT_CHUNK_SIZE, stop - pos)
+            cur.execute(
+                "SELECT SUBSTRING(file_data, %s, %s) FROM attachment "
+                "WHERE id_attachment = %s",
+                (pos + 1, size, attachment_id),
+            )
+            row = cur.fetchone()
+            chunk = bytes(row[0]) if row and row[0] else b""
+            if not chunk:
+                break
+            yield chunk
+            pos += len(chunk)
+    finally:
+        cur.close()
+
+
+def _attachment_response(
+    file_name: str, file_type: str, etag: str, last_modified, length, stream
+):
+    """Build a download response with validators and byte-range support.
+
+    `stream(start, stop)` must return an iterable over that byte range.
+    """
+    request = flask.request
+    if last_modified is not None and last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=UTC)
+    if not werkzeug.http.is_resource_modified(
+        request.environ, etag=etag, last_modified=last_modified
+    ):
+        resp = flask.Response(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    start, stop, status = 0, length, 200
+    rng = request.range
+    # request.if_range is an empty IfRange, not None, without the header
+    if_range = request.if_range
+    range_allowed = (if_range.etag is None and if_range.date is None) or (
+        if_range.etag == etag
+        or (
+            if_range.date is not None
+            and last_modified is not None
+            and if_range.date >= last_modified.replace(microsecond=0)
+        )
+    )
+    # multipart/byteranges is not supported; such requests get the full body
+    if rng is not None and range_allowed and len(rng.ranges) == 1:
+        bounds = rng.range_for_length(length)
+        if bounds is None:
+            resp = flask.Response(status=416)
+            resp.headers["Content-Range"] = f"bytes */{length}"
+            return resp
+        start, stop = bounds
+        status = 206
+
+    resp = flask.Response(
+        flask.stream_with_context(stream(start, stop)),
+        status=status,
+        mimetype=file_type,
+        direct_passthrough=True,
+    )
+    resp.content_length = stop - start
+    if status == 206:
+        resp.headers["Content-Range"] = f"bytes {start}-{stop - 1}/{length}"
+    resp.headers["Accept-Ranges"] = "bytes"
+    resp.set_etag(etag)
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    # attachments are personal data: only the browser may keep a copy
+    resp.headers["Cache-Control"] = "private, no-cache"
+    # suggest inline for images and PDFs, otherwise force download
+    if file_type.startswith("image/") or file_type == "application/pdf":
+        disposition = f'inline; filename="{file_name}"'
+    else:
+        disposition = f'attachment; filename="{file_name}"'
+    resp.headers["Content-Disposition"] = disposition
+    return resp
+
+
+@app.route("/attachment/<int:attachment_id>")
+@flask_login.login_required
+def serve_attachment(attachment_id: int):
+    """Stream attachment bytes with authorization checks.
+
+    Supports conditional GET (ETag/Last-Modified) and single byte ranges.
+    Files in the filesystem store are sent with `send_file`; legacy BLOBs
+    are read from MySQL in chunks instead of being loaded whole.
+    """
+    db = get_db()
+    cur = db.cursor(dictionary=True)
+    try:
+        cur.execute(
+            """
+            SELECT att.file_name, att.file_type, att.content_hash,
+                COALESCE(att.file_size, LENGTH(att.file_data)) AS file_size,
+                app.id_citizen, app.creation_date
+            FROM attachment att
+            JOIN application app ON att.id_application = app.id_application
+            WHERE att.id_attachment = %s
+            """,
+            (attachment_id,),
+        )
+        row = cur.fetchone()
     finally:
         cur.close()
+    if not row:
+        return flask.abort(404)
+
+    # Authorization: allow if current user is the owner (citizen) or an employee
+    owner_id = row["id_citizen"] if "id_citizen" in row else None
+    if flask_login.current_user.type == "citizen":
+        if str(owner_id) != str(flask_login.current_user.id):
+            return flask.abort(403)
+
+    file_name = row.get("file_name") or "attachment"
+    file_type = row.get("file_type") or "application/octet-stream"
+    content_hash = row.get("content_hash")
+    if content_hash:
+        # file responses use wsgi.file_wrapper (sendfile) where available
+        resp = flask.send_file(
+            attachment_files.path(content_hash),
+            mimetype=file_type,
+            as_attachment=not (
+                file_type.startswith("image/")
+                or file_type == "application/pdf"
+            ),
+            download_name=file_name,
+            conditional=True,
+            etag=content_hash,
+            last_modified=row.get("creation_date"),
+            max_age=None,
+        )
+        resp.headers["Cache-Control"] = "private, no-cache"
+        return resp
+
+    length = int(row.get("file_size") or 0)
+    # attachments are never modified in place, so id and size identify them
+    etag = f"att-{attachment_id}-{length}"
+
+    def stream(start, stop):
+        return _stream_attachment_blob(attachment_id, start, stop)
+
+    return _attachment_response(
+        file_name,
+        file_type,
+        etag,
+        row.get("creation_date"),
+        length,
+        stream,
+    )
+
+
+### Attachment previews
+# Downscaled renditions of image attachments and a raster of the first page
+# of PDFs, generated on first request and kept in an on-disk cache that is
+# trimmed (oldest first) to PREVIEW_CACHE_MAX_BYTES once a running size
+# total goes over it. Attachments never change, so previews are served
+# with long-lived cache headers.
+PREVIEW_CACHE_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "data", "previews"
+)
+PREVIEW_WIDTHS = (160, 1024)
+PREVIEW_MAX_AGE = 365 * 24 * 3600
+# seconds after which the running cache size is re-read from disk, since
+# other worker processes add previews too
+PREVIEW_CACHE_RESCAN = 300
+_preview_cache = {"bytes": None, "scanned": 0.0}
+_preview_cache_lock = threading.Lock()
+
+
+def _trim_preview_cache(limit: int) -> int:
+    """Delete least recently used previews until the cache fits `limit`.
+
+    Returns the size of the cache afterwards.
+    """
+    entries = []
+    total = 0
+    for name in os.listdir(PREVIEW_CACHE_DIR):
+        path = os.path.join(PREVIEW_CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if not os.path.isfile(path):
+            continue
+        entries.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+        total += st.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    return total
+
+
+def _preview_added(size: int) -> None:
+    """Account for a new preview; scan and trim only past the limit."""
+    limit = app.config["PREVIEW_CACHE_MAX_BYTES"]
+    with _preview_cache_lock:
+        age = time.monotonic() - _preview_cache["scanned"]
+        if _preview_cache["bytes"] is not None and age < PREVIEW_CACHE_RESCAN:
+            _preview_cache["bytes"] += size
+            if _preview_cache["bytes"] <= limit:
+                return
+        _preview_cache["bytes"] = _trim_preview_cache(limit)
+        _preview_cache["scanned"] = time.monotonic()
+
+
+def _render_preview(src: str, file_type: str, width: int, out: str) -> bool:
+    """Write a preview of `src` no wider than `width` to `out`."""
+    if file_type.startswith("image/"):
+        if Image is None:
+            return False
+        with Image.open(src) as img:
+            img = ImageOps.exif_transpose(img)
+            img.thumbnail((width, width * 4))
+            img.convert("RGB").save(out, "JPEG", quality=80, optimize=True)
+        return True
+    if file_type == "application/pdf":
+        pdftoppm = shutil.which("pdftoppm")
+        if pdftoppm is None:
+            return False
+        prefix = out + ".page"
+        subprocess.run(
+            [
+                pdftoppm,
+                "-f",
+                "1",
+                "-l",
+                "1",
+                "-jpeg",
+                "-singlefile",
+                "-scale-to-x",
+                str(width),
+                "-scale-to-y",
+                "-1",
+                src,
+                prefix,
+            ],
+            check=True,
+            timeout=30,
+            capture_output=True,
+        )
+        os.replace(prefix + ".jpg", out)
+        return True
+    return False
 
-    # compute free/paid bags for resident view
-    compute_free_paid(applications)
 
-    total_pages = max(1, (total + per_page - 1) // per_page)
+def _attachment_preview_path(row: dict, attachment_id: int, width: int):
+    """Return the cached preview path for an attachment, generating it."""
+    key = row.get("content_hash") or f"att-{attachment_id}"
+    path = os.path.join(PREVIEW_CACHE_DIR, f"{key}-{width}.jpg")
+    if os.path.exists(path):
+        return path
 
-    return flask.render_template(
-        "resident_dashboard.html",
-        applications=applications,
-        attachments_map=attachments_map,
-        page=page,
-        total_pages=total_pages,
-        status_filter=status_filter,
-        q=q,
-    )
-    # Serve attachment bytes endpoint
+    os.makedirs(PREVIEW_CACHE_DIR, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=PREVIEW_CACHE_DIR, suffix=".tmp")
+    os.close(fd)
+    src_tmp = None
+    try:
+        if row.get("content_hash"):
+            src = attachment_files.path(row["content_hash"])
+        else:
+            # legacy BLOB: spool it to a temp file for the renderer
+            fd, src_tmp = tempfile.mkstemp(dir=PREVIEW_CACHE_DIR)
+            with os.fdopen(fd, "wb") as out:
+                for chunk in _stream_attachment_blob(
+                    attachment_id, 0, 2**63 - 1
+                ):
+                    out.write(chunk)
+            src = src_tmp
+        if not _render_preview(src, row.get("file_type") or "", width, tmp):
+            return None
+        size = os.path.getsize(tmp)
+        os.replace(tmp, path)
+    except Exception as e:
+        print(f"preview failed for attachment {attachment_id}: {e}")
+        return None
+    finally:
+        for leftover in (tmp, src_tmp):
+            if leftover and os.path.exists(leftover):
+                os.remove(leftover)
+    _preview_added(size)
+    return path
 
 
-@app.route("/attachment/<int:attachment_id>")
+@app.route("/attachment/<int:attachment_id>/preview")
 @flask_login.login_required
-def serve_attachment(attachment_id: int):
-    """Return raw attachment bytes with authorization checks."""
+def attachment_preview(attachment_id: int):
+    """Serve a cached JPEG preview of an attachment (same authorization).
+
+    `w` selects one of PREVIEW_WIDTHS. When no preview can be made (e.g.
+    Pillow is not installed) images fall back to the original at the
+    largest width only; thumbnails and other files answer 404, so a list
+    of thumbnails never downloads every original.
+    """
+    try:
+        width = int(flask.request.args.get("w", PREVIEW_WIDTHS[0]))
+    except ValueError:
+        width = PREVIEW_WIDTHS[0]
+    if width not in PREVIEW_WIDTHS:
+        width = PREVIEW_WIDTHS[0]
+
     db = get_db()
     cur = db.cursor(dictionary=True)
     try:
         cur.execute(
             """
-            SELECT att.file_name, att.file_type, att.file_data, app.id_citizen
+            SELECT att.file_type, att.content_hash, app.id_citizen
             FROM attachment att
             JOIN application app ON att.id_application = app.id_application
             WHERE att.id_attachment = %s
@@ -1135,34 +3857,31 @@ def serve_attachment(attachment_id: int):
             (attachment_id,),
         )
         row = cur.fetchone()
-        if not row:
-            return flask.abort(404)
-
-        # Authorization: allow if current user is the owner (citizen) or an employee
-        owner_id = row["id_citizen"] if "id_citizen" in row else None
-        if flask_login.current_user.type == "citizen":
-            if str(owner_id) != str(flask_login.current_user.id):
-                return flask.abort(403)
-
-        file_name = row["file_name"] if "file_name" in row else "attachment"
-        file_type = (
-            row["file_type"]
-            if "file_type" in row
-            else "application/octet-stream"
-        )
-        data = row["file_data"]
-
-        resp = flask.make_response(data)
-        resp.headers["Content-Type"] = file_type
-        # suggest inline for images and PDFs, otherwise force download
-        if file_type.startswith("image/") or file_type == "application/pdf":
-            disposition = f'inline; filename="{file_name}"'
-        else:
-            disposition = f'attachment; filename="{file_name}"'
-        resp.headers["Content-Disposition"] = disposition
-        return resp
     finally:
         cur.close()
+    if not row:
+        return flask.abort(404)
+
+    owner_id = row["id_citizen"] if "id_citizen" in row else None
+    if flask_login.current_user.type == "citizen":
+        if str(owner_id) != str(flask_login.current_user.id):
+            return flask.abort(403)
+
+    path = _attachment_preview_path(row, attachment_id, width)
+    if path is None:
+        if width == max(PREVIEW_WIDTHS) and (
+            row.get("file_type") or ""
+        ).startswith("image/"):
+            return flask.redirect(
+                flask.url_for("serve_attachment", attachment_id=attachment_id)
+            )
+        return flask.abort(404)
+
+    resp = flask.send_file(path, mimetype="image/jpeg", conditional=True)
+    resp.headers["Cache-Control"] = (
+        f"private, max-age={PREVIEW_MAX_AGE}, immutable"
+    )
+    return resp
 
 
 @app.route("/attachment/view/<int:attachment_id>")
@@ -1243,6 +3962,30 @@ def citizen_info(citizen_id: int):
         cur.close()
 
 
+_STAFF_APPLICATIONS_SQL = """
+    SELECT a.*, e.id_sector, e.street, e.building_number, e.apartment_number, s.managing_company, s.company_address, s.company_hours, c.first_name, c.last_name, c.email
+    FROM application a
+    LEFT JOIN estate e ON a.id_estate = e.id_estate
+    LEFT JOIN sector s ON e.id_sector = s.id_sector
+    LEFT JOIN citizen c ON a.id_citizen = c.id_citizen
+    """
+
+
+def _attachments_map(cur, app_ids) -> dict:
+    """Return {id_application: [attachment rows]} for the given ids."""
+    attachments_map = {}
+    if not app_ids:
+        return attachments_map
+    format_strings = ",".join(["%s"] * len(app_ids))
+    cur.execute(
+        f"SELECT id_attachment, id_application, file_name, file_type FROM attachment WHERE id_application IN ({format_strings})",
+        tuple(app_ids),
+    )
+    for att in cur.fetchall():
+        attachments_map.setdefault(att["id_application"], []).append(att)
+    return attachments_map
+
+
 @app.route("/panel/urzednik")
 @flask_login.login_required
 def staff_dashboard() -> str:
@@ -1254,11 +3997,10 @@ def staff_dashboard() -> str:
         return flask.redirect(flask.url_for("index"))
 
     try:
-        page = int(flask.request.args.get("page", "1"))
+        page = max(1, int(flask.request.args.get("page", "1")))
     except ValueError:
         page = 1
     per_page = 25
-    offset = (page - 1) * per_page
 
     # filters
     status_filter = flask.request.args.get("status")
@@ -1273,67 +4015,54 @@ def staff_dashboard() -> str:
             where_clauses.append("a.status = %s")
             params.append(status_filter)
         if q:
-            # search in address and citizen fields
-            where_clauses.append(
-                "(e.street LIKE %s OR e.building_number LIKE %s OR e.apartment_number LIKE %s OR c.first_name LIKE %s OR c.last_name LIKE %s OR c.email LIKE %s)"
-            )
-            likeq = f"%{q}%"
-            params.extend([likeq, likeq, likeq, likeq, likeq, likeq])
+            # search in address and citizen fields via the search index
+            search_sql, search_params = _search_clause(q)
+            where_clauses.append(search_sql)
+            params.extend(search_params)
 
         where_sql = " AND ".join(where_clauses) if where_clauses else "1"
 
-        # total count
-        count_sql = f"SELECT COUNT(*) as cnt FROM application a LEFT JOIN estate e ON a.id_estate = e.id_estate LEFT JOIN citizen c ON a.id_citizen = c.id_citizen WHERE {where_sql}"
-        cur.execute(count_sql, tuple(params))
-        row = cur.fetchone()
-        total = row["cnt"] if row and "cnt" in row else 0
-
-        # paginated fetch: include citizen info and estate address
-        fetch_sql = f"""
-            SELECT a.*, e.id_sector, e.street, e.building_number, e.apartment_number, s.managing_company, s.company_address, s.company_hours, c.first_name, c.last_name, c.email
-            FROM application a
-            LEFT JOIN estate e ON a.id_estate = e.id_estate
-            LEFT JOIN sector s ON e.id_sector = s.id_sector
-            LEFT JOIN citizen c ON a.id_citizen = c.id_citizen
-            WHERE {where_sql}
-            ORDER BY a.creation_date DESC
-            LIMIT %s OFFSET %s
-            """
-        fetch_params = tuple(params + [per_page, offset])
-        cur.execute(fetch_sql, fetch_params)
-        applications = cur.fetchall()
+        # total count: maintained counters unless a search narrows it down
+        status_counts = _status_counts(cur)
+        exact_total = not status_counts or bool(q)
+        if not exact_total:
+            total = (
+                status_counts.get(status_filter, 0)
+                if status_filter
+                else sum(status_counts.values())
+            )
+        else:
+            count_sql = f"SELECT COUNT(*) as cnt FROM application a LEFT JOIN estate e ON a.id_estate = e.id_estate LEFT JOIN citizen c ON a.id_citizen = c.id_citizen WHERE {where_sql}"
+            cur.execute(count_sql, tuple(params))
+            row = cur.fetchone()
+            total = row["cnt"] if row and "cnt" in row else 0
+
+        # page fetch: include citizen info and estate address
+        applications, prev_cursor, next_cursor = _fetch_application_page(
+            cur,
+            _STAFF_APPLICATIONS_SQL,
+            where_clauses,
+            params,
+            page,
+            per_page,
+            total,
+            after=flask.request.args.get("after"),
+            before=flask.request.args.get("before"),
+            exact_total=exact_total,
+        )
 
         # fetch attachments for the listed applications
-        app_ids = (
-            [a["id_application"] for a in applications] if applications else []
+        attachments_map = _attachments_map(
+            cur, [a["id_application"] for a in applications]
         )
-        attachments_map = {}
-        if app_ids:
-            format_strings = ",".join(["%s"] * len(app_ids))
-            cur.execute(
-                f"SELECT id_attachment, id_application, file_name, file_type FROM attachment WHERE id_application IN ({format_strings})",
-                tuple(app_ids),
-            )
-            atts = cur.fetchall()
-            for att in atts:
-                attachments_map.setdefault(att["id_application"], []).append(
-                    att
-                )
+        change_seq = _latest_change_seq(cur)
     finally:
         cur.close()
 
     total_pages = max(1, (total + per_page - 1) // per_page)
 
-    # compute free/paid bags for staff view and ensure keys exist
+    # compute free/paid bags for staff view
     compute_free_paid(applications)
-    if applications:
-        try:
-            for a in applications:
-                if isinstance(a, dict):
-                    a.setdefault("free_bags", 0)
-                    a.setdefault("paid_bags", 0)
-        except Exception:
-            pass
 
     return flask.render_template(
         "staff_dashboard.html",
@@ -1341,8 +4070,328 @@ def staff_dashboard() -> str:
         attachments_map=attachments_map,
         page=page,
         total_pages=total_pages,
+        prev_cursor=prev_cursor,
+        next_cursor=next_cursor,
+        status_counts=status_counts,
         status_filter=status_filter,
         q=q,
+        change_seq=change_seq,
+    )
+
+
+@app.route("/panel/urzednik/changes")
+@flask_login.login_required
+def staff_changes():
+    """Return dashboard changes after `since`, with rendered table rows.
+
+    Without `since` only the current cursor is returned.
+    """
+    if flask_login.current_user.type == "citizen":
+        return flask.abort(403)
+    try:
+        since = int(flask.request.args.get("since", ""))
+    except ValueError:
+        since = None
+
+    db = get_db()
+    cur = db.cursor(dictionary=True)
+    try:
+        if since is None:
+            return flask.jsonify(
+                {"ok": True, "seq": _latest_change_seq(cur), "changes": []}
+            )
+        changes = _changes_since(cur, since)
+        # one rendered row per application, however often it changed
+        app_ids = list({c["id_application"]: None for c in changes})
+        rows = []
+        if app_ids:
+            placeholders = ", ".join(["%s"] * len(app_ids))
+            cur.execute(
+                f"{_STAFF_APPLICATIONS_SQL} "
+                f"WHERE a.id_application IN ({placeholders})",
+                app_ids,
+            )
+            rows = cur.fetchall()
+        attachments_map = _attachments_map(cur, app_ids)
+    finally:
+        cur.close()
+    compute_free_paid(rows)
+    html = {
+        r["id_application"]: flask.render_template(
+            "_staff_application_row.html",
+            a=r,
+            attachments_map=attachments_map,
+        )
+        for r in rows
+    }
+    for change in changes:
+        change["html"] = html.get(change["id_application"])
+    return flask.jsonify(
+        {
+            "ok": True,
+            "seq": changes[-1]["seq"] if changes else since,
+            "changes": changes,
+        }
+    )
+
+
+@app.route("/panel/urzednik/stream")
+@flask_login.login_required
+def staff_change_stream():
+    """Server-Sent Events stream of dashboard changes after `since`.
+
+    Events carry the change rows without HTML; a `resync` event tells the
+    client to catch up through `staff_changes`.
+    """
+    if flask_login.current_user.type == "citizen":
+        return flask.abort(403)
+    try:
+        since = int(
+            flask.request.headers.get("Last-Event-ID")
+            or flask.request.args.get("since", "0")
+        )
+    except ValueError:
+        since = 0
+    heartbeat = app.config["CHANGE_FEED_HEARTBEAT"]
+
+    def events():
+        last = since
+        change_feed.subscribe()
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                changes, seq, gap = change_feed.wait(last, heartbeat)
+                if gap:
+                    yield (
+                        f"event: resync\ndata: {json.dumps({'seq': last})}\n\n"
+                    )
+                    last = seq
+                elif changes:
+                    last = changes[-1]["seq"]
+                    data = json.dumps({"seq": last, "changes": changes})
+                    yield f"id: {last}\nevent: change\ndata: {data}\n\n"
+                else:
+                    yield ": keepalive\n\n"
+        finally:
+            change_feed.unsubscribe()
+
+    return flask.Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# fields exposed by /api/applications and the column each one reads
+API_APPLICATION_FIELDS = {
+    "id_application": "a.id_application",
+    "id_estate": "a.id_estate",
+    "id_citizen": "a.id_citizen",
+    "status": "a.status",
+    "bag_count": "a.bag_count",
+    "free_bags": "a.free_bags",
+    "paid_bags": "a.paid_bags",
+    "bag_arrival_date": "a.bag_arrival_date",
+    "bag_depart_date": "a.bag_depart_date",
+    "notes": "a.notes",
+    "creation_date": "a.creation_date",
+    "id_sector": "e.id_sector",
+    "street": "e.street",
+    "building_number": "e.building_number",
+    "apartment_number": "e.apartment_number",
+    "first_name": "c.first_name",
+    "last_name": "c.last_name",
+    "email": "c.email",
+}
+API_DEFAULT_FIELDS = (
+    "id_application",
+    "status",
+    "bag_count",
+    "free_bags",
+    "paid_bags",
+    "bag_depart_date",
+    "creation_date",
+    "street",
+    "building_number",
+    "apartment_number",
+)
+# columns compute_free_paid needs for rows stored before the quota ledger
+_API_ALLOCATION_FIELDS = ("id_estate", "bag_count", "free_bags", "paid_bags")
+
+
+@app.route("/api/applications")
+@flask_login.login_required
+def api_applications():
+    """List applications as compact JSON for kiosk and mobile clients.
+
+    Employees see every application, residents only their own. Supports
+    `fields` (comma separated, see API_APPLICATION_FIELDS), `status`, `q`,
+    `limit` and the `after` cursor from the previous response. Responses
+    carry a weak ETag built from the committed change-feed sequence, so
+    polling an unchanged listing costs one primary-key lookup and returns
+    304.
+    """
+    args = flask.request.args
+    if args.get("fields"):
+        fields = [f.strip() for f in args["fields"].split(",") if f.strip()]
+    else:
+        fields = list(API_DEFAULT_FIELDS)
+    unknown = [f for f in fields if f not in API_APPLICATION_FIELDS]
+    if unknown or not fields:
+        return (
+            flask.jsonify(
+                {"ok": False, "error": "unknown_field", "fields": unknown}
+            ),
+            400,
+        )
+    try:
+        limit = int(args.get("limit", app.config["API_PAGE_SIZE"]))
+    except ValueError:
+        limit = app.config["API_PAGE_SIZE"]
+    limit = min(app.config["API_MAX_PAGE_SIZE"], max(1, limit))
+    status_filter = args.get("status")
+    q = args.get("q", "").strip()
+    after = args.get("after")
+
+    user = flask_login.current_user
+    db = get_db()
+    cur = db.cursor(dictionary=True)
+    try:
+        # the counter moves when an application change commits and, via
+        # the estate/citizen triggers in SCHEMA_UPGRADES, when a joined row
+        # is edited. It is read before the rows in a statement of its own,
+        # so a change committing in between leaves the rows newer than the
+        # tag and the next poll fetches them again
+        seq = _latest_change_seq(cur)
+        scope = json.dumps(
+            [user.type, user.id, fields, status_filter, q, after, limit]
+        )
+        etag = f"{seq}-{hashlib.sha1(scope.encode('utf-8')).hexdigest()[:16]}"
+        if flask.request.if_none_match.contains_weak(etag):
+            response = flask.Response(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+
+        # always select the cursor key; allocation columns only on demand
+        columns = {"id_application", "creation_date", *fields}
+        if "free_bags" in fields or "paid_bags" in fields:
+            columns.update(_API_ALLOCATION_FIELDS)
+        exprs = [API_APPLICATION_FIELDS[c] for c in sorted(columns)]
+        joins = ""
+        if any(e.startswith("e.") for e in exprs):
+            joins += " LEFT JOIN estate e ON a.id_estate = e.id_estate"
+        if any(e.startswith("c.") for e in exprs):
+            joins += " LEFT JOIN citizen c ON a.id_citizen = c.id_citizen"
+
+        clauses = []
+        params = []
+        if user.type == "citizen":
+            clauses.append("a.id_citizen = %s")
+            params.append(user.id)
+        if status_filter:
+            clauses.append("a.status = %s")
+            params.append(status_filter)
+        if q:
+            search_sql, search_params = _search_clause(q)
+            clauses.append(search_sql)
+            params.extend(search_params)
+        after_key = _decode_cursor(after)
+        if after_key:
+            clauses.append(
+                "(a.creation_date < %s OR "
+                "(a.creation_date = %s AND a.id_application < %s))"
+            )
+            params.extend([after_key[0], after_key[0], after_key[1]])
+        where_sql = " AND ".join(clauses) if clauses else "1"
+        cur.execute(
+            f"SELECT {', '.join(exprs)} FROM application a{joins} "
+            f"WHERE {where_sql} "
+            "ORDER BY a.creation_date DESC, a.id_application DESC LIMIT %s",
+            tuple(params + [limit + 1]),
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if "free_bags" in fields or "paid_bags" in fields:
+        compute_free_paid(rows)
+    body = json.dumps(
+        {
+            "items": [{f: row.get(f) for f in fields} for row in rows],
+            "next": _encode_cursor(rows[-1]) if more else None,
+            "seq": seq,
+        },
+        default=str,
+        ensure_ascii=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+    response = flask.Response(body, mimetype="application/json")
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("Accept-Encoding")
+    if (
+        len(body) >= app.config["API_GZIP_MIN_BYTES"]
+        and flask.request.accept_encodings["gzip"] > 0
+    ):
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
+
+@app.route("/search/applications")
+@flask_login.login_required
+def search_applications():
+    """Return application IDs matching `q`, best matches first (type-ahead).
+
+    Only employees may search across all applications.
+    """
+    if flask_login.current_user.type == "citizen":
+        return flask.abort(403)
+
+    q = flask.request.args.get("q", "").strip()
+    try:
+        limit = min(50, max(1, int(flask.request.args.get("limit", "10"))))
+    except ValueError:
+        limit = 10
+    match_expr, short_words = _search_terms(q)
+    if not match_expr and not short_words:
+        return flask.jsonify({"ok": True, "q": q, "ids": []})
+
+    conditions = []
+    params = []
+    if match_expr:
+        score_sql = "MATCH(document) AGAINST (%s IN BOOLEAN MODE)"
+        conditions.append(score_sql)
+        params = [match_expr, match_expr]
+    else:
+        score_sql = "0"
+    for w in short_words:
+        conditions.append("document LIKE %s")
+        params.append(f"%{w}%")
+
+    db = get_db()
+    cur = db.cursor(dictionary=True)
+    try:
+        cur.execute(
+            f"SELECT id_application, {score_sql} AS score "
+            "FROM application_search "
+            f"WHERE {' AND '.join(conditions)} "
+            "ORDER BY score DESC, id_application DESC LIMIT %s",
+            tuple(params + [limit]),
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    return flask.jsonify(
+        {
+            "ok": True,
+            "q": q,
+            "ids": [r["id_application"] for r in rows],
+            "scores": [float(r["score"] or 0) for r in rows],
+        }
     )
 
 
@@ -1401,6 +4450,24 @@ def debug_staff_applications():
         cur.close()
 
 
+@app.route("/debug/db_pool")
+@flask_login.login_required
+def debug_db_pool():
+    """Developer helper: return connection pool statistics as JSON."""
+    if flask_login.current_user.type == "citizen":
+        return flask.abort(403)
+    return flask.jsonify(get_pool().stats())
+
+
+@app.route("/debug/export_queue")
+@flask_login.login_required
+def debug_export_queue():
+    """Developer helper: return XML export queue depth and lag as JSON."""
+    if flask_login.current_user.type == "citizen":
+        return flask.abort(403)
+    return flask.jsonify(export_queue_stats())
+
+
 @app.route("/application/<int:app_id>/decide", methods=["POST"])
 @flask_login.login_required
 def decide_application(app_id: int):
@@ -1421,100 +4488,158 @@ def decide_application(app_id: int):
 
     new_status = "approved" if action == "approve" else "declined"
 
-    # check current status to avoid useless transitions
+    # compare-and-set: the affected row count tells updated from the rest;
+    # only then is the row read to tell "not found" from "no change"
     db = get_db()
     cur = db.cursor(dictionary=True)
     try:
-        cur.execute(
-            "SELECT status FROM application WHERE id_application = %s",
-            (app_id,),
-        )
-        row = cur.fetchone()
-        if not row:
-            if (
-                flask.request.headers.get("X-Requested-With")
-                == "XMLHttpRequest"
-            ):
-                return flask.make_response(
-                    flask.jsonify({"ok": False, "error": "not_found"}), 404
-                )
-            return flask.redirect(flask.url_for("staff_dashboard"))
-
-        current_status = row["status"]
-        if current_status == new_status:
-            # no-op
+        db.start_transaction()
+        if _set_status(cur, [app_id], new_status):
+            _record_transitions(cur, [app_id], flask_login.current_user.id)
+            # XML export or revocation runs in the background export worker
+            _enqueue_export(
+                cur,
+                [app_id],
+                "export" if new_status == "approved" else "revoke",
+                new_status,
+            )
+            # last: it holds the change-seq row lock until commit
+            _log_changes(cur, [app_id], "status")
+            db.commit()
+            export_worker.wake()
+        else:
+            db.rollback()
+            cur.execute(
+                "SELECT status FROM application WHERE id_application = %s",
+                (app_id,),
+            )
+            row = cur.fetchone()
             if (
                 flask.request.headers.get("X-Requested-With")
                 == "XMLHttpRequest"
             ):
+                if not row:
+                    return flask.make_response(
+                        flask.jsonify({"ok": False, "error": "not_found"}),
+                        404,
+                    )
                 return flask.make_response(
                     flask.jsonify(
                         {
                             "ok": False,
                             "error": "no_change",
-                            "status": current_status,
+                            "status": row["status"],
                         }
                     ),
                     409,
                 )
             return flask.redirect(flask.url_for("staff_dashboard"))
+    except mysql.connector.Error as err:
+        print("Error updating application status:", err)
+        db.rollback()
+        if flask.request.headers.get("X-Requested-With") == "XMLHttpRequest":
+            return flask.make_response(
+                flask.jsonify({"ok": False, "error": "db_error"}), 500
+            )
     finally:
         cur.close()
 
-    # perform update
+    # AJAX clients receive JSON; normal form posts are redirected back
+    if flask.request.headers.get("X-Requested-With") == "XMLHttpRequest":
+        return flask.jsonify({"ok": True, "new_status": new_status})
+
+    page = flask.request.form.get("page") or flask.request.args.get("page")
+    if page:
+        return flask.redirect(
+            flask.url_for("staff_dashboard") + f"?page={page}"
+        )
+    return flask.redirect(flask.url_for("staff_dashboard"))
+
+
+@app.route("/applications/decide", methods=["POST"])
+@flask_login.login_required
+def decide_applications():
+    """Approve or decline many applications at once.
+
+    Expects form field 'action' ('approve' or 'decline') and one or more
+    'ids' fields. All transitions are applied in one transaction; the XML
+    export worker then writes each affected sector once.
+    """
+    if flask_login.current_user.type == "citizen":
+        return flask.abort(403)
+    is_ajax = flask.request.headers.get("X-Requested-With") == "XMLHttpRequest"
+
+    action = flask.request.form.get("action")
+    try:
+        ids = sorted(
+            {int(i) for i in flask.request.form.getlist("ids") if i.strip()}
+        )
+    except ValueError:
+        ids = None
+    if action not in ("approve", "decline") or not ids:
+        if is_ajax:
+            return (
+                flask.jsonify({"ok": False, "error": "invalid_request"}),
+                400,
+            )
+        return flask.redirect(flask.url_for("staff_dashboard"))
+    if len(ids) > app.config["BULK_DECISION_MAX"]:
+        if is_ajax:
+            return flask.jsonify({"ok": False, "error": "too_many"}), 400
+        return flask.redirect(flask.url_for("staff_dashboard"))
+
+    new_status = "approved" if action == "approve" else "declined"
+    placeholders = ", ".join(["%s"] * len(ids))
     db = get_db()
-    cur2 = db.cursor()
+    cur = db.cursor(dictionary=True)
     try:
-        cur2.execute(
-            "UPDATE application SET status = %s WHERE id_application = %s",
-            (new_status, app_id),
+        db.start_transaction()
+        # lock the rows first: the bulk reply has to tell unchanged and
+        # unknown ids apart, and only changed rows go to _record_transitions
+        cur.execute(
+            "SELECT id_application, status FROM application "
+            f"WHERE id_application IN ({placeholders}) FOR UPDATE",
+            ids,
         )
+        rows = cur.fetchall()
+        changed = [
+            r["id_application"] for r in rows if r["status"] != new_status
+        ]
+        if changed:
+            _set_status(cur, changed, new_status)
+            _record_transitions(cur, changed, flask_login.current_user.id)
+            _enqueue_export(
+                cur,
+                changed,
+                "export" if new_status == "approved" else "revoke",
+                new_status,
+            )
+            _log_changes(cur, changed, "status")
         db.commit()
-        # after successful update, export to per-sector XML or mark revoked
-        try:
-            db = get_db()
-            cur3 = db.cursor(dictionary=True)
-            try:
-                cur3.execute(
-                    "SELECT a.*, e.id_sector, e.street, e.building_number, e.apartment_number, c.* FROM application a LEFT JOIN estate e ON a.id_estate = e.id_estate LEFT JOIN citizen c ON a.id_citizen = c.id_citizen WHERE a.id_application = %s",
-                    (app_id,),
-                )
-                row = cur3.fetchone()
-                # fetch attachments
-                cur3.execute(
-                    "SELECT id_attachment, id_application, file_name, file_type FROM attachment WHERE id_application = %s",
-                    (app_id,),
-                )
-                atts = cur3.fetchall()
-                if row:
-                    if new_status == "approved":
-                        try:
-                            _write_sector_application(row, atts or [])
-                        except Exception as e:
-                            print("XML write error:", e)
-                    else:
-                        try:
-                            _mark_application_revoked(app_id)
-                        except Exception as e:
-                            print("XML revoke error:", e)
-            finally:
-                cur3.close()
-        except Exception:
-            # ignore xml export errors for now
-            pass
     except mysql.connector.Error as err:
-        print("Error updating application status:", err)
-        if flask.request.headers.get("X-Requested-With") == "XMLHttpRequest":
+        print("Error updating application statuses:", err)
+        db.rollback()
+        if is_ajax:
             return flask.make_response(
                 flask.jsonify({"ok": False, "error": "db_error"}), 500
             )
+        return flask.redirect(flask.url_for("staff_dashboard"))
     finally:
-        cur2.close()
-
-    # AJAX clients receive JSON; normal form posts are redirected back
-    if flask.request.headers.get("X-Requested-With") == "XMLHttpRequest":
-        return flask.jsonify({"ok": True, "new_status": new_status})
+        cur.close()
+    if changed:
+        export_worker.wake()
 
+    if is_ajax:
+        found = {r["id_application"] for r in rows}
+        return flask.jsonify(
+            {
+                "ok": True,
+                "new_status": new_status,
+                "updated": changed,
+                "unchanged": sorted(found.difference(changed)),
+                "not_found": [i for i in ids if i not in found],
+            }
+        )
     page = flask.request.form.get("page") or flask.request.args.get("page")
     if page:
         return flask.redirect(
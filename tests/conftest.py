@@ -0,0 +1,94 @@
+import os
+import sys
+
+import flask_login
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import app as bigbag
+
+
+class FakeCursor:
+    """DB-API cursor double that records every statement it runs."""
+
+    def __init__(self, conn, dictionary=False):
+        self.conn = conn
+        self.dictionary = dictionary
+        self.rows = []
+        self.rowcount = 0
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        self.conn.statements.append((" ".join(sql.split()), params))
+        self.rows = list(self.conn.respond(sql, params) or [])
+        self.rowcount = len(self.rows)
+
+    def executemany(self, sql, seq):
+        for params in seq:
+            self.execute(sql, params)
+
+    def fetchone(self):
+        return self.rows.pop(0) if self.rows else None
+
+    def fetchall(self):
+        rows, self.rows = self.rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Connection double; `respond(sql, params)` supplies result rows."""
+
+    def __init__(self, respond=None):
+        self.respond = respond or (lambda sql, params: [])
+        self.statements = []
+        self.transactions = []
+
+    def cursor(self, dictionary=False, **kwargs):
+        return FakeCursor(self, dictionary)
+
+    def start_transaction(self):
+        self.transactions.append(("begin", len(self.statements)))
+
+    def commit(self):
+        self.transactions.append(("commit", len(self.statements)))
+
+    def rollback(self):
+        self.transactions.append(("rollback", len(self.statements)))
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    conn = FakeConnection()
+    monkeypatch.setattr(bigbag, "get_db", lambda: conn)
+    return conn
+
+
+@pytest.fixture
+def client(monkeypatch):
+    bigbag.app.config.update(TESTING=True, EXPORT_WORKER_ENABLED=False)
+    if not hasattr(bigbag.app, "login_manager"):
+        manager = flask_login.LoginManager()
+        manager.init_app(bigbag.app)
+        manager.login_view = "login"
+    users = {}
+    bigbag.app.login_manager.user_loader(lambda user_id: users.get(user_id))
+
+    def login(user):
+        users[user.id] = user
+        with client.session_transaction() as session:
+            session["_user_id"] = user.id
+            session["_fresh"] = True
+
+    client = bigbag.app.test_client()
+    client.login = login
+    return client
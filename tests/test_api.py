@@ -0,0 +1,50 @@
+import mysql.connector
+
+from conftest import bigbag
+
+
+def _respond(seq):
+    def respond(sql, params):
+        if "application_change_seq" in sql:
+            return [{"seq": seq}]
+        return []
+
+    return respond
+
+
+def test_listing_etag_follows_committed_change_seq(client, fake_db):
+    client.login(bigbag.User("1", "employee", "Anna"))
+    fake_db.respond = _respond(5)
+    first = client.get("/api/applications")
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert etag.startswith('W/"5-')
+
+    fake_db.statements.clear()
+    again = client.get("/api/applications", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert len(fake_db.statements) == 1
+
+    fake_db.respond = _respond(6)
+    changed = client.get("/api/applications", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+
+
+def test_estate_and_citizen_edits_move_the_change_seq(fake_db):
+    def respond(sql, params):
+        if "CREATE TRIGGER" in sql:
+            raise mysql.connector.Error(msg="exists", errno=1359)
+        return []
+
+    fake_db.respond = respond
+    result = bigbag.app.test_cli_runner().invoke(args=["upgrade-db"])
+
+    assert result.exit_code == 0, result.output
+    triggers = [sql for sql, _ in fake_db.statements if "TRIGGER" in sql]
+    assert [sql.split(" ON ")[1].split()[0] for sql in triggers] == [
+        "estate",
+        "citizen",
+    ]
+    assert all("application_change_seq" in sql for sql in triggers)
+    assert result.output.count("skipped: CREATE TRIGGER") == 2
@@ -0,0 +1,92 @@
+import gzip
+import json
+
+import pytest
+
+from conftest import bigbag
+
+CSS = b"body { color: #123456; }\n" * 40
+
+
+@pytest.fixture
+def assets(tmp_path, monkeypatch):
+    static = tmp_path / "static"
+    (static / "css").mkdir(parents=True)
+    (static / "js").mkdir()
+    (static / "css" / "site.css").write_bytes(CSS)
+    out = tmp_path / "assets"
+    monkeypatch.setattr(bigbag.app, "static_folder", str(static))
+    monkeypatch.setattr(bigbag, "STATIC_ASSET_OUT_DIR", str(out))
+    monkeypatch.setattr(
+        bigbag, "STATIC_ASSET_MANIFEST", str(out / "manifest.json")
+    )
+    monkeypatch.setitem(bigbag._asset_manifest, "mtime", None)
+    return static, out
+
+
+def _build():
+    result = bigbag.app.test_cli_runner().invoke(args=["build-assets"])
+    assert result.exit_code == 0, result.output
+    return result
+
+
+def _asset_url(filename):
+    with bigbag.app.test_request_context():
+        return bigbag.asset_url(filename)
+
+
+def test_asset_url_falls_back_to_static_before_a_build(assets):
+    assert _asset_url("css/site.css") == "/static/css/site.css"
+
+
+def test_build_assets_fingerprints_and_precompresses(assets):
+    _, out = assets
+    _build()
+
+    manifest = json.loads((out / "manifest.json").read_text())
+    digest = bigbag.hashlib.sha256(CSS).hexdigest()[:12]
+    assert manifest == {"css/site.css": f"css/site.{digest}.css"}
+    hashed = out / manifest["css/site.css"]
+    assert hashed.read_bytes() == CSS
+    assert (
+        gzip.decompress((out / "css" / f"{hashed.name}.gz").read_bytes())
+        == CSS
+    )
+    assert _asset_url("css/site.css") == f"/assets/css/site.{digest}.css"
+
+
+def test_rebuild_drops_outputs_of_changed_files(assets):
+    static, out = assets
+    _build()
+    old = sorted(p.name for p in (out / "css").iterdir())
+    (static / "css" / "site.css").write_bytes(CSS + b"a { color: red; }\n")
+    _build()
+
+    current = sorted(p.name for p in (out / "css").iterdir())
+    assert len(current) == len(old)
+    assert not set(old) & set(current)
+
+
+def test_hashed_assets_are_served_immutable_and_precompressed(client, assets):
+    _build()
+    url = _asset_url("css/site.css")
+
+    plain = client.get(url, headers={"Accept-Encoding": "identity"})
+    assert plain.status_code == 200
+    assert plain.data == CSS
+    assert "Content-Encoding" not in plain.headers
+    assert "immutable" in plain.headers["Cache-Control"]
+
+    packed = client.get(url, headers={"Accept-Encoding": "gzip"})
+    assert packed.headers["Content-Encoding"] == "gzip"
+    assert packed.headers["Content-Type"].startswith("text/css")
+    assert gzip.decompress(packed.data) == CSS
+    assert "Accept-Encoding" in packed.headers["Vary"]
+
+
+@pytest.mark.parametrize(
+    "path", ["/assets/css/missing.css", "/assets/../manifest.json"]
+)
+def test_unknown_assets_are_not_found(client, assets, path):
+    _build()
+    assert client.get(path).status_code == 404
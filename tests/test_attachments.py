@@ -0,0 +1,250 @@
+import io
+from datetime import datetime
+
+import pytest
+import werkzeug.exceptions
+
+from conftest import bigbag
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 100
+
+
+@pytest.fixture
+def store_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(bigbag, "ATTACHMENT_STORE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_spool_hashes_and_sniffs(store_dir):
+    spool = bigbag.UploadSpool(limit=1024)
+    spool.write(PNG[:3])
+    spool.write(PNG[3:])
+    assert spool.size == len(PNG)
+    assert spool.sniffed_type == "image/png"
+    assert spool.content_hash == bigbag.hashlib.sha256(PNG).hexdigest()
+
+
+def test_spool_rejects_unknown_type_from_first_bytes(store_dir):
+    spool = bigbag.UploadSpool(limit=1024)
+    with pytest.raises(werkzeug.exceptions.UnsupportedMediaType):
+        spool.write(b"MZ\x90\0" + b"\0" * 100)
+    assert spool.size == 104
+    assert spool.tell() == 0
+
+
+def test_spool_enforces_size_limit(store_dir):
+    spool = bigbag.UploadSpool(limit=64)
+    with pytest.raises(werkzeug.exceptions.RequestEntityTooLarge):
+        spool.write(PNG)
+
+
+def test_database_store_inserts_bytes_in_one_statement(fake_db):
+    cur = fake_db.cursor()
+    bigbag.DatabaseAttachmentStore().save(
+        cur, 7, "a.png", "image/png", io.BytesIO(PNG * 5000)
+    )
+    ((sql, params),) = fake_db.statements
+    assert sql.startswith("INSERT INTO attachment")
+    assert params[3] == PNG * 5000
+    assert params[4] == len(PNG) * 5000
+
+
+def test_database_store_appends_the_rest_in_chunks(fake_db, monkeypatch):
+    monkeypatch.setattr(bigbag.DatabaseAttachmentStore, "BLOB_CHUNK_SIZE", 64)
+    fake_db.respond = lambda sql, params: []
+    cur = fake_db.cursor()
+    bigbag.DatabaseAttachmentStore().save(
+        cur, 7, "a.png", "image/png", io.BytesIO(PNG)
+    )
+    (insert, first), *appends = fake_db.statements
+    assert insert.startswith("INSERT INTO attachment")
+    assert first[3:] == (PNG[:64], 64)
+    assert [params[:2] for _, params in appends] == [(PNG[64:], 44)]
+    assert all("CONCAT(file_data, %s)" in sql for sql, _ in appends)
+
+
+def test_spool_file_is_removed_on_close(store_dir):
+    spool = bigbag.UploadSpool(limit=1024)
+    spool.write(PNG)
+    assert bigbag.os.path.exists(spool.name)
+    spool.close()
+    spool.close()
+    assert not bigbag.os.path.exists(spool.name)
+
+
+def _post_form(client, data):
+    return client.post(
+        "/wniosek",
+        data={"id_estate": "1", "new_est_attachment": (io.BytesIO(data), "a")},
+        content_type="multipart/form-data",
+    )
+
+
+def test_form_reports_rejected_upload(client, fake_db, store_dir):
+    bigbag.app.config.update(ATTACHMENT_MAX_SIZE=2**20)
+    try:
+        client.login(bigbag.User("7", "citizen", "Jan"))
+        too_large = _post_form(client, PNG * 11000)
+        wrong_type = _post_form(client, b"GIF89a" + b"\0" * 100)
+    finally:
+        bigbag.app.config.update(ATTACHMENT_MAX_SIZE=10 * 1024 * 1024)
+    assert too_large.status_code == 413
+    assert "większy niż 1 MB" in too_large.get_data(as_text=True)
+    assert wrong_type.status_code == 415
+    assert "Nieprawidłowy typ pliku" in wrong_type.get_data(as_text=True)
+    assert not fake_db.statements
+
+
+def test_other_endpoints_keep_default_413(client):
+    client.application.config["MAX_CONTENT_LENGTH"] = 16
+    try:
+        response = client.post("/logowanie", data={"email": "x" * 64})
+    finally:
+        client.application.config["MAX_CONTENT_LENGTH"] = 11 * 1024 * 1024
+    assert response.status_code == 413
+    assert "application_form" not in response.get_data(as_text=True)
+    assert "Plik" not in response.get_data(as_text=True)
+
+
+BLOB = bytes(range(20))
+
+
+def _serve_blob(fake_db):
+    def respond(sql, params):
+        if "FROM attachment att" in sql:
+            return [
+                {
+                    "file_name": "a.pdf",
+                    "file_type": "application/pdf",
+                    "content_hash": None,
+                    "file_size": len(BLOB),
+                    "id_citizen": 7,
+                    "creation_date": datetime(2025, 5, 1, 12, 0),
+                }
+            ]
+        if "SUBSTRING(file_data" in sql:
+            pos, size, _ = params
+            return [(BLOB[pos - 1 : pos - 1 + size],)]
+        return []
+
+    fake_db.respond = respond
+
+
+def _blob_reads(fake_db):
+    return [p for sql, p in fake_db.statements if "SUBSTRING" in sql]
+
+
+def test_blob_download_sends_validators(client, fake_db):
+    _serve_blob(fake_db)
+    client.login(bigbag.User("7", "citizen", "Jan"))
+    response = client.get("/attachment/9")
+    assert response.status_code == 200
+    assert response.data == BLOB
+    assert response.headers["ETag"] == '"att-9-20"'
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+
+def test_blob_download_serves_a_single_range(client, fake_db):
+    _serve_blob(fake_db)
+    client.login(bigbag.User("7", "citizen", "Jan"))
+    response = client.get("/attachment/9", headers={"Range": "bytes=2-5"})
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 2-5/20"
+    assert response.data == BLOB[2:6]
+    assert _blob_reads(fake_db) == [(3, 4, 9)]
+
+
+def test_blob_download_rejects_unsatisfiable_range(client, fake_db):
+    _serve_blob(fake_db)
+    client.login(bigbag.User("7", "citizen", "Jan"))
+    response = client.get("/attachment/9", headers={"Range": "bytes=40-"})
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == "bytes */20"
+
+
+def test_blob_download_ignores_range_for_a_stale_if_range(client, fake_db):
+    _serve_blob(fake_db)
+    client.login(bigbag.User("7", "citizen", "Jan"))
+    response = client.get(
+        "/attachment/9",
+        headers={"Range": "bytes=2-5", "If-Range": '"att-9-19"'},
+    )
+    assert response.status_code == 200
+    assert response.data == BLOB
+
+
+def test_blob_download_answers_if_none_match_without_reading(client, fake_db):
+    _serve_blob(fake_db)
+    client.login(bigbag.User("7", "citizen", "Jan"))
+    response = client.get(
+        "/attachment/9", headers={"If-None-Match": '"att-9-20"'}
+    )
+    assert response.status_code == 304
+    assert response.headers["ETag"] == '"att-9-20"'
+    assert _blob_reads(fake_db) == []
+
+
+class BlobTable:
+    """attachment rows for attachments-migrate, as {id: [data, hash]}."""
+
+    def __init__(self, rows):
+        self.rows = {i: [data, None] for i, data in rows.items()}
+        self.fail_updates = False
+
+    def respond(self, sql, params):
+        if sql.startswith("SELECT id_attachment FROM attachment"):
+            pending = [
+                (i,)
+                for i, (data, content_hash) in sorted(self.rows.items())
+                if content_hash is None and data is not None
+            ]
+            return pending[: params[0]]
+        if "SUBSTRING(file_data" in sql:
+            pos, size, attachment_id = params
+            data = self.rows[attachment_id][0]
+            return [(data[pos - 1 : pos - 1 + size],)]
+        if sql.startswith("UPDATE attachment SET content_hash"):
+            if self.fail_updates:
+                raise bigbag.mysql.connector.Error(msg="connection lost")
+            content_hash, _, attachment_id = params
+            self.rows[attachment_id] = [None, content_hash]
+        return []
+
+
+def _stored_files(root):
+    return sorted(
+        p.name
+        for p in root.rglob("*")
+        if p.is_file() and p.relative_to(root).parts[0] != "tmp"
+    )
+
+
+def test_attachments_migrate_is_idempotent(fake_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        bigbag, "attachment_files", bigbag.FilesystemAttachmentStore(tmp_path)
+    )
+    table = BlobTable({1: PNG, 2: b"%PDF-1.4", 3: PNG})
+    fake_db.respond = table.respond
+    runner = bigbag.app.test_cli_runner()
+
+    # a run that dies before its UPDATE leaves files but no hashes
+    table.fail_updates = True
+    failed = runner.invoke(args=["attachments-migrate", "--batch-size", "2"])
+    assert failed.exit_code != 0
+    assert all(h is None for _, h in table.rows.values())
+
+    table.fail_updates = False
+    first = runner.invoke(args=["attachments-migrate", "--batch-size", "2"])
+    assert first.exit_code == 0, first.output
+    assert "done, 3 attachments moved" in first.output
+    stored = _stored_files(tmp_path)
+    digest = bigbag.hashlib.sha256
+    assert stored == sorted(
+        {digest(PNG).hexdigest(), digest(b"%PDF-1.4").hexdigest()}
+    )
+    assert table.rows[1] == table.rows[3] == [None, digest(PNG).hexdigest()]
+
+    again = runner.invoke(args=["attachments-migrate"])
+    assert again.exit_code == 0, again.output
+    assert "done, 0 attachments moved" in again.output
+    assert _stored_files(tmp_path) == stored
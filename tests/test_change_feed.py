@@ -0,0 +1,48 @@
+import pytest
+
+from conftest import FakeConnection, FakeCursor, bigbag
+
+
+class SequenceCursor(FakeCursor):
+    """Emulates UPDATE ... SET seq = LAST_INSERT_ID(seq + n)."""
+
+    def __init__(self, conn, seq):
+        super().__init__(conn)
+        self.seq = seq
+
+    def execute(self, sql, params=()):
+        super().execute(sql, params)
+        if sql.startswith("UPDATE application_change_seq"):
+            if self.seq is None:
+                self.rowcount = 0
+                return
+            self.seq += params[0]
+            self.rowcount = 1
+            self.lastrowid = self.seq
+
+
+def test_log_changes_takes_a_block_of_sequence_numbers():
+    conn = FakeConnection()
+    cur = SequenceCursor(conn, seq=41)
+    bigbag._log_changes(cur, [7, 8, 9], "status")
+    update, *inserts = conn.statements
+    assert update[1] == (3,)
+    assert [params for _, params in inserts] == [
+        (42, 7, "status"),
+        (43, 8, "status"),
+        (44, 9, "status"),
+    ]
+
+
+def test_log_changes_needs_the_sequence_row():
+    cur = SequenceCursor(FakeConnection(), seq=None)
+    with pytest.raises(RuntimeError):
+        bigbag._log_changes(cur, [7], "created")
+
+
+def test_latest_change_seq_reads_the_committed_counter(fake_db):
+    fake_db.respond = lambda sql, params: [{"seq": 12}]
+    cur = fake_db.cursor(dictionary=True)
+    assert bigbag._latest_change_seq(cur) == 12
+    ((sql, _),) = fake_db.statements
+    assert "application_change_seq" in sql
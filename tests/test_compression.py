@@ -0,0 +1,145 @@
+import gzip
+
+import flask
+import pytest
+
+from conftest import bigbag
+
+BODY = "<p>" + "wniosek " * 400 + "</p>"
+
+
+@pytest.fixture
+def client():
+    app = flask.Flask(__name__)
+    app.config.update(
+        COMPRESS_ENABLED=True,
+        COMPRESS_MIN_SIZE=1024,
+        COMPRESS_LEVEL=6,
+        COMPRESS_BR_QUALITY=5,
+    )
+
+    @app.route("/page")
+    def page():
+        return BODY
+
+    @app.route("/small")
+    def small():
+        return "ok"
+
+    @app.route("/tagged")
+    def tagged():
+        response = flask.make_response(BODY)
+        response.set_etag("v1", weak=flask.request.args.get("weak") == "1")
+        return response.make_conditional(flask.request)
+
+    @app.route("/stream")
+    def stream():
+        return flask.Response(iter([BODY]), mimetype="text/event-stream")
+
+    @app.route("/events")
+    def events():
+        def generate():
+            for i in range(5):
+                pulled.append(i)
+                yield f"data: {i}\n\n"
+
+        return flask.Response(generate(), mimetype="text/event-stream")
+
+    @app.route("/binary")
+    def binary():
+        return flask.Response(b"\0" * 4096, mimetype="application/pdf")
+
+    pulled = []
+    app.wsgi_app = bigbag.CompressionMiddleware(app.wsgi_app, app)
+    client = app.test_client()
+    client.pulled = pulled
+    return client
+
+
+GZIP = {"Accept-Encoding": "gzip"}
+
+
+def test_large_text_response_is_gzipped(client):
+    response = client.get("/page", headers=GZIP)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert int(response.headers["Content-Length"]) == len(response.data)
+    assert gzip.decompress(response.data).decode() == BODY
+    assert response.headers["ETag"].endswith('-gzip"')
+
+
+def test_identity_when_not_accepted(client):
+    response = client.get("/page")
+    assert "Content-Encoding" not in response.headers
+    assert response.get_data(as_text=True) == BODY
+    assert response.headers["Vary"] == "Accept-Encoding"
+
+
+def test_small_response_is_not_compressed(client):
+    response = client.get("/small", headers=GZIP)
+    assert "Content-Encoding" not in response.headers
+    assert "Vary" not in response.headers
+    assert response.headers["ETag"]
+
+
+@pytest.mark.parametrize("path", ["/stream", "/binary"])
+def test_streams_and_binary_types_pass_through(client, path):
+    response = client.get(path, headers=GZIP)
+    assert "Content-Encoding" not in response.headers
+    assert "ETag" not in response.headers
+
+
+def test_matching_etag_returns_not_modified(client):
+    etag = client.get("/page", headers=GZIP).headers["ETag"]
+    response = client.get("/page", headers={**GZIP, "If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+    assert "Content-Encoding" not in response.headers
+
+
+def test_etag_differs_per_encoding(client):
+    identity = client.get("/page").headers["ETag"]
+    gzipped = client.get("/page", headers=GZIP).headers["ETag"]
+    assert identity != gzipped
+    response = client.get("/page", headers={**GZIP, "If-None-Match": identity})
+    assert response.status_code == 200
+
+
+def test_view_strong_etag_gets_encoding_suffix(client):
+    response = client.get("/tagged", headers=GZIP)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == '"v1-gzip"'
+    assert client.get("/tagged").headers["ETag"] == '"v1"'
+    again = client.get(
+        "/tagged", headers={**GZIP, "If-None-Match": '"v1-gzip"'}
+    )
+    assert again.status_code == 304
+
+
+def test_view_weak_etag_is_kept(client):
+    response = client.get("/tagged?weak=1", headers=GZIP)
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == 'W/"v1"'
+
+
+def test_head_reports_encoded_representation(client):
+    get = client.get("/page", headers=GZIP)
+    head = client.head("/page", headers=GZIP)
+    assert head.status_code == 200
+    assert head.data == b""
+    for name in ("Content-Encoding", "Content-Length", "ETag", "Vary"):
+        assert head.headers[name] == get.headers[name]
+
+
+def test_disabled(client):
+    client.application.config["COMPRESS_ENABLED"] = False
+    response = client.get("/page", headers=GZIP)
+    assert "Content-Encoding" not in response.headers
+
+
+def test_head_does_not_run_streams(client):
+    response = client.head("/events")
+    assert response.status_code == 200
+    assert response.data == b""
+    assert client.pulled == []
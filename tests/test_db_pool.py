@@ -0,0 +1,117 @@
+import threading
+
+import pytest
+
+from conftest import bigbag
+
+
+class PooledConnection:
+    def __init__(self):
+        self.connected = True
+        self.in_transaction = False
+        self.rolled_back = False
+        self.closed = False
+
+    def is_connected(self):
+        return self.connected
+
+    def rollback(self):
+        self.rolled_back = True
+        self.in_transaction = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = bigbag.ConnectionPool(
+        size=2, max_overflow=1, recycle=1800, timeout=0.05
+    )
+    opened = []
+
+    def connect():
+        conn = PooledConnection()
+        pool._born[id(conn)] = bigbag.time.monotonic()
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(pool, "_connect", connect)
+    pool.opened = opened
+    return pool
+
+
+def test_checkout_reuses_idle_connection(pool):
+    conn = pool.checkout()
+    pool.checkin(conn)
+    assert pool.checkout() is conn
+    assert len(pool.opened) == 1
+
+
+def test_checkin_rolls_back_open_transaction(pool):
+    conn = pool.checkout()
+    conn.in_transaction = True
+    pool.checkin(conn)
+    assert conn.rolled_back
+    assert pool.stats()["idle"] == 1
+
+
+def test_overflow_connections_are_closed_on_checkin(pool):
+    conns = [pool.checkout() for _ in range(3)]
+    assert pool.stats()["open"] == 3
+    for conn in conns:
+        pool.checkin(conn)
+    stats = pool.stats()
+    assert stats["open"] == 2
+    assert stats["idle"] == 2
+    assert stats["in_use"] == 0
+    assert sum(c.closed for c in conns) == 1
+
+
+def test_checkout_times_out_when_exhausted(pool):
+    for _ in range(3):
+        pool.checkout()
+    with pytest.raises(bigbag.PoolTimeout):
+        pool.checkout()
+    assert pool.stats()["checkout_failures"] == 1
+
+
+def test_waiter_gets_connection_released_by_another_thread(pool):
+    pool.timeout = 2
+    conns = [pool.checkout() for _ in range(3)]
+    timer = threading.Timer(0.05, pool.checkin, args=(conns[0],))
+    timer.start()
+    try:
+        assert pool.checkout() is not None
+    finally:
+        timer.join()
+
+
+def test_dead_connection_is_replaced(pool):
+    conn = pool.checkout()
+    pool.checkin(conn)
+    conn.connected = False
+    fresh = pool.checkout()
+    assert fresh is not conn
+    assert conn.closed
+    assert pool.stats()["replaced"] == 1
+
+
+def test_stale_connection_is_recycled(pool):
+    pool.recycle = 0
+    conn = pool.checkout()
+    pool.checkin(conn)
+    assert pool.checkout() is not conn
+    assert pool.stats()["replaced"] == 1
+
+
+def test_failed_connect_releases_slot(pool, monkeypatch):
+    def refuse():
+        raise RuntimeError("connection refused")
+
+    monkeypatch.setattr(pool, "_connect", refuse)
+    with pytest.raises(RuntimeError):
+        pool.checkout()
+    stats = pool.stats()
+    assert stats["open"] == 0
+    assert stats["in_use"] == 0
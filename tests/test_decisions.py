@@ -0,0 +1,156 @@
+import pytest
+
+from conftest import bigbag
+
+
+@pytest.fixture
+def logged(monkeypatch, fake_db):
+    """Record the statement count each _log_changes call starts at."""
+    calls = []
+
+    def log_changes(cur, app_ids, kind):
+        calls.append((len(fake_db.statements), list(app_ids), kind))
+
+    monkeypatch.setattr(bigbag, "_log_changes", log_changes)
+    monkeypatch.setattr(bigbag.export_worker, "wake", lambda: None)
+    return calls
+
+
+def _ajax(client, url, data):
+    return client.post(
+        url, data=data, headers={"X-Requested-With": "XMLHttpRequest"}
+    )
+
+
+def test_decide_logs_changes_right_before_commit(client, fake_db, logged):
+    fake_db.respond = lambda sql, params: (
+        [{}] if sql.startswith("UPDATE application SET") else []
+    )
+    client.login(bigbag.User("1", "employee", "Anna"))
+
+    response = _ajax(client, "/application/7/decide", {"action": "approve"})
+
+    assert response.status_code == 200
+    ((at, ids, kind),) = logged
+    assert (ids, kind) == ([7], "status")
+    assert "INSERT INTO export_outbox" in fake_db.statements[at - 1][0]
+    assert fake_db.transactions[-1] == ("commit", at)
+
+
+def test_bulk_decide_logs_changes_right_before_commit(client, fake_db, logged):
+    def respond(sql, params):
+        if "FOR UPDATE" in sql:
+            return [{"id_application": 3, "status": "awaiting"}]
+        return []
+
+    fake_db.respond = respond
+    client.login(bigbag.User("1", "employee", "Anna"))
+
+    response = _ajax(
+        client, "/applications/decide", {"action": "decline", "ids": ["3"]}
+    )
+
+    assert response.status_code == 200
+    ((at, ids, _),) = logged
+    assert ids == [3]
+    assert "INSERT INTO export_outbox" in fake_db.statements[at - 1][0]
+    assert fake_db.transactions[-1] == ("commit", at)
+
+
+def test_bulk_decide_only_moves_rows_that_change(client, fake_db, logged):
+    def respond(sql, params):
+        if "FOR UPDATE" in sql:
+            return [
+                {"id_application": 1, "status": "awaiting"},
+                {"id_application": 2, "status": "approved"},
+                {"id_application": 4, "status": "declined"},
+            ]
+        return []
+
+    fake_db.respond = respond
+    client.login(bigbag.User("1", "employee", "Anna"))
+
+    response = _ajax(
+        client,
+        "/applications/decide",
+        {"action": "approve", "ids": ["4", "1", "2", "3"]},
+    )
+
+    assert response.json == {
+        "ok": True,
+        "new_status": "approved",
+        "updated": [1, 4],
+        "unchanged": [2],
+        "not_found": [3],
+    }
+    writes = [
+        (sql, params)
+        for sql, params in fake_db.statements
+        if not sql.startswith("SELECT")
+    ]
+    (update, update_params), history, *_ = writes
+    assert update.startswith("UPDATE application SET prev_status = status")
+    assert update_params == ["approved", 1, 4, "approved"]
+    assert history[0].startswith("INSERT INTO application_status_history")
+    assert history[1] == ["1", 1, 4]
+    outbox = [p for sql, p in writes if "export_outbox" in sql]
+    assert outbox == [(1, "export", "approved"), (4, "export", "approved")]
+    assert [ids for _, ids, _ in logged] == [[1, 4]]
+    assert [t for t, _ in fake_db.transactions] == ["begin", "commit"]
+
+
+def test_bulk_decide_with_nothing_to_change_writes_nothing(
+    client, fake_db, logged
+):
+    def respond(sql, params):
+        if "FOR UPDATE" in sql:
+            return [{"id_application": 2, "status": "declined"}]
+        return []
+
+    fake_db.respond = respond
+    client.login(bigbag.User("1", "employee", "Anna"))
+
+    response = _ajax(
+        client, "/applications/decide", {"action": "decline", "ids": ["2"]}
+    )
+
+    assert response.json["updated"] == []
+    assert response.json["unchanged"] == [2]
+    assert all(sql.startswith("SELECT") for sql, _ in fake_db.statements)
+    assert logged == []
+
+
+@pytest.mark.parametrize(
+    "current, status, body",
+    [
+        (
+            [{"status": "approved"}],
+            409,
+            {"ok": False, "error": "no_change", "status": "approved"},
+        ),
+        ([], 404, {"ok": False, "error": "not_found"}),
+    ],
+)
+def test_decide_lost_update_reads_the_row_after_rollback(
+    client, fake_db, logged, current, status, body
+):
+    # another employee approved the row first: the compare-and-set
+    # UPDATE matches nothing, so nothing else may be written
+    def respond(sql, params):
+        if sql.startswith("SELECT status FROM application"):
+            return current
+        return []
+
+    fake_db.respond = respond
+    client.login(bigbag.User("1", "employee", "Anna"))
+
+    response = _ajax(client, "/application/7/decide", {"action": "approve"})
+
+    assert response.status_code == status
+    assert response.json == body
+    (update, params), (read, _) = fake_db.statements
+    assert update.endswith("AND status <> %s")
+    assert params == ["approved", 7, "approved"]
+    assert read.startswith("SELECT status FROM application")
+    assert [t for t, _ in fake_db.transactions] == ["begin", "rollback"]
+    assert logged == []
@@ -0,0 +1,69 @@
+from conftest import bigbag
+
+
+def test_export_uses_status_from_queue_time(fake_db, monkeypatch):
+    def respond(sql, params):
+        if "FROM application a" in sql:
+            return [
+                {
+                    "id_application": 3,
+                    "id_sector": 2,
+                    "status": "declined",
+                    "bag_count": 1,
+                    "free_bags": 1,
+                    "paid_bags": 0,
+                }
+            ]
+        return []
+
+    written = []
+    fake_db.respond = respond
+    monkeypatch.setattr(
+        bigbag,
+        "_write_sector_applications",
+        lambda sector_id, items: written.extend(items),
+    )
+    jobs = [
+        {
+            "id_job": 1,
+            "id_application": 3,
+            "action": "export",
+            "status": "approved",
+        }
+    ]
+
+    assert bigbag._process_export_jobs(fake_db, jobs) == {}
+    ((row, attachments),) = written
+    assert row["status"] == "approved"
+    assert attachments == []
+
+
+def test_worker_starts_with_first_request(client, monkeypatch):
+    started = []
+    monkeypatch.setattr(
+        bigbag.export_worker, "start", lambda: started.append(1)
+    )
+    monkeypatch.setitem(bigbag.app.config, "EXPORT_WORKER_ENABLED", True)
+    client.get("/")
+    assert started
+
+
+def test_export_row_fields_match_the_original_export():
+    select = bigbag._EXPORT_ROW_SQL.split("FROM")[0]
+    assert "postal_code" not in select
+    assert "e.city" not in select
+    el = bigbag._application_element_from_row(
+        {
+            "id_application": 3,
+            "street": "Tumska",
+            "first_name": "Jan",
+            "bag_count": 1,
+            "free_bags": 1,
+            "paid_bags": 0,
+        },
+        [],
+    )
+    assert el.findtext("estate/street") == "Tumska"
+    assert el.findtext("estate/postal_code") == ""
+    assert el.findtext("estate/city") == ""
+    assert el.findtext("applicant/first_name") == "Jan"
@@ -0,0 +1,70 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import bigbag
+
+
+def test_cursor_round_trip():
+    row = {
+        "creation_date": datetime(2025, 3, 4, 5, 6, 7),
+        "id_application": 42,
+    }
+    token = bigbag._encode_cursor(row)
+    assert "=" not in token
+    assert bigbag._decode_cursor(token) == (row["creation_date"], 42)
+
+
+@pytest.mark.parametrize(
+    "token", [None, "", "not-a-cursor", "W10", "WyJ4IiwxXQ"]
+)
+def test_invalid_cursor_is_ignored(token):
+    assert bigbag._decode_cursor(token) is None
+
+
+@pytest.mark.parametrize("total", [-3, 0])
+def test_page_beyond_bad_total_uses_non_negative_limit(fake_db, total):
+    cur = fake_db.cursor(dictionary=True)
+    rows, prev_cursor, next_cursor = bigbag._fetch_application_page(
+        cur,
+        "SELECT a.* FROM application a",
+        [],
+        [],
+        2,
+        25,
+        total,
+        exact_total=True,
+    )
+    assert rows == []
+    ((_, params),) = fake_db.statements
+    limit, offset = params[-2:]
+    assert limit >= 0 and offset >= 0
+
+
+@pytest.mark.parametrize("counted, limit", [(60, 10), (55, 5)])
+def test_last_page_tail_follows_the_row_count(fake_db, counted, limit):
+    # the counters claim 60 rows; the tail is cut from the real count
+    fake_db.respond = lambda sql, params: (
+        [{"cnt": counted}] if "COUNT(*)" in sql else []
+    )
+    cur = fake_db.cursor(dictionary=True)
+    bigbag._fetch_application_page(
+        cur, "SELECT a.* FROM application a", [], [], 3, 25, 60
+    )
+    (count_sql, _), (page_sql, params) = fake_db.statements
+    assert count_sql.startswith("SELECT COUNT(*) AS cnt FROM application a")
+    assert "ASC" in page_sql
+    assert params[-2:] == (limit, 0)
+
+
+def test_last_page_falls_back_to_offset_when_counters_undercount(fake_db):
+    fake_db.respond = lambda sql, params: (
+        [{"cnt": 80}] if "COUNT(*)" in sql else []
+    )
+    cur = fake_db.cursor(dictionary=True)
+    bigbag._fetch_application_page(
+        cur, "SELECT a.* FROM application a", [], [], 3, 25, 60
+    )
+    _, (page_sql, params) = fake_db.statements
+    assert "DESC" in page_sql
+    assert params[-2:] == (26, 50)
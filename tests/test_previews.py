@@ -0,0 +1,78 @@
+import pytest
+
+from conftest import bigbag
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(bigbag, "PREVIEW_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(
+        bigbag, "_preview_cache", {"bytes": None, "scanned": 0.0}
+    )
+    monkeypatch.setitem(bigbag.app.config, "PREVIEW_CACHE_MAX_BYTES", 250)
+    return tmp_path
+
+
+def _add(cache_dir, name, size):
+    (cache_dir / name).write_bytes(b"x" * size)
+    bigbag._preview_added(size)
+
+
+def test_cache_is_scanned_only_when_over_limit(cache_dir, monkeypatch):
+    scans = []
+    trim = bigbag._trim_preview_cache
+
+    def counting_trim(limit):
+        scans.append(limit)
+        return trim(limit)
+
+    monkeypatch.setattr(bigbag, "_trim_preview_cache", counting_trim)
+    _add(cache_dir, "a-160.jpg", 100)
+    _add(cache_dir, "b-160.jpg", 100)
+    assert len(scans) == 1
+    _add(cache_dir, "c-160.jpg", 100)
+    assert len(scans) == 2
+    assert bigbag._preview_cache["bytes"] <= 250
+
+
+def test_trim_removes_least_recently_used(cache_dir):
+    for i, name in enumerate(["old.jpg", "mid.jpg", "new.jpg"]):
+        path = cache_dir / name
+        path.write_bytes(b"x" * 100)
+        bigbag.os.utime(path, (1000 + i, 1000 + i))
+    assert bigbag._trim_preview_cache(250) == 200
+    assert sorted(p.name for p in cache_dir.iterdir()) == [
+        "mid.jpg",
+        "new.jpg",
+    ]
+
+
+def test_running_total_is_rescanned_when_stale(cache_dir, monkeypatch):
+    _add(cache_dir, "a-160.jpg", 100)
+    # another worker added a preview behind this process' back
+    (cache_dir / "b-160.jpg").write_bytes(b"x" * 100)
+    monkeypatch.setattr(bigbag, "PREVIEW_CACHE_RESCAN", 0)
+    _add(cache_dir, "c-160.jpg", 10)
+    assert bigbag._preview_cache["bytes"] == 210
+
+
+@pytest.mark.parametrize(
+    "width, file_type, status",
+    [
+        (160, "image/jpeg", 404),
+        (1024, "image/jpeg", 302),
+        (1024, "application/pdf", 404),
+    ],
+)
+def test_missing_preview_fallback(
+    client, fake_db, monkeypatch, width, file_type, status
+):
+    fake_db.respond = lambda sql, params: [
+        {"file_type": file_type, "content_hash": "ab" * 32, "id_citizen": 7}
+    ]
+    monkeypatch.setattr(
+        bigbag, "_attachment_preview_path", lambda row, att_id, w: None
+    )
+    client.login(bigbag.User("1", "employee", "Anna"))
+    response = client.get(f"/attachment/5/preview?w={width}")
+    assert response.status_code == status
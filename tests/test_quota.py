@@ -0,0 +1,90 @@
+import pytest
+
+from conftest import bigbag
+
+FREE = bigbag.FREE_BAGS_PER_ESTATE_YEAR
+
+
+@pytest.mark.parametrize(
+    "prior, count, expected",
+    [
+        (0, 1, (1, 0)),
+        (0, FREE + 2, (FREE, 2)),
+        (None, FREE, (FREE, 0)),
+        (FREE - 1, 3, (1, 2)),
+        (FREE, 2, (0, 2)),
+        (FREE + 5, 2, (0, 2)),
+        (0, 0, (0, 0)),
+    ],
+)
+def test_split_bags(prior, count, expected):
+    assert bigbag._split_bags(prior, count) == expected
+
+
+def _ledger(conn, bag_total):
+    def respond(sql, params):
+        if "FOR UPDATE" in sql:
+            return [(bag_total,)]
+        return []
+
+    conn.respond = respond
+    return conn.cursor()
+
+
+def test_reserve_bags_charges_the_locked_ledger_row(fake_db):
+    cur = _ledger(fake_db, 0)
+    free, paid, created = bigbag._reserve_bags(cur, 4, FREE + 2)
+    assert (free, paid) == (FREE, 2)
+    upsert, lock, charge = fake_db.statements
+    assert upsert[0].startswith("INSERT INTO estate_year_quota")
+    assert lock[1] == (4, created.year)
+    assert charge[0].startswith("UPDATE estate_year_quota")
+    assert charge[1] == (FREE + 2, 4, created.year)
+    assert created.microsecond == 0
+
+
+def test_reserve_bags_after_quota_is_used(fake_db):
+    cur = _ledger(fake_db, FREE)
+    assert bigbag._reserve_bags(cur, 4, 3)[:2] == (0, 3)
+
+
+def _rebuild_db(fake_db, applications, ledger):
+    def respond(sql, params):
+        if "GROUP BY id_estate" in sql:
+            return [
+                {"id_estate": e, "year": y, "bag_total": t}
+                for (e, y), t in applications.items()
+            ]
+        if sql.startswith("SELECT id_estate, year, bag_total"):
+            return [
+                {"id_estate": e, "year": y, "bag_total": t}
+                for (e, y), t in ledger.items()
+            ]
+        return []
+
+    fake_db.respond = respond
+
+
+def test_quota_rebuild_locks_the_ledger_before_reading(fake_db):
+    _rebuild_db(fake_db, {(1, 2025): 3}, {(1, 2025): 2})
+    result = bigbag.app.test_cli_runner().invoke(args=["quota-rebuild"])
+    assert result.exit_code == 0, result.output
+    sqls = [sql for sql, _ in fake_db.statements]
+    assert sqls[0].endswith("FOR UPDATE")
+    assert "id_estate IS NOT NULL" in sqls[1]
+    assert fake_db.transactions == [("begin", 0), ("commit", len(sqls))]
+    ((sql, params),) = [
+        s for s in fake_db.statements if s[0].startswith("INSERT")
+    ]
+    assert params == (1, 2025, 3)
+
+
+def test_quota_rebuild_verify_reports_drift_without_writing(fake_db):
+    _rebuild_db(fake_db, {(1, 2025): 3}, {(1, 2025): 2})
+    result = bigbag.app.test_cli_runner().invoke(
+        args=["quota-rebuild", "--verify"]
+    )
+    assert result.exit_code == 1
+    assert "stored=2 expected=3" in result.output
+    assert fake_db.transactions == []
+    assert not any("FOR UPDATE" in sql for sql, _ in fake_db.statements)
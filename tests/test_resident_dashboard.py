@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import bigbag
+
+PER_PAGE = 25
+# status counters, page fetch, batched allocation, attachments
+QUERY_BUDGET = 4
+# the last page also counts the rows its tail is cut from
+LAST_PAGE = 3
+
+
+def _page_rows(with_split):
+    rows = []
+    for i in range(PER_PAGE + 1):
+        rows.append(
+            {
+                "id_application": 1000 - i,
+                "id_estate": 1 + i % 3,
+                "id_citizen": 7,
+                "status": "awaiting",
+                "bag_count": 2,
+                "free_bags": 1 if with_split else None,
+                "paid_bags": 1 if with_split else None,
+                "bag_arrival_date": None,
+                "bag_depart_date": None,
+                "notes": None,
+                "creation_date": datetime(2025, 5, 1, 12, 0, i),
+                "id_sector": 1,
+                "street": "Tumska",
+                "building_number": "1",
+                "apartment_number": None,
+            }
+        )
+    return rows
+
+
+@pytest.mark.parametrize("page", [1, 2, 3])
+@pytest.mark.parametrize("with_split", [True, False])
+def test_resident_dashboard_query_budget(client, fake_db, with_split, page):
+    rows = _page_rows(with_split)
+
+    def respond(sql, params):
+        if "application_status_count" in sql:
+            return [{"status": "awaiting", "cnt": 60}]
+        if "COUNT(*)" in sql:
+            return [{"cnt": 60}]
+        if "prior_bags" in sql:
+            return [
+                {"id_application": r["id_application"], "prior_bags": 0}
+                for r in rows
+            ]
+        if "FROM attachment" in sql:
+            return [
+                {
+                    "id_attachment": 5,
+                    "id_application": rows[0]["id_application"],
+                    "file_name": "zdjecie.jpg",
+                    "file_type": "image/jpeg",
+                }
+            ]
+        if "FROM application a" in sql:
+            return rows
+        return []
+
+    fake_db.respond = respond
+    client.login(bigbag.User("7", "citizen", "Jan"))
+
+    response = client.get(f"/panel/mieszkaniec?page={page}")
+
+    assert response.status_code == 200
+    assert b"Tumska" in response.data
+    budget = QUERY_BUDGET + (page == LAST_PAGE)
+    assert len(fake_db.statements) <= budget, fake_db.statements
@@ -0,0 +1,107 @@
+import json
+import os
+
+import pytest
+
+from conftest import bigbag
+
+ENTRY = {
+    "width": 1200,
+    "height": 800,
+    "variants": {
+        "avif": [[480, "bag.abc.480.avif"], [1200, "bag.abc.1200.avif"]],
+        "webp": [],
+        "jpeg": [
+            [480, "bag.abc.480.jpg"],
+            [960, "bag.abc.960.jpg"],
+            [1200, "bag.abc.1200.jpg"],
+        ],
+    },
+}
+
+
+@pytest.fixture
+def image_dir(tmp_path, monkeypatch):
+    out = tmp_path / "img"
+    out.mkdir()
+    monkeypatch.setattr(bigbag, "RESPONSIVE_IMAGE_DIR", str(out))
+    monkeypatch.setattr(
+        bigbag, "RESPONSIVE_IMAGE_MANIFEST", str(out / "manifest.json")
+    )
+    monkeypatch.setitem(bigbag._image_manifest, "mtime", None)
+    return out
+
+
+def _write_manifest(image_dir, manifest, mtime):
+    path = image_dir / "manifest.json"
+    path.write_text(json.dumps(manifest), encoding="utf-8")
+    os.utime(path, (mtime, mtime))
+
+
+def _render(*args, **kwargs):
+    with bigbag.app.test_request_context():
+        return str(bigbag.responsive_image(*args, **kwargs))
+
+
+def test_unbuilt_image_falls_back_to_the_original(image_dir):
+    html = _render("bag.jpg", alt="Worek")
+    assert html.startswith("<img ")
+    assert 'src="/static/img/bag.jpg"' in html
+    assert 'loading="lazy"' in html
+    assert "srcset" not in html
+
+
+def test_built_image_renders_picture_with_variants(image_dir):
+    _write_manifest(image_dir, {"bag.jpg": ENTRY}, 1000)
+    html = _render("bag.jpg", alt="Worek", sizes="50vw", fetch_priority="high")
+
+    assert html.startswith("<picture><source ")
+    assert (
+        'type="image/avif" srcset="/img/bag.abc.480.avif 480w, '
+        '/img/bag.abc.1200.avif 1200w" sizes="50vw"'
+    ) in html
+    assert "image/webp" not in html
+    # <img src> is the largest JPEG at or below the default width
+    assert 'src="/img/bag.abc.960.jpg"' in html
+    assert 'width="1200" height="800"' in html
+    assert 'fetch-priority="high"' in html
+
+
+def test_manifest_is_reread_when_it_changes(image_dir):
+    _write_manifest(image_dir, {}, 1000)
+    assert _render("bag.jpg").startswith("<img ")
+    _write_manifest(image_dir, {"bag.jpg": ENTRY}, 2000)
+    assert _render("bag.jpg").startswith("<picture>")
+
+
+def test_variants_are_served_immutable(client, image_dir):
+    (image_dir / "bag.abc.480.jpg").write_bytes(b"\xff\xd8\xff")
+    response = client.get("/img/bag.abc.480.jpg")
+    assert response.status_code == 200
+    assert "immutable" in response.headers["Cache-Control"]
+    assert "public" in response.headers["Cache-Control"]
+
+
+@pytest.mark.skipif(bigbag.Image is not None, reason="Pillow is installed")
+def test_build_images_needs_pillow(image_dir):
+    result = bigbag.app.test_cli_runner().invoke(args=["build-images"])
+    assert result.exit_code != 0
+    assert "Pillow is required" in result.output
+
+
+@pytest.mark.skipif(bigbag.Image is None, reason="Pillow is not installed")
+def test_build_images_never_upscales(image_dir, monkeypatch, tmp_path):
+    source = tmp_path / "src"
+    source.mkdir()
+    bigbag.Image.new("RGB", (600, 300)).save(source / "bag.jpg")
+    monkeypatch.setattr(bigbag, "RESPONSIVE_IMAGE_SOURCE_DIR", str(source))
+
+    result = bigbag.app.test_cli_runner().invoke(args=["build-images"])
+
+    assert result.exit_code == 0, result.output
+    manifest = json.loads((image_dir / "manifest.json").read_text())
+    entry = manifest["bag.jpg"]
+    assert (entry["width"], entry["height"]) == (600, 300)
+    assert [w for w, _ in entry["variants"]["jpeg"]] == [480, 600]
+    for _, name in entry["variants"]["jpeg"]:
+        assert (image_dir / name).is_file()
@@ -0,0 +1,19 @@
+from conftest import bigbag
+
+
+def test_search_terms_split_short_words():
+    match_expr, short = bigbag._search_terms("Tumska 12a/3 Kowalski")
+    assert match_expr == "+Tumska* +12a* +Kowalski*"
+    assert short == ["3"]
+
+
+def test_search_clause_combines_fulltext_and_like():
+    sql, params = bigbag._search_clause("7 Tum", column="a.id")
+    assert sql.startswith("a.id IN (SELECT id_application")
+    assert "MATCH(document) AGAINST" in sql
+    assert "document LIKE %s" in sql
+    assert params == ["+Tum*", "%7%"]
+
+
+def test_empty_query_matches_everything():
+    assert bigbag._search_clause("  ") == ("1", [])
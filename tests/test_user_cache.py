@@ -0,0 +1,48 @@
+from conftest import bigbag
+
+
+def _user(user_id, type="citizen"):
+    return bigbag.User(user_id, type, "Jan")
+
+
+def test_get_returns_cached_user():
+    cache = bigbag.UserCache(ttl=60)
+    user = _user("1")
+    cache.put(user)
+    assert cache.get("1", "citizen") is user
+    assert cache.get(1, "citizen") is user
+
+
+def test_types_do_not_collide():
+    cache = bigbag.UserCache(ttl=60)
+    cache.put(_user("1", "citizen"))
+    assert cache.get("1", "employee") is None
+
+
+def test_expired_entry_is_dropped(monkeypatch):
+    cache = bigbag.UserCache(ttl=10)
+    now = [100.0]
+    monkeypatch.setattr(bigbag.time, "monotonic", lambda: now[0])
+    cache.put(_user("1"))
+    now[0] += 11
+    assert cache.get("1", "citizen") is None
+    assert not cache._entries
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = bigbag.UserCache(ttl=60, maxsize=2)
+    cache.put(_user("1"))
+    cache.put(_user("2"))
+    cache.get("1", "citizen")
+    cache.put(_user("3"))
+    assert cache.get("2", "citizen") is None
+    assert cache.get("1", "citizen") is not None
+    assert cache.get("3", "citizen") is not None
+
+
+def test_invalidate():
+    cache = bigbag.UserCache(ttl=60)
+    cache.put(_user("1"))
+    cache.invalidate("1", "citizen")
+    cache.invalidate("2", "citizen")
+    assert cache.get("1", "citizen") is None
@@ -0,0 +1,226 @@
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+
+import pytest
+
+from conftest import bigbag
+
+
+def _application(app_id, status="approved"):
+    el = ET.Element("application", id=str(app_id))
+    ET.SubElement(el, "status").text = status
+    citizen = ET.SubElement(el, "citizen")
+    ET.SubElement(citizen, "name").text = f"Jan {app_id}"
+    return el
+
+
+def _tree_bytes(path, elements):
+    root = ET.Element("applications")
+    root.extend(elements)
+    ET.indent(root, space="  ")
+    ET.ElementTree(root).write(path, encoding="utf-8", xml_declaration=True)
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("count", [0, 1, 3])
+def test_writer_matches_element_tree_output(tmp_path, count):
+    expected = _tree_bytes(
+        tmp_path / "expected.xml", [_application(i) for i in range(count)]
+    )
+    path = tmp_path / "sector_1.xml"
+    with bigbag.SectorXMLWriter(str(path)) as writer:
+        for i in range(count):
+            writer.write(_application(i))
+    assert path.read_bytes() == expected
+    assert writer.count == count
+    assert sorted(os.listdir(tmp_path)) == ["expected.xml", "sector_1.xml"]
+
+
+def test_writer_keeps_original_file_on_error(tmp_path):
+    path = tmp_path / "sector_1.xml"
+    path.write_text("old")
+    with (
+        pytest.raises(RuntimeError),
+        bigbag.SectorXMLWriter(str(path)) as writer,
+    ):
+        writer.write(_application(1))
+        raise RuntimeError("export failed")
+    assert path.read_text() == "old"
+    assert os.listdir(tmp_path) == ["sector_1.xml"]
+
+
+def test_journal_plan_keeps_last_upsert_per_application():
+    records = [
+        {"op": "upsert", "id": 1, "v": "a"},
+        {"op": "upsert", "id": 2, "v": "b"},
+        {"op": "upsert", "id": 1, "v": "c"},
+    ]
+    upserts, revoked = bigbag._journal_plan(records)
+    assert [r["v"] for r in upserts] == ["b", "c"]
+    assert revoked == {}
+
+
+def test_journal_plan_revoke_after_upsert_counts_once():
+    records = [
+        {"op": "upsert", "id": 1},
+        {"op": "revoke", "id": 1, "at": "2025-01-01T10:00:00"},
+        {"op": "revoke", "id": 1, "at": "2025-01-02T10:00:00"},
+        {"op": "revoke", "id": 3},
+    ]
+    upserts, revoked = bigbag._journal_plan(records)
+    assert upserts == [records[0]]
+    assert revoked == {"1": "2025-01-01T10:00:00", "3": ""}
+
+
+def test_journal_plan_upsert_clears_earlier_revoke():
+    records = [
+        {"op": "revoke", "id": 1, "at": "2025-01-01T10:00:00"},
+        {"op": "upsert", "id": 1},
+    ]
+    upserts, revoked = bigbag._journal_plan(records)
+    assert upserts == [records[1]]
+    assert revoked == {}
+
+
+@pytest.fixture
+def xml_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(bigbag, "XML_OUT_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_busy_sector_is_not_compacted_without_blocking(xml_dir):
+    with bigbag._sector_compact_lock(1), pytest.raises(BlockingIOError):
+        bigbag._compact_sector(1, blocking=False)
+
+
+def test_rebuild_keeps_revoked_applications(xml_dir, fake_db, monkeypatch):
+    # the history is read back as a Unix timestamp, written out in UTC
+    revoked_at = datetime(2025, 6, 1, 9, 30, tzinfo=timezone.utc).timestamp()
+    rows = [
+        {"id_application": 1, "status": "approved", "id_sector": 2},
+        {"id_application": 2, "status": "declined", "id_sector": 2},
+    ]
+    for row in rows:
+        row.update(bag_count=1, free_bags=1, paid_bags=0)
+
+    def respond(sql, params):
+        if "FROM application a" in sql:
+            return [dict(r) for r in rows] if params[0] == 0 else []
+        if "FROM application_status_history" in sql:
+            assert "UNIX_TIMESTAMP(MAX(changed_at))" in sql
+            return [{"id_application": 2, "at": revoked_at}]
+        return []
+
+    fake_db.respond = respond
+    monkeypatch.setattr(bigbag, "_db_pool", None)
+    sector_id, count, _ = bigbag._export_sector_file(2, 100)
+
+    assert (sector_id, count) == (2, 2)
+    path = bigbag._sector_file_path(2) + ".rebuild"
+    approved, withdrawn = list(bigbag._iter_sector_applications(path))
+    assert approved.get("revoked") is None
+    assert withdrawn.get("revoked") == "true"
+    assert withdrawn.findtext("status") == "approved"
+    assert withdrawn.findtext("revoked_at") == "2025-06-01T09:30:00"
+
+
+def test_revoked_at_is_naive_utc():
+    at = datetime(2025, 1, 15, 23, 5, tzinfo=timezone.utc)
+    assert bigbag._revoked_at(at.timestamp()) == "2025-01-15T23:05:00"
+    assert "+" not in bigbag._revoked_at()
+
+
+def test_file_lock_excludes_other_threads(xml_dir):
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with bigbag._FileLock("sector_1"):
+            held.set()
+            release.wait(5)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    assert held.wait(5)
+    try:
+        with pytest.raises(BlockingIOError):
+            with bigbag._FileLock("sector_1", blocking=False):
+                pass
+        with bigbag._FileLock("sector_2", blocking=False):
+            pass
+    finally:
+        release.set()
+        holder.join()
+    with bigbag._FileLock("sector_1", blocking=False):
+        pass
+
+
+def _group_commit(monkeypatch, fail=False):
+    """Return (commits, batches, started, release); the first write waits."""
+    started, release = threading.Event(), threading.Event()
+    batches = []
+
+    def write_journal(sector_id, records):
+        batches.append(list(records))
+        if len(batches) == 1:
+            started.set()
+            release.wait(5)
+        if fail:
+            raise OSError("disk full")
+        return list(range(len(records))), len(records)
+
+    monkeypatch.setattr(bigbag, "_write_journal", write_journal)
+    commits = bigbag._JournalGroupCommit()
+    return commits, batches, started, release
+
+
+def _append_concurrently(commits, started, release, names):
+    results = {}
+
+    def append(name):
+        try:
+            results[name] = commits.append(1, [name, name])
+        except OSError as exc:
+            results[name] = exc
+
+    threads = [threading.Thread(target=append, args=(n,)) for n in names]
+    threads[0].start()
+    assert started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    deadline = time.monotonic() + 5
+    while len(commits._queues.get(1, [])) < len(names) - 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join()
+    return results
+
+
+def test_group_commit_coalesces_waiting_appends(monkeypatch):
+    commits, batches, started, release = _group_commit(monkeypatch)
+    results = _append_concurrently(commits, started, release, "abcd")
+
+    assert batches[0] == ["a", "a"]
+    assert len(batches) == 2
+    assert sorted(batches[1]) == ["b", "b", "c", "c", "d", "d"]
+    assert results["a"] == ([0, 1], 2)
+    follower_offsets = []
+    for name in "bcd":
+        offsets, size = results[name]
+        assert size == 6
+        assert [batches[1][i] for i in offsets] == [name, name]
+        follower_offsets += offsets
+    assert sorted(follower_offsets) == list(range(6))
+
+
+def test_group_commit_hands_write_errors_to_every_waiter(monkeypatch):
+    commits, _, started, release = _group_commit(monkeypatch, fail=True)
+    results = _append_concurrently(commits, started, release, "abc")
+
+    assert all(isinstance(r, OSError) for r in results.values())
+    assert not commits._leaders
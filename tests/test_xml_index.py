@@ -0,0 +1,72 @@
+import pytest
+
+from conftest import bigbag
+
+
+@pytest.fixture
+def xml_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(bigbag, "XML_OUT_DIR", str(tmp_path))
+    monkeypatch.setattr(bigbag, "XML_INDEX_PATH", str(tmp_path / "index"))
+    return tmp_path
+
+
+def _row(app_id, sector_id):
+    return {
+        "id_application": app_id,
+        "id_sector": sector_id,
+        "status": "approved",
+        "bag_count": 1,
+        "free_bags": 1,
+        "paid_bags": 0,
+    }
+
+
+def _journal(sector_id):
+    return bigbag._read_journal(bigbag._sector_journal_path(sector_id))
+
+
+def test_export_records_sector_in_index(xml_dir):
+    bigbag._write_sector_applications(3, [(_row(10, 3), [])])
+    bigbag._write_sector_applications(0, [(_row(11, None), [])])
+    assert bigbag._xml_index_get(10) == 3
+    assert bigbag._xml_index_get(11) == 0
+
+
+def test_revocation_goes_to_the_indexed_sector(xml_dir):
+    bigbag._write_sector_applications(3, [(_row(10, 3), [])])
+    bigbag._write_sector_applications(0, [(_row(11, None), [])])
+    bigbag._rebuild_xml_index()
+    bigbag._mark_applications_revoked([10, 11, 12])
+    assert [r["op"] for r in _journal(3)] == ["upsert", "revoke"]
+    assert [r["op"] for r in _journal(0)] == ["upsert", "revoke"]
+
+
+def test_unbuilt_index_is_rebuilt_from_the_exports(xml_dir):
+    bigbag._write_sector_applications(2, [(_row(10, 2), [])])
+    bigbag._compact_sector(2)
+    # dbm may keep the index in several files
+    for path in xml_dir.glob("index*"):
+        path.unlink()
+    with pytest.raises(KeyError):
+        bigbag._xml_index_get(10)
+    bigbag._mark_applications_revoked([10])
+    assert [r["op"] for r in _journal(2)] == ["revoke"]
+    assert bigbag._xml_index_get(10) == 2
+    assert bigbag._xml_index_get(99) is None
+
+
+def test_compaction_keeps_index_entries(xml_dir):
+    bigbag._write_sector_applications(2, [(_row(10, 2), [])])
+    bigbag._rebuild_xml_index()
+    bigbag._compact_sector(2)
+    bigbag._write_sector_applications(2, [(_row(11, 2), [])])
+    assert bigbag._xml_index_get(10) == 2
+    assert bigbag._xml_index_get(11) == 2
+
+
+def test_entries_with_offsets_are_still_read(xml_dir):
+    with bigbag._open_xml_index() as index:
+        index["10"] = "4:120"
+        index["11"] = "5:"
+    assert bigbag._xml_index_get(10) == 4
+    assert bigbag._xml_index_get(11) == 5